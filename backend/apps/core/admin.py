@@ -3,7 +3,7 @@ Admin configuration for core app
 """
 
 from django.contrib import admin
-from .models import WebApp, Environment, Instance, DeploymentLog, DatabaseConfig
+from .models import WebApp, Environment, Instance, Deployment, DeploymentLog, DeploymentLogArchive, DatabaseConfig, StageEvent
 
 
 @admin.register(WebApp)
@@ -29,12 +29,50 @@ class InstanceAdmin(admin.ModelAdmin):
     readonly_fields = ['id', 'created_at', 'updated_at']
 
 
+class StageEventInline(admin.TabularInline):
+    model = StageEvent
+    extra = 0
+    can_delete = False
+    readonly_fields = ['stage', 'outcome', 'started_at', 'finished_at', 'duration_ms']
+
+
+@admin.register(Deployment)
+class DeploymentAdmin(admin.ModelAdmin):
+    list_display = ['webapp', 'revision', 'branch', 'plan', 'region', 'rollback_of', 'created_at']
+    list_filter = ['plan', 'region', 'created_at']
+    list_select_related = ['webapp']
+    search_fields = ['webapp__name', '=webapp__id']
+    raw_id_fields = ['webapp']
+    readonly_fields = ['id', 'created_at']
+    inlines = [StageEventInline]
+
+
 @admin.register(DeploymentLog)
 class DeploymentLogAdmin(admin.ModelAdmin):
-    list_display = ['id', 'instance', 'timestamp']
-    list_filter = ['timestamp']
-    search_fields = ['instance__id']
+    list_display = ['id', 'instance', 'level', 'stage', 'message', 'timestamp']
+    list_filter = ['level', 'stage', 'timestamp']
+    list_select_related = ['instance']
+    # Exact match on the instance id uses core_log_instance_ts_idx
+    search_fields = ['=instance__id']
+    raw_id_fields = ['instance']
     readonly_fields = ['id', 'timestamp']
+    date_hierarchy = 'timestamp'
+    # Skip the unfiltered COUNT(*) over the whole table on every page
+    show_full_result_count = False
+
+
+@admin.register(DeploymentLogArchive)
+class DeploymentLogArchiveAdmin(admin.ModelAdmin):
+    list_display = ['instance', 'line_count', 'size_bytes', 'compression', 'last_timestamp', 'updated_at']
+    list_filter = ['compression', 'last_timestamp']
+    list_select_related = ['instance']
+    search_fields = ['=instance__id']
+    raw_id_fields = ['instance']
+    exclude = ['data']
+    readonly_fields = [
+        'id', 'compression', 'line_count', 'size_bytes', 'first_timestamp',
+        'last_timestamp', 'last_message', 'created_at', 'updated_at',
+    ]
 
 
 @admin.register(DatabaseConfig)
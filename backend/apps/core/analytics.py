@@ -0,0 +1,71 @@
+"""
+Deployment stage timing analytics over StageEvent rows.
+
+Percentiles are computed in the database with a CUME_DIST() window per
+group, so only one row per (group, stage) comes back whatever the number
+of events in the window. A percentile is the nearest-rank value: the
+smallest duration whose cumulative distribution reaches it.
+"""
+
+from django.db import connection
+
+from .models import Deployment, StageEvent, WebApp
+
+# Groupable columns: name -> (table alias, column)
+DIMENSIONS = {
+    'region': ('d', 'region'),
+    'plan': ('d', 'plan'),
+    'template': ('w', 'template'),
+}
+
+PERCENTILES = (50, 95)
+
+
+def stage_duration_stats(since, group_by=(), stage=None):
+    """
+    Per stage (and per `group_by` dimension value): successful run count,
+    failed count, p50/p95/max duration in ms, over events finished since
+    `since`. Region and plan are those of the deployment revision.
+    """
+    qn = connection.ops.quote_name
+    columns = [f"{DIMENSIONS[name][0]}.{qn(DIMENSIONS[name][1])}" for name in group_by]
+    select_dims = "".join(f"{column} AS {qn(name)}, " for name, column in zip(group_by, columns))
+    partition_dims = "".join(f"{column}, " for column in columns)
+    group_dims = "".join(f"{qn(name)}, " for name in group_by)
+
+    where = ["e.finished_at >= %s"]
+    params = [since]
+    if stage:
+        where.append("e.stage = %s")
+        params.append(stage)
+
+    percentiles = ", ".join(
+        f"MIN(CASE WHEN outcome = 'success' AND cume >= {p / 100} THEN duration_ms END) AS p{p}_ms"
+        for p in PERCENTILES
+    )
+    sql = f"""
+        WITH events AS (
+            SELECT {select_dims}e.stage AS stage, e.outcome AS outcome,
+                   e.duration_ms AS duration_ms,
+                   CUME_DIST() OVER (
+                       PARTITION BY {partition_dims}e.stage, e.outcome
+                       ORDER BY e.duration_ms
+                   ) AS cume
+            FROM {qn(StageEvent._meta.db_table)} e
+            JOIN {qn(Deployment._meta.db_table)} d ON d.id = e.deployment_id
+            JOIN {qn(WebApp._meta.db_table)} w ON w.id = d.webapp_id
+            WHERE {' AND '.join(where)}
+        )
+        SELECT {group_dims}stage,
+               SUM(CASE WHEN outcome = 'success' THEN 1 ELSE 0 END) AS count,
+               SUM(CASE WHEN outcome = 'failed' THEN 1 ELSE 0 END) AS failed,
+               {percentiles},
+               MAX(CASE WHEN outcome = 'success' THEN duration_ms END) AS max_ms
+        FROM events
+        GROUP BY {group_dims}stage
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
@@ -0,0 +1,126 @@
+"""
+Deployment event bus for kuberns core app.
+
+deploy_instance publishes status transitions and new log lines on a
+per-webapp channel; the /webapps/{id}/events/ stream subscribes to it.
+Redis pub/sub is used in production, InMemoryBroker in tests and local runs
+where the task executes in the same process (CELERY_TASK_ALWAYS_EAGER).
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from contextlib import asynccontextmanager
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def channel_name(webapp_id):
+    return f"kuberns:deployments:{webapp_id}"
+
+
+class RedisBroker:
+    def __init__(self, url):
+        self.url = url
+        self._client = None
+
+    def publish(self, channel, message):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url)
+        self._client.publish(channel, message)
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        client = aioredis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(channel)
+
+        async def receive(timeout):
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+            return message["data"] if message else None
+
+        try:
+            yield receive
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
+            await client.aclose()
+
+
+class InMemoryBroker:
+    """
+    Process-local stand-in for Redis pub/sub. Publishing is thread-safe so
+    eager Celery tasks running in a worker thread can feed async subscribers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        entry = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(entry)
+
+        async def receive(timeout):
+            try:
+                return await asyncio.wait_for(entry[1].get(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        try:
+            yield receive
+        finally:
+            with self._lock:
+                self._subscribers[channel].remove(entry)
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        if settings.DEPLOYMENT_EVENTS_BACKEND == 'memory':
+            _broker = InMemoryBroker()
+        else:
+            _broker = RedisBroker(settings.DEPLOYMENT_EVENTS_URL)
+    return _broker
+
+
+def publish_event(webapp_id, event_type, data):
+    """
+    Best effort: a broker outage must never fail a deployment.
+    """
+    message = json.dumps({"type": event_type, "data": data}, default=str)
+    try:
+        get_broker().publish(channel_name(webapp_id), message)
+    except redis.RedisError:
+        logger.warning("Could not publish %s event for webapp %s", event_type, webapp_id, exc_info=True)
+
+
+@asynccontextmanager
+async def subscribe(webapp_id):
+    """
+    Subscribe to a webapp's events. The yielded coroutine function returns
+    the next decoded event, or None if nothing arrived within `timeout`
+    seconds.
+    """
+    async with get_broker().subscribe(channel_name(webapp_id)) as receive:
+        async def next_event(timeout=15):
+            message = await receive(timeout)
+            return json.loads(message) if message is not None else None
+
+        yield next_event
@@ -0,0 +1,149 @@
+"""
+Plain-function serializers for the read-heavy responses.
+
+DRF serializers build a tree of Field objects per response and run every
+value through them; for read-only output that is most of the request's
+CPU. These functions produce the same JSON as WebAppListSerializer and
+DeploymentLogSerializer (bench_serializers checks that they match) from
+.values() rows or model objects. Timestamps still go through one DRF
+DateTimeField per batch, with the current timezone resolved once, so they
+are formatted exactly as before.
+"""
+
+from django.conf import settings
+from django.db.models import OuterRef
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import log_summary_annotations
+
+
+def datetime_formatter():
+    """
+    DateTimeField.to_representation for the current timezone, None-safe.
+    """
+    field = serializers.DateTimeField(
+        default_timezone=timezone.get_current_timezone() if settings.USE_TZ else None
+    )
+
+    def format_datetime(value):
+        return None if value is None else field.to_representation(value)
+
+    return format_datetime
+
+
+def _str(value):
+    return None if value is None else str(value)
+
+
+WEBAPP_FIELDS = [
+    'id', 'name', 'region', 'template', 'plan',
+    'organization', 'repo', 'branch',
+    'database_enabled', 'database_type',
+    'created_at', 'updated_at',
+]
+ENVIRONMENT_FIELDS = ['id', 'port', 'environment_variables', 'created_at', 'updated_at']
+INSTANCE_FIELDS = ['id', 'cpu', 'ram', 'storage', 'status', 'public_ip', 'created_at', 'updated_at']
+DATABASE_CONFIG_FIELDS = ['id', 'engine', 'name', 'username', 'created_at']
+
+
+def webapp_list_values(queryset):
+    """
+    One flat row per webapp with its environment, instance (and log
+    summary, as Instance.objects.with_log_summary()) and database config,
+    all from a single query.
+    """
+    return queryset.annotate(
+        **log_summary_annotations(OuterRef('environment__instance'))
+    ).values(
+        *WEBAPP_FIELDS,
+        'log_count', 'latest_log',
+        *(f'environment__{field}' for field in ENVIRONMENT_FIELDS),
+        *(f'environment__instance__{field}' for field in INSTANCE_FIELDS),
+        *(f'database_config__{field}' for field in DATABASE_CONFIG_FIELDS),
+    )
+
+
+def webapp_list_rows(rows):
+    """
+    WebAppListSerializer output for webapp_list_values() rows.
+    """
+    dt = datetime_formatter()
+    return [webapp_list_row(row, dt) for row in rows]
+
+
+def webapp_list_row(row, dt):
+    """
+    `dt` is a datetime_formatter().
+    """
+    instance = None
+    if row['environment__instance__id'] is not None:
+        instance = {
+            'id': str(row['environment__instance__id']),
+            'cpu': row['environment__instance__cpu'],
+            'ram': row['environment__instance__ram'],
+            'storage': row['environment__instance__storage'],
+            'status': row['environment__instance__status'],
+            'public_ip': row['environment__instance__public_ip'],
+            'created_at': dt(row['environment__instance__created_at']),
+            'updated_at': dt(row['environment__instance__updated_at']),
+            'log_count': row['log_count'],
+            'latest_log': _str(row['latest_log']),
+        }
+
+    environment = None
+    if row['environment__id'] is not None:
+        environment = {
+            'id': str(row['environment__id']),
+            'port': row['environment__port'],
+            'environment_variables': row['environment__environment_variables'],
+            'created_at': dt(row['environment__created_at']),
+            'updated_at': dt(row['environment__updated_at']),
+            'instance': instance,
+        }
+
+    database_config = None
+    if row['database_config__id'] is not None:
+        database_config = {
+            'id': str(row['database_config__id']),
+            'engine': row['database_config__engine'],
+            'name': row['database_config__name'],
+            'username': row['database_config__username'],
+            'created_at': dt(row['database_config__created_at']),
+        }
+
+    return {
+        'id': str(row['id']),
+        'name': row['name'],
+        'region': row['region'],
+        'template': row['template'],
+        'plan': row['plan'],
+        'organization': row['organization'],
+        'repo': row['repo'],
+        'branch': row['branch'],
+        'database_enabled': row['database_enabled'],
+        'database_type': row['database_type'],
+        'created_at': dt(row['created_at']),
+        'updated_at': dt(row['updated_at']),
+        'environment': environment,
+        'database_config': database_config,
+    }
+
+
+def log_row(log, dt=None):
+    """
+    DeploymentLogSerializer output for a DeploymentLog (live or archived).
+    """
+    dt = dt or datetime_formatter()
+    return {
+        'id': str(log.id),
+        'level': log.level,
+        'stage': log.stage,
+        'message': log.message,
+        'timestamp': dt(log.timestamp),
+    }
+
+
+def log_rows(logs):
+    dt = datetime_formatter()
+    return [log_row(log, dt) for log in logs]
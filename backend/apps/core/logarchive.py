@@ -0,0 +1,241 @@
+"""
+Deployment log compaction, retention and archive-aware reads.
+
+Once a deployment has finished, its DeploymentLog rows are folded into a
+single compressed DeploymentLogArchive per instance. Archived lines keep
+their original id and timestamp, so log cursors stay valid across
+compaction; readers go through instance_logs()/instance_logs_before()/
+recent_logs(), which merge
+the archive with whatever live rows the instance still has.
+"""
+
+import gzip
+import json
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Instance, DeploymentLog, DeploymentLogArchive
+from .pagination import decode_log_cursor, logs_after, logs_before
+from .plans import PLAN_CATALOG, log_retention
+
+
+COMPACTABLE_STATUSES = ('active', 'failed')
+
+
+def _codec(compression):
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress
+    return gzip.compress, gzip.decompress
+
+
+def _sort_key(log):
+    return (log.timestamp, log.id)
+
+
+def encode_lines(logs, compression):
+    compress, _ = _codec(compression)
+    rows = [
+        [str(log.id), log.timestamp.isoformat(), log.level, log.stage, log.message]
+        for log in logs
+    ]
+    return compress(json.dumps(rows, separators=(',', ':')).encode())
+
+
+def decode_lines(archive, instance=None):
+    """
+    The archived lines as unsaved DeploymentLog objects, oldest first.
+    """
+    _, decompress = _codec(archive.compression)
+    rows = json.loads(decompress(bytes(archive.data)))
+    instance = instance or archive.instance
+    return [
+        DeploymentLog(
+            id=uuid.UUID(log_id), instance=instance, timestamp=parse_datetime(timestamp),
+            level=level, stage=stage, message=message,
+        )
+        for log_id, timestamp, level, stage, message in rows
+    ]
+
+
+def get_archive(instance):
+    """
+    The instance's archive or None; free when loaded with
+    select_related('log_archive').
+    """
+    try:
+        return instance.log_archive
+    except DeploymentLogArchive.DoesNotExist:
+        return None
+
+
+def archived_logs(instance):
+    archive = get_archive(instance)
+    return decode_lines(archive, instance) if archive else []
+
+
+def instance_logs(instance, after=None, limit=None, filters=None):
+    """
+    Lines of an instance after the optional (timestamp, id) cursor, oldest
+    first, from the archive and the live rows. `filters` maps a field
+    (level, stage) to the accepted values.
+    """
+    filters = filters or {}
+    live = logs_after(
+        instance.logs.filter(**{f"{field}__in": values for field, values in filters.items()}),
+        after,
+    )
+    if limit:
+        live = live[:limit]
+    logs = list(live)
+
+    archived = archived_logs(instance)
+    if archived:
+        if after:
+            position = decode_log_cursor(after)
+            archived = [log for log in archived if _sort_key(log) > position]
+        archived = [
+            log for log in archived
+            if all(getattr(log, field) in values for field, values in filters.items())
+        ]
+        logs = sorted(archived + logs, key=_sort_key)
+        if limit:
+            logs = logs[:limit]
+    return logs
+
+
+def instance_logs_before(instance, before=None, limit=None, filters=None):
+    """
+    Lines of an instance before the optional (timestamp, id) cursor, newest
+    first; instance_logs() in the other direction.
+    """
+    filters = filters or {}
+    live = logs_before(
+        instance.logs.filter(**{f"{field}__in": values for field, values in filters.items()}),
+        before,
+    )
+    if limit:
+        live = live[:limit]
+    logs = list(live)
+
+    archived = archived_logs(instance)
+    if archived:
+        if before:
+            position = decode_log_cursor(before)
+            archived = [log for log in archived if _sort_key(log) < position]
+        archived = [
+            log for log in archived
+            if all(getattr(log, field) in values for field, values in filters.items())
+        ]
+        logs = sorted(archived + logs, key=_sort_key, reverse=True)
+        if limit:
+            logs = logs[:limit]
+    return logs
+
+
+def recent_logs(instance, count):
+    """
+    The newest `count` lines of an instance, newest first. The archive is
+    only read when the live rows do not fill the window.
+    """
+    logs = list(instance.logs.order_by('-timestamp', '-id')[:count])
+    if len(logs) < count:
+        archived = archived_logs(instance)
+        logs = sorted(archived + logs, key=_sort_key, reverse=True)[:count]
+    return logs
+
+
+def compact_instance(instance_id):
+    """
+    Move the live log rows of one finished instance into its archive,
+    keeping at most the plan's max_lines newest lines. Returns the number
+    of rows compacted.
+    """
+    with transaction.atomic():
+        instance = (
+            Instance.objects
+            .select_for_update(of=('self',))
+            .select_related('environment__webapp')
+            .filter(pk=instance_id, status__in=COMPACTABLE_STATUSES)
+            .first()
+        )
+        if instance is None:
+            return 0
+
+        live = list(instance.logs.order_by('timestamp', 'id'))
+        if not live:
+            return 0
+
+        archive = DeploymentLogArchive.objects.filter(instance=instance).first()
+        if archive is None:
+            archive = DeploymentLogArchive(
+                instance=instance,
+                compression=settings.DEPLOYMENT_LOG_ARCHIVE_COMPRESSION,
+            )
+            lines = live
+        else:
+            lines = sorted(decode_lines(archive, instance) + live, key=_sort_key)
+
+        lines = lines[-log_retention(instance.environment.webapp.plan)['max_lines']:]
+        archive.data = encode_lines(lines, archive.compression)
+        archive.line_count = len(lines)
+        archive.size_bytes = len(archive.data)
+        archive.first_timestamp = lines[0].timestamp
+        archive.last_timestamp = lines[-1].timestamp
+        archive.last_message = lines[-1].message
+        archive.save()
+
+        DeploymentLog.objects.filter(pk__in=[log.pk for log in live]).delete()
+        return len(live)
+
+
+def compactable_instances(now=None):
+    """
+    Finished instances, idle for DEPLOYMENT_LOG_COMPACT_AFTER seconds,
+    that still have live log rows.
+    """
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.DEPLOYMENT_LOG_COMPACT_AFTER)
+    return Instance.objects.filter(
+        Exists(DeploymentLog.objects.filter(instance=OuterRef('pk'))),
+        status__in=COMPACTABLE_STATUSES,
+        updated_at__lt=cutoff,
+    )
+
+
+def compact_logs(batch_size=None, now=None):
+    batch_size = batch_size or settings.DEPLOYMENT_LOG_COMPACT_BATCH
+    instances = compacted = 0
+    while True:
+        batch = list(compactable_instances(now).values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            break
+        for instance_id in batch:
+            compacted += compact_instance(instance_id)
+        instances += len(batch)
+    return {"instances": instances, "lines": compacted}
+
+
+def enforce_retention(now=None):
+    """
+    Delete archives and live rows older than each plan's retention window.
+    """
+    now = now or timezone.now()
+    deleted = {}
+    for plan in PLAN_CATALOG:
+        cutoff = now - timedelta(days=log_retention(plan)['days'])
+        archives, _ = DeploymentLogArchive.objects.filter(
+            instance__environment__webapp__plan=plan,
+            last_timestamp__lt=cutoff,
+        ).delete()
+        lines, _ = DeploymentLog.objects.filter(
+            instance__environment__webapp__plan=plan,
+            timestamp__lt=cutoff,
+        ).delete()
+        deleted[plan] = {"archives": archives, "lines": lines}
+    return deleted
@@ -0,0 +1,67 @@
+"""
+Buffered deployment log writer
+"""
+
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .events import publish_event
+from .models import DeploymentLog
+from .pagination import encode_log_cursor
+from .fastpath import log_row
+from .status_cache import write_status
+
+
+class DeploymentLogSink:
+    """
+    Collects log records for one instance (tagged with the pipeline `stage`
+    that emits them) and writes them with a single
+    bulk_create once `max_lines` are buffered, once the oldest buffered line
+    is `max_delay` seconds old, or when flush() is called explicitly
+    (the deployment task flushes before every status transition).
+    """
+
+    def __init__(self, instance, stage='', max_lines=None, max_delay=None):
+        self.instance = instance
+        self.stage = stage
+        self.max_lines = max_lines or settings.DEPLOYMENT_LOG_BUFFER_SIZE
+        self.max_delay = settings.DEPLOYMENT_LOG_FLUSH_INTERVAL if max_delay is None else max_delay
+        self._buffer = []
+        self._oldest = None
+
+    def add(self, message, level='info'):
+        self._buffer.append(DeploymentLog(
+            instance=self.instance,
+            level=level,
+            stage=self.stage,
+            message=message,
+            timestamp=timezone.now(),
+        ))
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+        if len(self._buffer) >= self.max_lines or time.monotonic() - self._oldest >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+
+        logs, self._buffer, self._oldest = self._buffer, [], None
+        DeploymentLog.objects.bulk_create(logs)
+        write_status(self.instance, logs)
+
+        webapp_id = self.instance.environment.webapp_id
+        for log in logs:
+            publish_event(webapp_id, "log", {
+                **log_row(log),
+                "cursor": encode_log_cursor(log),
+            })
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
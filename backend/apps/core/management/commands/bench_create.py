@@ -0,0 +1,124 @@
+"""
+Compare creating N apps with N POST /webapps/ against one POST /webapps/bulk/.
+
+    python manage.py bench_create --apps 200 --rounds 3
+
+Requests go through Django's test client, so each single create commits on
+its own as it does in production. Celery dispatch is replaced by a counter
+(no broker is needed); `dispatches` is the number of apply_async calls, one
+per app for single creates and one group for the bulk request. The created
+apps are deleted after every round.
+"""
+
+import json
+import random
+import statistics
+import time
+import uuid
+from unittest import mock
+
+from celery import group
+from celery.canvas import Signature
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from apps.core.models import WebApp
+from apps.core.status_cache import delete_status
+
+
+def app_payload(run_id, index):
+    database = random.random() < 0.5
+    return {
+        "name": f"bench-create-{run_id}-{index}",
+        "region": random.choice(WebApp.REGION_CHOICES)[0],
+        "template": random.choice(WebApp.FRAMEWORK_CHOICES)[0],
+        "plan": random.choice(WebApp.PLAN_CHOICES)[0],
+        "repo": "bench/repo",
+        "branch": "main",
+        "database_enabled": database,
+        "database_type": "postgresql" if database else "none",
+        "environment": {"port": 3000, "environment_variables": {"DEBUG": "false"}},
+        **({"database_config": {"name": f"db_{index}"}} if database else {}),
+    }
+
+
+class Command(BaseCommand):
+    help = "Report wall time, queries and Celery dispatches of N single creates vs one bulk create"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apps', type=int, default=100, help="Apps per round")
+        parser.add_argument('--rounds', type=int, default=3)
+        parser.add_argument('--output', help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        self.dispatches = 0
+        results = {"single": [], "bulk": []}
+
+        with mock.patch.object(Signature, 'apply_async', self.dispatch), \
+                mock.patch.object(group, 'apply_async', self.dispatch):
+            for _ in range(options['rounds']):
+                for name, create in (("single", self.single), ("bulk", self.bulk)):
+                    run_id = uuid.uuid4().hex[:8]
+                    payloads = [app_payload(run_id, i) for i in range(options['apps'])]
+                    try:
+                        results[name].append(self.measure(create, payloads))
+                    finally:
+                        self.cleanup(run_id)
+
+        report = {
+            "vendor": connection.vendor,
+            "apps": options['apps'],
+            "rounds": options['rounds'],
+            **{name: self.summarize(rounds) for name, rounds in results.items()},
+        }
+        report["speedup"] = round(report["single"]["median_ms"] / report["bulk"]["median_ms"], 2)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    def dispatch(self, *args, **kwargs):
+        self.dispatches += 1
+
+    def single(self, client, payloads):
+        for payload in payloads:
+            yield client.post('/api/webapps/', payload, content_type='application/json')
+
+    def bulk(self, client, payloads):
+        yield client.post('/api/webapps/bulk/', payloads, content_type='application/json')
+
+    def measure(self, create, payloads):
+        client = Client()
+        self.dispatches = 0
+        queries = []
+        # CaptureQueriesContext keeps only the last 9000 queries.
+        started = time.perf_counter()
+        with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+            for response in create(client, payloads):
+                if response.status_code != 201:
+                    raise CommandError(f"{response.status_code}: {response.content.decode()[:500]}")
+        return {
+            "apps": len(payloads),
+            "ms": (time.perf_counter() - started) * 1000,
+            "queries": len(queries),
+            "dispatches": self.dispatches,
+        }
+
+    def summarize(self, rounds):
+        median = statistics.median(r["ms"] for r in rounds)
+        return {
+            "median_ms": round(median, 2),
+            "ms_per_app": round(median / rounds[-1]["apps"], 3),
+            "queries": rounds[-1]["queries"],
+            "dispatches": rounds[-1]["dispatches"],
+        }
+
+    def cleanup(self, run_id):
+        webapps = WebApp.objects.filter(name__startswith=f"bench-create-{run_id}-")
+        ids = list(webapps.values_list('pk', flat=True))
+        webapps.delete()
+        for webapp_id in ids:
+            delete_status(webapp_id)
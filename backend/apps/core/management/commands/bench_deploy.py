@@ -0,0 +1,440 @@
+"""
+Load-test the deployment pipeline together with the dashboard polling endpoints.
+
+    python manage.py bench_deploy --apps 200 --workers 8 --pollers 16 --time-scale 0.01 --output deploy.json
+
+WebApps are created through WebAppCreateSerializer (the bulk path) and
+deployed by an in-process stand-in for the Celery workers that honours each
+stage's countdown, scaled by --time-scale. Meanwhile simulated dashboards
+poll /status/, /progress/ and /logs/ with Django's test client. The seeded
+apps are deleted afterwards unless --keep is given.
+
+--hold-workers makes each worker sleep through the countdowns of the
+deployment it picked up, so a worker slot is held for the whole pipeline
+as with the time.sleep tasks; compare throughput_per_s with and without.
+
+--log-buffer 1 writes every log line with its own INSERT, as the
+deployment task did before DeploymentLogSink; compare it with the default
+(DEPLOYMENT_LOG_BUFFER_SIZE) through queries_per_deployment and the stage
+latencies.
+
+With --ec2-boot-polls N the ec2 stage runs AsyncEC2Provisioner against
+FakeEC2Client, whose instances get their IP on the Nth describe call, so
+the wait_for_public_ip countdown tasks are part of the run.
+
+Database connections follow the production lifecycle: workers close obsolete
+connections around every stage as Celery's Django fixup does, pollers around
+every request as Django's request signals do. The report counts connections
+opened per role, so runs with --conn-max-age 0 and 600 show the churn that
+persistent connections save.
+
+Workers and pollers use their own database connections, so point it at
+PostgreSQL for meaningful numbers (SQLite serialises writers). Set
+DEPLOYMENT_EVENTS_BACKEND=memory to run without Redis.
+"""
+
+import itertools
+import json
+import queue
+import random
+import resource
+import statistics
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, defaultdict
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connection, connections
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from apps.core import provisioning
+from apps.core.models import WebApp
+from apps.core.provisioning import AsyncEC2Provisioner, FakeEC2Client
+from apps.core.serializers import WebAppCreateSerializer
+from apps.core.status_cache import delete_status
+from apps.core.tasks import DEPLOYMENT_STAGES, run_deployment_stage, wait_for_public_ip
+
+from .bench_queries import percentile
+
+
+FINISHED = ('success', 'failed', 'skipped')
+
+IP_POLL = 'ec2_ip_poll'
+
+
+def summarize(samples):
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "p50_ms": round(statistics.median(samples), 2),
+        "p95_ms": round(percentile(samples, 95), 2),
+        "p99_ms": round(percentile(samples, 99), 2),
+        "max_ms": round(max(samples), 2),
+    }
+
+
+class ConnectionCounter:
+    """
+    connection_created receiver counting new connections by the role prefix
+    of the opening thread's name ('worker', 'poller').
+    """
+
+    def __init__(self):
+        self.opened = Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, sender, connection, **kwargs):
+        with self._lock:
+            self.opened[threading.current_thread().name.split('-')[0]] += 1
+
+
+class StageScheduler:
+    """
+    Runs run_deployment_stage and wait_for_public_ip calls on worker
+    threads, each no earlier than its countdown. Installed as both tasks'
+    apply_async, so the pipeline schedules its own next stages and IP
+    polls exactly as it does on Celery.
+
+    With `hold`, a worker keeps the follow-up tasks its task schedules and
+    sleeps through their countdowns itself, holding its slot for the whole
+    deployment as the time.sleep pipeline did.
+    """
+
+    def __init__(self, workers, hold=False):
+        self.workers = workers
+        self.hold = hold
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.started = {}
+        self.finished = {}
+        self.stage_ms = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.errors = Counter()
+
+    def apply_async(self, args=(), kwargs=None, countdown=None, **options):
+        self._put(run_deployment_stage, args, countdown)
+
+    def apply_wait_async(self, args=(), kwargs=None, countdown=None, **options):
+        self._put(wait_for_public_ip, args, countdown)
+
+    def _put(self, task, args, countdown):
+        entry = (time.monotonic() + (countdown or 0), next(self._seq), (task, tuple(args)))
+        held = getattr(self._local, 'held', None)
+        if self.hold and held is not None:
+            held.append(entry)
+        else:
+            self._queue.put(entry)
+
+    def submit(self, instance_id, countdown=0):
+        self.started[instance_id] = time.monotonic() + countdown
+        self.apply_async((instance_id, DEPLOYMENT_STAGES[0][0]), countdown=countdown)
+
+    def done(self):
+        return len(self.finished) >= len(self.started)
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self._work, name=f"worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def stop(self, threads):
+        for _ in threads:
+            self._queue.put((0, next(self._seq), None))
+        for thread in threads:
+            thread.join()
+
+    def _work(self):
+        self._local.held = []
+        try:
+            while True:
+                entry = self._local.held.pop(0) if self._local.held else self._queue.get()
+                due, _, item = entry
+                if item is None:
+                    return
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self._run(*item)
+        finally:
+            connection.close()
+
+    def _run(self, task, args):
+        instance_id = args[0]
+        stage = args[1] if task is run_deployment_stage else IP_POLL
+        started = time.perf_counter()
+        close_old_connections()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                result = task(*args)
+        except Exception as e:
+            result = {"status": "failed"}
+            self.errors[type(e).__name__] += 1
+        finally:
+            close_old_connections()
+        elapsed = (time.perf_counter() - started) * 1000
+
+        with self._lock:
+            self.stage_ms[stage].append(elapsed)
+            self.queries[instance_id] += len(queries)
+            if result["status"] in FINISHED:
+                self.finished[instance_id] = (result["status"], time.monotonic())
+
+
+class Poller:
+    """
+    One simulated deployment dashboard: repeatedly picks a deploying app and
+    polls it the way the frontend does (conditional /progress/ with a
+    cursor), plus the /status/ and /logs/ endpoints.
+    """
+
+    def __init__(self, webapp_ids, interval):
+        self.webapp_ids = webapp_ids
+        self.interval = interval
+        self.timings = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self._cursors = {}
+        self._etags = {}
+
+    def _get(self, client, name, path, **headers):
+        started = time.perf_counter()
+        # The test client skips close_old_connections, so run it as a server would.
+        close_old_connections()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(path, **headers)
+        close_old_connections()
+        self.timings[name].append((time.perf_counter() - started) * 1000)
+        self.queries[name].append(len(queries))
+        self.statuses[name][response.status_code] += 1
+        return response
+
+    def run(self, stop):
+        client = Client()
+        try:
+            while not stop.is_set():
+                webapp_id = random.choice(self.webapp_ids)
+                cursor = self._cursors.get(webapp_id)
+                suffix = f"?after={cursor}" if cursor else ""
+
+                self._get(client, "status", f"/api/webapps/{webapp_id}/status/")
+
+                headers = {}
+                if webapp_id in self._etags:
+                    headers["HTTP_IF_NONE_MATCH"] = self._etags[webapp_id]
+                response = self._get(client, "progress", f"/api/webapps/{webapp_id}/progress/{suffix}", **headers)
+                if response.status_code == 200:
+                    self._etags[webapp_id] = response["ETag"]
+                    self._cursors[webapp_id] = response.json()["cursor"]
+
+                self._get(client, "logs", f"/api/webapps/{webapp_id}/logs/{suffix}")
+
+                if self.interval:
+                    time.sleep(self.interval)
+        finally:
+            connection.close()
+
+
+class Command(BaseCommand):
+    help = "Run concurrent deployments under polling load and report throughput, latency, queries and memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apps', type=int, default=100, help="Deployments to run")
+        parser.add_argument('--workers', type=int, default=4, help="Concurrent stage workers")
+        parser.add_argument('--pollers', type=int, default=8, help="Concurrent simulated dashboards")
+        parser.add_argument('--poll-interval', type=float, default=0.05, help="Seconds between a poller's rounds")
+        parser.add_argument('--time-scale', type=float, default=0.01,
+                            help="Multiplier for DEPLOYMENT_STAGE_DELAYS (0 runs stages back to back)")
+        parser.add_argument('--rate', type=float, default=0,
+                            help="Deployments started per second (0 starts them all at once)")
+        parser.add_argument('--hold-workers', action='store_true',
+                            help="Workers sleep through countdowns instead of re-queueing (blocking baseline)")
+        parser.add_argument('--log-buffer', type=int,
+                            help="DEPLOYMENT_LOG_BUFFER_SIZE for the run (1: one INSERT per line)")
+        parser.add_argument('--ec2-boot-polls', type=int, default=0,
+                            help="Provision through FakeEC2Client, booting after this many IP polls (0: MockProvisioner)")
+        parser.add_argument('--ec2-latency', type=float, default=0.05, help="FakeEC2Client seconds per call")
+        parser.add_argument('--conn-max-age', type=int,
+                            help="CONN_MAX_AGE for the run (default: the DB_CONN_MAX_AGE setting)")
+        parser.add_argument('--trace-memory', action='store_true',
+                            help="Also report the tracemalloc peak (slows the run down)")
+        parser.add_argument('--keep', action='store_true', help="Keep the seeded apps")
+        parser.add_argument('--output', help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        if options['trace_memory']:
+            tracemalloc.start()
+
+        run_id = uuid.uuid4().hex[:8]
+        seed_started = time.perf_counter()
+        with CaptureQueriesContext(connection) as seed_queries:
+            webapps = self.seed(run_id, options['apps'])
+        seed_ms = (time.perf_counter() - seed_started) * 1000
+
+        # Thread connections are created from these settings on first use.
+        db_settings = connections.settings[DEFAULT_DB_ALIAS]
+        default_conn_max_age = db_settings['CONN_MAX_AGE']
+        if options['conn_max_age'] is not None:
+            db_settings['CONN_MAX_AGE'] = options['conn_max_age']
+        conn_max_age = db_settings['CONN_MAX_AGE']
+        counter = ConnectionCounter()
+        connection_created.connect(counter)
+        try:
+            with override_settings(
+                DEPLOYMENT_TIME_SCALE=options['time_scale'],
+                DEPLOYMENT_LOG_BUFFER_SIZE=options['log_buffer'] or settings.DEPLOYMENT_LOG_BUFFER_SIZE,
+                EC2_IP_POLL_INTERVAL=settings.EC2_IP_POLL_INTERVAL * options['time_scale'],
+            ), mock.patch.object(provisioning, '_provisioner', self.provisioner(options)):
+                deployments, endpoints = self.run(webapps, options)
+        finally:
+            connection_created.disconnect(counter)
+            db_settings['CONN_MAX_AGE'] = default_conn_max_age
+            if not options['keep']:
+                self.cleanup(webapps)
+
+        deployments["connections_opened"] = {
+            "workers": counter.opened["worker"],
+            "pollers": counter.opened["poller"],
+            "per_deployment": round(counter.opened["worker"] / max(len(webapps), 1), 2),
+        }
+
+        memory = {"max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+        if options['trace_memory']:
+            memory["tracemalloc_peak_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024)
+            tracemalloc.stop()
+
+        report = {
+            "vendor": connection.vendor,
+            "config": {
+                name: options[name]
+                for name in (
+                    'apps', 'workers', 'pollers', 'poll_interval', 'time_scale', 'rate', 'ec2_boot_polls',
+                    'hold_workers',
+                )
+            },
+            "conn_max_age": conn_max_age,
+            "log_buffer": options['log_buffer'] or settings.DEPLOYMENT_LOG_BUFFER_SIZE,
+            "seed": {"ms": round(seed_ms, 2), "queries": len(seed_queries)},
+            "deployments": deployments,
+            "endpoints": endpoints,
+            "memory": memory,
+        }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    def provisioner(self, options):
+        if not options['ec2_boot_polls']:
+            return None
+        # Per-invocation cap only: the shared slots need the scheduler's Redis.
+        return AsyncEC2Provisioner(client_factory=lambda region: FakeEC2Client(
+            region, latency=options['ec2_latency'], boot_polls=options['ec2_boot_polls'],
+        ), shared_slots=False)
+
+    def seed(self, run_id, app_count):
+        serializer = WebAppCreateSerializer(data=[
+            {
+                "name": f"bench-deploy-{run_id}-{i}",
+                "region": random.choice(WebApp.REGION_CHOICES)[0],
+                "template": random.choice(WebApp.FRAMEWORK_CHOICES)[0],
+                "plan": random.choice(WebApp.PLAN_CHOICES)[0],
+                "repo": "bench/repo",
+                "branch": "main",
+                "database_enabled": False,
+                "database_type": "none",
+                "environment": {"port": 3000, "environment_variables": {}},
+            }
+            for i in range(app_count)
+        ], many=True)
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def run(self, webapps, options):
+        scheduler = StageScheduler(options['workers'], hold=options['hold_workers'])
+        pollers = [
+            Poller([str(webapp.id) for webapp in webapps], options['poll_interval'])
+            for _ in range(options['pollers'])
+        ]
+        stop = threading.Event()
+
+        with mock.patch.object(run_deployment_stage, 'apply_async', scheduler.apply_async), \
+                mock.patch.object(wait_for_public_ip, 'apply_async', scheduler.apply_wait_async):
+            started = time.monotonic()
+            for i, webapp in enumerate(webapps):
+                countdown = i / options['rate'] if options['rate'] else 0
+                scheduler.submit(str(webapp.environment.instance.id), countdown)
+
+            poller_threads = [
+                threading.Thread(target=poller.run, args=(stop,), name=f"poller-{i}", daemon=True)
+                for i, poller in enumerate(pollers)
+            ]
+            for thread in poller_threads:
+                thread.start()
+            worker_threads = scheduler.run()
+
+            while not scheduler.done():
+                time.sleep(0.05)
+            wall = time.monotonic() - started
+
+            stop.set()
+            for thread in poller_threads:
+                thread.join()
+            scheduler.stop(worker_threads)
+
+        outcomes = Counter(status for status, _ in scheduler.finished.values())
+        latencies = [
+            (finished - scheduler.started[instance_id]) * 1000
+            for instance_id, (_, finished) in scheduler.finished.items()
+        ]
+        queries = list(scheduler.queries.values())
+        deployments = {
+            "count": len(scheduler.started),
+            "outcomes": dict(outcomes),
+            "errors": dict(scheduler.errors),
+            "wall_s": round(wall, 3),
+            "throughput_per_s": round(len(scheduler.finished) / wall, 2) if wall else None,
+            "latency": summarize(latencies),
+            "stages": {
+                stage: summarize(scheduler.stage_ms[stage])
+                for stage in [*(stage for stage, _ in DEPLOYMENT_STAGES), IP_POLL]
+            },
+            "queries_per_deployment": {
+                "mean": round(statistics.mean(queries), 1) if queries else 0,
+                "max": max(queries, default=0),
+            },
+        }
+
+        endpoints = {}
+        for name in ('status', 'progress', 'logs'):
+            timings = [t for poller in pollers for t in poller.timings[name]]
+            counts = [n for poller in pollers for n in poller.queries[name]]
+            statuses = sum((poller.statuses[name] for poller in pollers), Counter())
+            endpoints[name] = {
+                **summarize(timings),
+                "throughput_per_s": round(len(timings) / wall, 2) if wall else None,
+                "queries_mean": round(statistics.mean(counts), 2) if counts else 0,
+                "queries_max": max(counts, default=0),
+                "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+            }
+        return deployments, endpoints
+
+    def cleanup(self, webapps):
+        ids = [webapp.id for webapp in webapps]
+        WebApp.objects.filter(pk__in=ids).delete()
+        for webapp_id in ids:
+            delete_status(webapp_id)
@@ -0,0 +1,115 @@
+"""
+Compare the cost of a list page under each pagination/count strategy.
+
+    python manage.py bench_pagination --apps 50000 --page 2000
+
+Per list endpoint, on a seeded table (rolled back afterwards):
+
+- exact_count: COUNT(*) over the whole tenant on every request, as
+  PageNumberPagination does (PAGINATION_EXACT_COUNT_LIMIT=0, cache cold);
+- capped_count: count_rows() with the configured limit, cache cold;
+- cached_count: the per-tenant count cache warm;
+- deep_offset / deep_keyset: page --page by ?page= alone (OFFSET) and by
+  the `next` link of the page before it (?after= seek);
+- cursor: ?pagination=cursor, no count at all.
+"""
+
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from apps.core.tenancy import forget_tenant_counts
+
+from .bench_queries import Command as BenchQueries, Rollback, percentile
+
+
+ENDPOINTS = {
+    "webapp_list": "/api/webapps/",
+    "environment_list": "/api/environments/",
+    "instance_list": "/api/instances/",
+}
+
+
+class Command(BaseCommand):
+    help = "Seed a large table and report p50/p99 latency and queries per pagination strategy"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apps', type=int, default=10000)
+        parser.add_argument('--page', type=int, default=500, help="Page number for the deep page scenarios")
+        parser.add_argument('--requests', type=int, default=20, help="Requests per scenario")
+        parser.add_argument('--output', help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        report = {}
+        try:
+            with transaction.atomic():
+                BenchQueries().seed(options['apps'], 0)
+                report = {
+                    "vendor": connection.vendor,
+                    "apps": options['apps'],
+                    "page": options['page'],
+                    "endpoints": {
+                        name: self.measure(path, options['page'], options['requests'])
+                        for name, path in ENDPOINTS.items()
+                    },
+                }
+                raise Rollback
+        except Rollback:
+            pass
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    def measure(self, path, page, request_count):
+        client = Client()
+        before = client.get(f"{path}?page={page - 1}").json()
+        deep_keyset = before["next"]
+        if deep_keyset is None:
+            deep_keyset = f"{path}?page={page}"
+            self.stderr.write(f"{path} has fewer than {page} pages; deep_keyset falls back to OFFSET")
+
+        scenarios = {
+            "exact_count": (path, True, {"PAGINATION_EXACT_COUNT_LIMIT": 0}),
+            "capped_count": (path, True, {}),
+            "cached_count": (path, False, {}),
+            "deep_offset": (f"{path}?page={page}", False, {}),
+            "deep_keyset": (deep_keyset, False, {}),
+            "cursor": (f"{path}?pagination=cursor", False, {}),
+        }
+        results = {}
+        for name, (url, cold, overrides) in scenarios.items():
+            with override_settings(**overrides):
+                results[name] = self.time_requests(client, url, cold, request_count)
+        return results
+
+    def time_requests(self, client, url, cold, request_count):
+        timings = []
+        for _ in range(request_count):
+            if cold:
+                forget_tenant_counts(None)
+            started = time.perf_counter()
+            client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        if cold:
+            forget_tenant_counts(None)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        body = response.json()
+
+        return {
+            "status": response.status_code,
+            "count": body.get("count"),
+            "count_estimated": body.get("count_estimated"),
+            "p50_ms": round(statistics.median(timings), 2),
+            "p99_ms": round(percentile(timings, 99), 2),
+            "queries": len(queries),
+        }
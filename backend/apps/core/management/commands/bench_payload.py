@@ -0,0 +1,151 @@
+"""
+Compare response size and latency of the list/detail endpoints with the
+log summary against the embedded log history they used to carry.
+
+    python manage.py bench_payload --apps 200 --logs-per-app 30
+
+"summary" is the API as served (log_count and latest_log per instance).
+"embedded" renders the same rows the way InstanceSerializer did before,
+with every DeploymentLog of the instance nested under `logs`, querying
+included. It skips the request cycle and the list envelope, so its
+latency and size are lower bounds. The seeded rows are rolled back.
+"""
+
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from apps.core.models import DeploymentLog, Instance, WebApp
+from apps.core.serializers import (
+    DeploymentLogSerializer,
+    EnvironmentSerializer,
+    InstanceSerializer,
+    WebAppDetailSerializer,
+    WebAppListSerializer,
+)
+
+from .bench_queries import Command as BenchQueries, Rollback, percentile
+
+
+class EmbeddedInstanceSerializer(InstanceSerializer):
+    log_count = None
+    latest_log = None
+    logs = DeploymentLogSerializer(many=True, read_only=True)
+
+    class Meta(InstanceSerializer.Meta):
+        fields = ['id', 'cpu', 'ram', 'storage', 'status', 'public_ip',
+                  'created_at', 'updated_at', 'logs']
+
+
+class EmbeddedEnvironmentSerializer(EnvironmentSerializer):
+    instance = EmbeddedInstanceSerializer(read_only=True)
+
+
+class EmbeddedWebAppListSerializer(WebAppListSerializer):
+    environment = EmbeddedEnvironmentSerializer(read_only=True)
+
+
+class EmbeddedWebAppDetailSerializer(WebAppDetailSerializer):
+    environment = EmbeddedEnvironmentSerializer(read_only=True)
+
+
+def embedded_logs(lookup='logs'):
+    return Prefetch(lookup, queryset=DeploymentLog.objects.order_by('timestamp', 'id'))
+
+
+class Command(BaseCommand):
+    help = "Report bytes, p50/p99 latency and queries of list/detail pages with and without embedded logs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apps', type=int, default=200)
+        parser.add_argument('--logs-per-app', type=int, default=30)
+        parser.add_argument('--requests', type=int, default=20, help="Requests per endpoint and variant")
+        parser.add_argument('--output', help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        report = {}
+        try:
+            with transaction.atomic():
+                webapps = BenchQueries().seed(options['apps'], options['logs_per_app'])
+                report = {
+                    "vendor": connection.vendor,
+                    "apps": options['apps'],
+                    "logs_per_app": options['logs_per_app'],
+                    "page_size": settings.REST_FRAMEWORK['PAGE_SIZE'],
+                    "endpoints": self.compare(webapps[0], options['requests']),
+                }
+                raise Rollback
+        except Rollback:
+            pass
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    def compare(self, webapp, request_count):
+        client = Client()
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        variants = {
+            "webapp_list": (
+                lambda: client.get('/api/webapps/').content,
+                lambda: JSONRenderer().render(EmbeddedWebAppListSerializer(
+                    WebApp.objects.select_related('environment__instance', 'database_config')
+                    .prefetch_related(embedded_logs('environment__instance__logs'))
+                    [:page_size],
+                    many=True,
+                ).data),
+            ),
+            "webapp_detail": (
+                lambda: client.get(f'/api/webapps/{webapp.id}/').content,
+                lambda: JSONRenderer().render(EmbeddedWebAppDetailSerializer(
+                    WebApp.objects.select_related('environment__instance', 'database_config')
+                    .prefetch_related(embedded_logs('environment__instance__logs'))
+                    .get(pk=webapp.pk),
+                ).data),
+            ),
+            "instance_list": (
+                lambda: client.get('/api/instances/').content,
+                lambda: JSONRenderer().render(EmbeddedInstanceSerializer(
+                    Instance.objects.order_by('-environment__webapp__created_at')
+                    .prefetch_related(embedded_logs())[:page_size],
+                    many=True,
+                ).data),
+            ),
+        }
+
+        results = {}
+        for name, (summary, embedded) in variants.items():
+            results[name] = {
+                "summary": self.measure(summary, request_count),
+                "embedded": self.measure(embedded, request_count),
+            }
+            results[name]["bytes_ratio"] = round(
+                results[name]["embedded"]["bytes"] / results[name]["summary"]["bytes"], 2
+            )
+        return results
+
+    def measure(self, render, request_count):
+        timings = []
+        for _ in range(request_count):
+            started = time.perf_counter()
+            render()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        with CaptureQueriesContext(connection) as queries:
+            body = render()
+        return {
+            "bytes": len(body),
+            "p50_ms": round(statistics.median(timings), 2),
+            "p99_ms": round(percentile(timings, 99), 2),
+            "queries": len(queries),
+        }
@@ -0,0 +1,149 @@
+"""
+Seed a large dataset and report query plans and latency for the hot API paths.
+
+    python manage.py bench_queries --apps 2000 --logs-per-app 200 --output before.json
+
+Everything runs inside a transaction that is rolled back at the end, so the
+seeded rows never persist. Run it on two revisions and diff the reports.
+"""
+
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.core.models import WebApp, Environment, Instance, DeploymentLog
+from apps.core.plans import instance_specs
+
+
+BENCH_STAGES = ['received', 'deploying', 'provisioning', 'ec2', 'active']
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+
+class Command(BaseCommand):
+    help = "Seed a large dataset and report EXPLAIN plans and p50/p99 latency per endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apps', type=int, default=1000)
+        parser.add_argument('--logs-per-app', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=50, help="Requests per endpoint")
+        parser.add_argument('--output', help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        report = {}
+        try:
+            with transaction.atomic():
+                webapps = self.seed(options['apps'], options['logs_per_app'])
+                report = {
+                    "vendor": connection.vendor,
+                    "apps": options['apps'],
+                    "logs_per_app": options['logs_per_app'],
+                    "endpoints": self.measure(webapps, options['requests']),
+                }
+                raise Rollback
+        except Rollback:
+            pass
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    def seed(self, app_count, logs_per_app):
+        start = timezone.now() - timedelta(days=30)
+        webapps, environments, instances, logs = [], [], [], []
+
+        for i in range(app_count):
+            plan = random.choice(WebApp.PLAN_CHOICES)[0]
+            webapp = WebApp(
+                name=f"bench-{i}",
+                region=random.choice(WebApp.REGION_CHOICES)[0],
+                template=random.choice(WebApp.FRAMEWORK_CHOICES)[0],
+                plan=plan,
+                repo="bench/repo",
+                branch="main",
+            )
+            env = Environment(webapp=webapp, port=3000, environment_variables={})
+            instance = Instance(
+                environment=env,
+                status=random.choice(Instance.STATUS_CHOICES)[0],
+                **instance_specs(plan)
+            )
+            webapps.append(webapp)
+            environments.append(env)
+            instances.append(instance)
+            for j in range(logs_per_app):
+                logs.append(DeploymentLog(
+                    instance=instance,
+                    level=random.choice(DeploymentLog.LEVEL_CHOICES)[0],
+                    stage=random.choice(BENCH_STAGES),
+                    message=f"bench line {j}",
+                    timestamp=start + timedelta(seconds=i * logs_per_app + j),
+                ))
+
+        WebApp.objects.bulk_create(webapps, batch_size=1000)
+        Environment.objects.bulk_create(environments, batch_size=1000)
+        Instance.objects.bulk_create(instances, batch_size=1000)
+        DeploymentLog.objects.bulk_create(logs, batch_size=5000)
+        return webapps
+
+    def endpoints(self, webapp):
+        return {
+            "webapp_list": "/api/webapps/",
+            "webapp_detail": f"/api/webapps/{webapp.id}/",
+            "webapp_status": f"/api/webapps/{webapp.id}/status/",
+            "webapp_logs": f"/api/webapps/{webapp.id}/logs/",
+            "instance_list": "/api/instances/",
+            "log_list": "/api/logs/",
+            "log_list_by_webapp": f"/api/logs/?webapp={webapp.id}",
+        }
+
+    def measure(self, webapps, request_count):
+        client = Client()
+        results = {}
+
+        for name in self.endpoints(webapps[0]):
+            timings = []
+            for _ in range(request_count):
+                path = self.endpoints(random.choice(webapps))[name]
+                started = time.perf_counter()
+                client.get(path)
+                timings.append((time.perf_counter() - started) * 1000)
+
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(self.endpoints(webapps[0])[name])
+
+            results[name] = {
+                "status": response.status_code,
+                "p50_ms": round(statistics.median(timings), 2),
+                "p99_ms": round(percentile(timings, 99), 2),
+                "queries": len(queries),
+                "plans": [
+                    self.explain(query["sql"]) for query in queries
+                    if query["sql"].startswith("SELECT")
+                ],
+            }
+        return results
+
+    def explain(self, sql):
+        prefix = "EXPLAIN QUERY PLAN " if connection.vendor == 'sqlite' else "EXPLAIN "
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            plan = [" ".join(str(col) for col in row) for row in cursor.fetchall()]
+        return {"sql": sql, "plan": plan}
@@ -0,0 +1,121 @@
+"""
+Compare the DRF serializers with the fastpath plain-function serializers.
+
+    python manage.py bench_serializers --apps 2000 --logs-per-app 20
+
+First checks that both render byte-identical JSON for every seeded webapp
+and log line (exits with an error otherwise), then reports rows/second
+for each, querying included. The seeded rows are rolled back.
+"""
+
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.renderers import JSONRenderer
+
+from apps.core.fastpath import log_rows, webapp_list_rows, webapp_list_values
+from apps.core.models import WebApp, DatabaseConfig, DeploymentLog
+from apps.core.serializers import DeploymentLogSerializer, WebAppListSerializer
+
+from .bench_queries import Command as BenchQueries, Rollback
+
+
+def render(data):
+    return JSONRenderer().render(data)
+
+
+class Command(BaseCommand):
+    help = "Check that fastpath output matches the DRF serializers and compare their rows/second"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apps', type=int, default=1000)
+        parser.add_argument('--logs-per-app', type=int, default=20)
+        parser.add_argument('--rounds', type=int, default=5, help="Timed runs per serializer")
+        parser.add_argument('--output', help="Write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        report = {}
+        try:
+            with transaction.atomic():
+                self.seed(options['apps'], options['logs_per_app'])
+                self.check_contract()
+                report = {
+                    "vendor": connection.vendor,
+                    "apps": options['apps'],
+                    "logs_per_app": options['logs_per_app'],
+                    "webapp_list": self.compare(
+                        options['rounds'],
+                        drf=lambda: WebAppListSerializer(WebApp.objects.with_deployment(), many=True).data,
+                        fast=lambda: webapp_list_rows(webapp_list_values(WebApp.objects.all())),
+                    ),
+                    "logs": self.compare(
+                        options['rounds'],
+                        drf=lambda: DeploymentLogSerializer(self.logs(), many=True).data,
+                        fast=lambda: log_rows(self.logs()),
+                    ),
+                }
+                raise Rollback
+        except Rollback:
+            pass
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    def seed(self, app_count, logs_per_app):
+        webapps = BenchQueries().seed(app_count, logs_per_app)
+        # Half the apps get a database, so both shapes of the row are covered.
+        DatabaseConfig.objects.bulk_create([
+            DatabaseConfig(webapp=webapp, engine=random.choice(DatabaseConfig.DATABASE_ENGINE_CHOICES)[0])
+            for webapp in webapps[::2]
+        ], batch_size=1000)
+
+    def logs(self):
+        return DeploymentLog.objects.order_by('-timestamp', '-id')
+
+    def check_contract(self):
+        pairs = [
+            (
+                "webapp_list",
+                WebAppListSerializer(WebApp.objects.with_deployment(), many=True).data,
+                webapp_list_rows(webapp_list_values(WebApp.objects.all())),
+            ),
+            (
+                "logs",
+                DeploymentLogSerializer(self.logs(), many=True).data,
+                log_rows(self.logs()),
+            ),
+        ]
+        for name, expected, actual in pairs:
+            if render(expected) == render(actual):
+                continue
+            for index, (want, got) in enumerate(zip(expected, actual)):
+                if render(want) != render(got):
+                    raise CommandError(
+                        f"{name} row {index} differs:\n  drf:  {render(want).decode()}\n  fast: {render(got).decode()}"
+                    )
+            raise CommandError(f"{name}: {len(expected)} rows from DRF, {len(actual)} from fastpath")
+
+    def compare(self, rounds, drf, fast):
+        results = {name: self.measure(serialize, rounds) for name, serialize in (("drf", drf), ("fast", fast))}
+        results["speedup"] = round(results["fast"]["rows_per_s"] / results["drf"]["rows_per_s"], 2)
+        return results
+
+    def measure(self, serialize, rounds):
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            rows = len(serialize())
+            timings.append(time.perf_counter() - started)
+        median = statistics.median(timings)
+        return {
+            "rows": rows,
+            "median_ms": round(median * 1000, 2),
+            "rows_per_s": round(rows / median),
+        }
@@ -0,0 +1,256 @@
+"""
+Prometheus metrics for kuberns core app, served at /metrics.
+
+Request metrics are kept in process memory by MetricsMiddleware, so each
+web process reports its own series (scrape every process, or run one).
+Deployment stages run in Celery worker processes, so their histogram is
+accumulated in Redis (METRICS_SHARED_URL) where any web process can read
+it; without a shared URL it stays in process memory as well.
+Everything is a no-op when METRICS_ENABLED is off.
+"""
+
+import json
+import logging
+import threading
+from bisect import bisect_left
+
+import redis
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+WAIT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels
+    )
+    return '{%s}' % pairs
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with a fixed label set, kept in memory.
+    """
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def series(self):
+        """
+        {label values: (per-bucket counts incl. +Inf, sum, count)}
+        """
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self.series().items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                le = bound if bound == '+Inf' else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(float(total))}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class SharedHistogram(Histogram):
+    """
+    Histogram accumulated in a Redis hash so observations made in Celery
+    workers are visible to the web processes. Redis errors are logged and
+    the observation is dropped.
+    """
+
+    def __init__(self, *args, url=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.url = url
+        self._client = None
+
+    @property
+    def key(self):
+        return f"kuberns:metrics:{self.name}"
+
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def observe(self, value, **labels):
+        if not self.url:
+            return super().observe(value, **labels)
+
+        key = json.dumps([str(labels[name]) for name in self.labelnames])
+        index = bisect_left(self.buckets, value)
+        try:
+            pipe = self.client().pipeline(transaction=False)
+            pipe.hincrby(self.key, f"{key}|bucket|{index}", 1)
+            pipe.hincrbyfloat(self.key, f"{key}|sum", value)
+            pipe.hincrby(self.key, f"{key}|count", 1)
+            pipe.execute()
+        except redis.RedisError:
+            logger.warning("Could not record %s", self.name, exc_info=True)
+
+    def series(self):
+        if not self.url:
+            return super().series()
+
+        try:
+            fields = self.client().hgetall(self.key)
+        except redis.RedisError:
+            logger.warning("Could not read %s", self.name, exc_info=True)
+            return {}
+
+        series = {}
+        for field, value in fields.items():
+            key, kind, *index = field.decode().split('|')
+            key = tuple(json.loads(key))
+            counts, total, count = series.setdefault(key, ([0] * (len(self.buckets) + 1), 0.0, 0))
+            if kind == 'bucket':
+                counts[int(index[0])] = int(value)
+            elif kind == 'sum':
+                series[key] = (counts, float(value), count)
+            else:
+                series[key] = (counts, total, int(value))
+        return series
+
+
+class Gauge:
+    """
+    Gauge whose samples ({label values: value}) are collected at scrape time.
+    """
+
+    def __init__(self, name, documentation, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = self.collect()
+        except redis.RedisError:
+            logger.warning("Could not collect %s", self.name, exc_info=True)
+            samples = {}
+        for key, value in sorted(samples.items()):
+            labels = list(zip(self.labelnames, (key,) if isinstance(key, str) else key))
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+def _queue_depths():
+    from .scheduling import queue_depths
+    return queue_depths()
+
+
+def _in_flight():
+    from .scheduling import in_flight
+    return in_flight()
+
+
+REQUEST_LATENCY = Histogram(
+    'kuberns_http_request_duration_seconds',
+    "Time spent producing the response, by view.",
+    ('view', 'method', 'status'), LATENCY_BUCKETS,
+)
+REQUEST_QUERIES = Histogram(
+    'kuberns_http_request_db_queries',
+    "Database queries executed per request, by view.",
+    ('view', 'method'), QUERY_COUNT_BUCKETS,
+)
+REQUEST_DB_TIME = Histogram(
+    'kuberns_http_request_db_duration_seconds',
+    "Time spent in database queries per request, by view.",
+    ('view', 'method'), LATENCY_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    'kuberns_http_response_size_bytes',
+    "Serialized response body size, by view (streaming responses excluded).",
+    ('view', 'method'), SIZE_BUCKETS,
+)
+DEPLOYMENT_STAGE_DURATION = SharedHistogram(
+    'kuberns_deployment_stage_duration_seconds',
+    "Run time of each deployment pipeline stage task, by outcome.",
+    ('stage', 'outcome'), STAGE_BUCKETS,
+    url=settings.METRICS_SHARED_URL,
+)
+DEPLOYMENT_QUEUE_WAIT = SharedHistogram(
+    'kuberns_deployment_queue_wait_seconds',
+    "Time from enqueueing a deployment until it was admitted to run.",
+    ('region', 'plan'), WAIT_BUCKETS,
+    url=settings.METRICS_SHARED_URL,
+)
+DEPLOYMENT_QUEUE_DEPTH = Gauge(
+    'kuberns_deployment_queue_depth',
+    "Deployment stage messages waiting on each region queue.",
+    ('queue',), _queue_depths,
+)
+DEPLOYMENTS_IN_FLIGHT = Gauge(
+    'kuberns_deployments_in_flight',
+    "Admitted, unfinished deployments per region.",
+    ('region',), _in_flight,
+)
+
+REGISTRY = [
+    REQUEST_LATENCY,
+    REQUEST_QUERIES,
+    REQUEST_DB_TIME,
+    RESPONSE_SIZE,
+    DEPLOYMENT_STAGE_DURATION,
+    DEPLOYMENT_QUEUE_WAIT,
+    DEPLOYMENT_QUEUE_DEPTH,
+    DEPLOYMENTS_IN_FLIGHT,
+]
+
+
+def record_stage(stage, outcome, seconds):
+    if settings.METRICS_ENABLED:
+        DEPLOYMENT_STAGE_DURATION.observe(seconds, stage=stage, outcome=outcome)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics(request):
+    """
+    Prometheus text exposition of every metric above.
+    """
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,61 @@
+"""
+Middleware for kuberns core app
+"""
+
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .metrics import REQUEST_DB_TIME, REQUEST_LATENCY, REQUEST_QUERIES, RESPONSE_SIZE
+
+
+class QueryTimer:
+    """
+    connection.execute_wrapper() hook counting queries and their run time.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """
+    Records per-view latency, database query count and time, and response
+    size for /metrics. Removed from the stack entirely (MiddlewareNotUsed)
+    when METRICS_ENABLED is off.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        REQUEST_LATENCY.observe(elapsed, view=view, method=request.method, status=response.status_code)
+        REQUEST_QUERIES.observe(timer.count, view=view, method=request.method)
+        REQUEST_DB_TIME.observe(timer.duration, view=view, method=request.method)
+        if not response.streaming:
+            RESPONSE_SIZE.observe(len(response.content), view=view, method=request.method)
+        return response
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:12
+
+from django.contrib.postgres.operations import AddIndexConcurrently as PostgresAddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class AddIndexConcurrently(PostgresAddIndexConcurrently):
+    """
+    CREATE INDEX CONCURRENTLY on PostgreSQL, so the tables stay writable
+    while the indexes build; a plain AddIndex on other backends.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        return migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        return migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    # Concurrent index builds cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('core', '0002_deploymentlog_timestamp_default'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='deploymentlog',
+            index=models.Index(fields=['instance', 'timestamp', 'id'], name='core_log_instance_ts_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='deploymentlog',
+            index=models.Index(fields=['timestamp', 'id'], name='core_log_ts_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='instance',
+            index=models.Index(fields=['-created_at'], name='core_instance_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='instance',
+            index=models.Index(fields=['status', '-created_at'], name='core_instance_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='webapp',
+            index=models.Index(fields=['-created_at'], name='core_webapp_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='webapp',
+            index=models.Index(fields=['owner', '-created_at'], name='core_webapp_owner_created_idx'),
+        ),
+        # Drop the plain FK index only once the composite index covers it.
+        # Without the migration transaction each operation commits on its
+        # own, so a failed index build stops here with the FK index intact.
+        migrations.AlterField(
+            model_name='deploymentlog',
+            name='instance',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='logs', to='core.instance'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeploymentLogArchive',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('compression', models.CharField(choices=[('gzip', 'gzip'), ('zstd', 'Zstandard')], default='gzip', max_length=10)),
+                ('data', models.BinaryField()),
+                ('line_count', models.PositiveIntegerField(default=0)),
+                ('size_bytes', models.PositiveIntegerField(default=0)),
+                ('first_timestamp', models.DateTimeField(null=True)),
+                ('last_timestamp', models.DateTimeField(null=True)),
+                ('last_log_text', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('instance', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='log_archive', to='core.instance')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_timestamp'], name='core_logarchive_last_ts_idx')],
+            },
+        ),
+    ]
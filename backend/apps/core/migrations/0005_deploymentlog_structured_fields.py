@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_deploymentlogarchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deploymentlog',
+            name='level',
+            field=models.CharField(choices=[('info', 'Info'), ('success', 'Success'), ('warning', 'Warning'), ('error', 'Error')], default='info', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='deploymentlog',
+            name='stage',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='deploymentlog',
+            name='message',
+            field=models.TextField(default=''),
+            preserve_default=False,
+        ),
+        migrations.RenameField(
+            model_name='deploymentlogarchive',
+            old_name='last_log_text',
+            new_name='last_message',
+        ),
+    ]
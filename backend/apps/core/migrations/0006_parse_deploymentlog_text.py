@@ -0,0 +1,103 @@
+"""
+Split the pre-formatted DeploymentLog.log_text ("<timestamp> - [LEVEL] message")
+into level, stage and message, for live rows and compacted archives.
+"""
+
+import gzip
+import json
+import re
+
+from django.db import migrations
+
+
+LINE_RE = re.compile(r'^(?:\d{4}-\d\d-\d\d \d\d:\d\d:\d\d - )?(?:\[(?P<level>[A-Z]+)\]\s*)?(?P<message>.*)$', re.S)
+
+LEVELS = {'INFO': 'info', 'SUCCESS': 'success', 'WARN': 'warning', 'WARNING': 'warning', 'ERROR': 'error'}
+
+# Message prefixes written by each pipeline stage before stages were recorded
+STAGE_PREFIXES = [
+    ('Deployment task received', 'received'),
+    ('Deployment started', 'deploying'),
+    ('Provisioning cloud resources', 'provisioning'),
+    ('Initiating EC2 provisioning', 'ec2'),
+    ('EC2 ', 'ec2'),
+    ('Deployment completed', 'active'),
+]
+
+BATCH_SIZE = 2000
+
+
+def parse(log_text):
+    match = LINE_RE.match(log_text)
+    level = LEVELS.get(match.group('level') or '', 'info')
+    message = match.group('message')
+    stage = next((stage for prefix, stage in STAGE_PREFIXES if message.startswith(prefix)), '')
+    return level, stage, message
+
+
+def _codec(compression):
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress
+    return gzip.compress, gzip.decompress
+
+
+def forwards(apps, schema_editor):
+    DeploymentLog = apps.get_model('core', 'DeploymentLog')
+    DeploymentLogArchive = apps.get_model('core', 'DeploymentLogArchive')
+
+    batch = []
+    for log in DeploymentLog.objects.only('id', 'log_text').iterator(chunk_size=BATCH_SIZE):
+        log.level, log.stage, log.message = parse(log.log_text)
+        batch.append(log)
+        if len(batch) >= BATCH_SIZE:
+            DeploymentLog.objects.bulk_update(batch, ['level', 'stage', 'message'])
+            batch = []
+    if batch:
+        DeploymentLog.objects.bulk_update(batch, ['level', 'stage', 'message'])
+
+    for archive in DeploymentLogArchive.objects.iterator(chunk_size=100):
+        compress, decompress = _codec(archive.compression)
+        rows = json.loads(decompress(bytes(archive.data)))
+        rows = [[log_id, timestamp, *parse(log_text)] for log_id, timestamp, log_text in rows]
+        archive.data = compress(json.dumps(rows, separators=(',', ':')).encode())
+        archive.size_bytes = len(archive.data)
+        archive.last_message = rows[-1][4] if rows else ''
+        archive.save(update_fields=['data', 'size_bytes', 'last_message'])
+
+
+def backwards(apps, schema_editor):
+    DeploymentLog = apps.get_model('core', 'DeploymentLog')
+    DeploymentLogArchive = apps.get_model('core', 'DeploymentLogArchive')
+
+    batch = []
+    for log in DeploymentLog.objects.only('id', 'timestamp', 'level', 'message').iterator(chunk_size=BATCH_SIZE):
+        log.log_text = f"{log.timestamp:%Y-%m-%d %H:%M:%S} - [{log.level.upper()}] {log.message}"
+        batch.append(log)
+        if len(batch) >= BATCH_SIZE:
+            DeploymentLog.objects.bulk_update(batch, ['log_text'])
+            batch = []
+    if batch:
+        DeploymentLog.objects.bulk_update(batch, ['log_text'])
+
+    for archive in DeploymentLogArchive.objects.iterator(chunk_size=100):
+        compress, decompress = _codec(archive.compression)
+        rows = [
+            [log_id, timestamp, f"[{level.upper()}] {message}"]
+            for log_id, timestamp, level, stage, message in json.loads(decompress(bytes(archive.data)))
+        ]
+        archive.data = compress(json.dumps(rows, separators=(',', ':')).encode())
+        archive.size_bytes = len(archive.data)
+        archive.last_message = rows[-1][2] if rows else ''
+        archive.save(update_fields=['data', 'size_bytes', 'last_message'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_deploymentlog_structured_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_parse_deploymentlog_text'),
+    ]
+
+    operations = [
+        # Give log_text a default first so the migration can be reversed
+        # (0006 then refills it).
+        migrations.AlterField(
+            model_name='deploymentlog',
+            name='log_text',
+            field=models.TextField(default=''),
+        ),
+        migrations.RemoveField(
+            model_name='deploymentlog',
+            name='log_text',
+        ),
+        migrations.AddIndex(
+            model_name='deploymentlog',
+            index=models.Index(fields=['instance', 'level', 'timestamp', 'id'], name='core_log_inst_level_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deploymentlog',
+            index=models.Index(fields=['instance', 'stage', 'timestamp', 'id'], name='core_log_inst_stage_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deploymentlog',
+            index=models.Index(fields=['level', 'timestamp', 'id'], name='core_log_level_ts_idx'),
+        ),
+    ]
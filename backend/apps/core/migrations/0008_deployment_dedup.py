@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_deploymentlog_drop_log_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instance',
+            name='stage',
+            field=models.CharField(blank=True, default='', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='webapp',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+# Stages every deployment ran before redeploys could skip some
+ALL_STAGES = ['received', 'deploying', 'provisioning', 'ec2', 'active']
+
+BATCH_SIZE = 2000
+
+
+def backfill_initial_revisions(apps, schema_editor):
+    """
+    Record each existing webapp's current inputs as its revision 1. A
+    webapp without an environment gets empty environment variables.
+    """
+    WebApp = apps.get_model('core', 'WebApp')
+    Deployment = apps.get_model('core', 'Deployment')
+
+    webapps = WebApp.objects.select_related('environment').order_by('pk')
+    batch = []
+    for webapp in webapps.iterator(chunk_size=BATCH_SIZE):
+        environment = getattr(webapp, 'environment', None)
+        batch.append(Deployment(
+            webapp=webapp,
+            revision=1,
+            repo=webapp.repo,
+            branch=webapp.branch,
+            plan=webapp.plan,
+            region=webapp.region,
+            environment_variables=environment.environment_variables if environment else {},
+            stages=ALL_STAGES,
+        ))
+        if len(batch) >= BATCH_SIZE:
+            Deployment.objects.bulk_create(batch)
+            batch = []
+    Deployment.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_deployment_dedup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Deployment',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('revision', models.PositiveIntegerField()),
+                ('repo', models.CharField(max_length=255)),
+                ('branch', models.CharField(max_length=255)),
+                ('plan', models.CharField(choices=[('starter', 'Starter'), ('pro', 'Pro')], max_length=20)),
+                ('region', models.CharField(choices=[('us-east-1', 'US East (N. Virginia)'), ('us-west-2', 'US West (Oregon)'), ('eu-central-1', 'EU (Frankfurt)')], max_length=20)),
+                ('environment_variables', models.JSONField(default=dict)),
+                ('changed', models.JSONField(default=list)),
+                ('stages', models.JSONField(default=list)),
+                ('rollback_of', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('webapp', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='deployments', to='core.webapp')),
+            ],
+            options={
+                'ordering': ['-revision'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='deployment',
+            constraint=models.UniqueConstraint(fields=('webapp', 'revision'), name='core_deployment_revision_uniq'),
+        ),
+        migrations.RunPython(backfill_initial_revisions, migrations.RunPython.noop),
+    ]
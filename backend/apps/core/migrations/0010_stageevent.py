@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_deployment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StageEvent',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('stage', models.CharField(max_length=20)),
+                ('outcome', models.CharField(choices=[('success', 'Success'), ('failed', 'Failed')], max_length=10)),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+                ('duration_ms', models.PositiveIntegerField()),
+                ('deployment', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stage_events', to='core.deployment')),
+            ],
+            options={
+                'ordering': ['started_at'],
+                'indexes': [models.Index(fields=['finished_at'], name='core_stageevent_finished_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stageevent',
+            constraint=models.UniqueConstraint(fields=('deployment', 'stage'), name='core_stageevent_stage_uniq'),
+        ),
+    ]
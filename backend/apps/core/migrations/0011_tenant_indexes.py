@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_stageevent'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='webapp',
+            name='core_webapp_owner_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='webapp',
+            index=models.Index(fields=['owner', '-created_at', '-id'], name='core_webapp_owner_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='webapp',
+            index=models.Index(fields=['owner', 'organization', '-created_at', '-id'], name='core_webapp_owner_org_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_tenant_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='webapp',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='webapp',
+            constraint=models.UniqueConstraint(fields=('owner', 'idempotency_key'), name='core_webapp_owner_idempotency_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='webapp',
+            constraint=models.UniqueConstraint(condition=models.Q(('owner__isnull', True)), fields=('idempotency_key',), name='core_webapp_anonymous_idempotency_key'),
+        ),
+    ]
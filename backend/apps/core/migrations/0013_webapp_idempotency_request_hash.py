@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_webapp_idempotency_key_per_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webapp',
+            name='idempotency_request_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
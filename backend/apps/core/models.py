@@ -3,10 +3,29 @@ Models for kuberns core app
 """
 
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 
 
+class WebAppQuerySet(models.QuerySet):
+    """
+    Per-action loading strategies for WebApp and its one-to-one chain.
+    """
+
+    def with_deployment(self):
+        # environment and database_config are one-to-one, so they are joined
+        # in the same query; the instance comes in one more query carrying
+        # its log summary annotations.
+        return self.select_related('environment', 'database_config').prefetch_related(
+            models.Prefetch(
+                'environment__instance',
+                queryset=Instance.objects.with_log_summary(),
+            )
+        )
+
+
 class WebApp(models.Model):
     REGION_CHOICES = [
         ('us-east-1', 'US East (N. Virginia)'),
@@ -46,11 +65,36 @@ class WebApp(models.Model):
     organization = models.CharField(max_length=255, null=True, blank=True)
     database_type = models.CharField(max_length=20, choices=DATABASE_CHOICES, default='none')
     database_enabled = models.BooleanField(default=False)
+    # Client-supplied Idempotency-Key of the create request; a retried
+    # request with the same key returns this app instead of a new one.
+    # Unique per owner (see Meta.constraints), as keys are only looked up
+    # within the requesting tenant.
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True, editable=False)
+    # sha256 of that request's body, so a key reused for a different
+    # request is refused rather than replayed ('' for apps created before).
+    idempotency_request_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = WebAppQuerySet.as_manager()
+
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=['-created_at'], name='core_webapp_created_idx'),
+            # Per-tenant list pages seek on these (see KeysetPageNumberPagination)
+            models.Index(fields=['owner', '-created_at', '-id'], name='core_webapp_owner_keyset_idx'),
+            models.Index(fields=['owner', 'organization', '-created_at', '-id'], name='core_webapp_owner_org_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'idempotency_key'], name='core_webapp_owner_idempotency_key'),
+            # NULL owners never collide above, so the anonymous tenant gets its own.
+            models.UniqueConstraint(
+                fields=['idempotency_key'],
+                condition=models.Q(owner__isnull=True),
+                name='core_webapp_anonymous_idempotency_key',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -85,6 +129,43 @@ class Environment(models.Model):
         return f"Environment for {self.webapp.name}"
 
 
+def log_summary_annotations(instance):
+    """
+    log_count and latest_log expressions for the instance `instance` (an
+    OuterRef) points at. Lines compacted into the instance's
+    DeploymentLogArchive are counted too, and its last line stands in once
+    no live rows are left.
+    """
+    # Correlated subqueries rather than a JOIN + GROUP BY, so a LIMITed
+    # page only summarizes its own rows.
+    live = DeploymentLog.objects.filter(instance=instance).order_by()
+    latest = DeploymentLog.objects.filter(instance=instance).order_by('-timestamp', '-id')
+    archive = DeploymentLogArchive.objects.filter(instance=instance)
+    return {
+        'log_count': Coalesce(
+            models.Subquery(
+                live.values('instance').annotate(count=models.Count('*')).values('count'),
+                output_field=models.IntegerField(),
+            ),
+            0,
+        ) + Coalesce(
+            models.Subquery(archive.values('line_count')[:1]), 0
+        ),
+        'latest_log': Coalesce(
+            models.Subquery(latest.values('message')[:1]),
+            models.Subquery(archive.values('last_message')[:1]),
+        ),
+    }
+
+
+class InstanceQuerySet(models.QuerySet):
+    def with_log_summary(self):
+        """
+        Annotate log_count and latest_log in SQL instead of loading the logs.
+        """
+        return self.annotate(**log_summary_annotations(models.OuterRef('pk')))
+
+
 class Instance(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -101,24 +182,177 @@ class Instance(models.Model):
     storage = models.CharField(max_length=20)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     public_ip = models.CharField(max_length=50, null=True, blank=True)
+    # Last pipeline stage claimed by a worker (see tasks.run_deployment_stage)
+    stage = models.CharField(max_length=20, blank=True, default='', editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = InstanceQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='core_instance_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='core_instance_status_idx'),
+        ]
 
     def __str__(self):
         return f"Instance: {self.status}"
 
 
+class Deployment(models.Model):
+    """
+    One revision of a webapp: the inputs it was deployed with and the
+    pipeline stages that ran. Revision 1 is the initial create; each
+    redeploy or rollback adds the next one.
+    """
+    # What a deployment is built from; a change to any of them is what a
+    # redeploy compares (see tasks.STAGE_INPUTS).
+    INPUT_FIELDS = ('repo', 'branch', 'plan', 'region', 'environment_variables')
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    webapp = models.ForeignKey(WebApp, on_delete=models.CASCADE, related_name='deployments', db_index=False)
+    revision = models.PositiveIntegerField()
+    repo = models.CharField(max_length=255)
+    branch = models.CharField(max_length=255)
+    plan = models.CharField(max_length=20, choices=WebApp.PLAN_CHOICES)
+    region = models.CharField(max_length=20, choices=WebApp.REGION_CHOICES)
+    environment_variables = models.JSONField(default=dict)
+    # Inputs that differ from the previous revision, and the stages run for it
+    changed = models.JSONField(default=list)
+    stages = models.JSONField(default=list)
+    # Set when this revision redeployed the inputs of an older one
+    rollback_of = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-revision']
+        constraints = [
+            # Also the index for a webapp's revision history
+            models.UniqueConstraint(fields=['webapp', 'revision'], name='core_deployment_revision_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Revision {self.revision} of {self.webapp_id}"
+
+    @classmethod
+    def current_inputs(cls, webapp):
+        """
+        The inputs webapp and its environment hold now, i.e. those of the
+        latest revision. A webapp without an environment has no variables.
+        """
+        environment = getattr(webapp, 'environment', None)
+        inputs = {field: getattr(webapp, field) for field in cls.INPUT_FIELDS if field != 'environment_variables'}
+        inputs['environment_variables'] = environment.environment_variables if environment else {}
+        return inputs
+
+    def inputs(self):
+        return {field: getattr(self, field) for field in self.INPUT_FIELDS}
+
+
+class StageEvent(models.Model):
+    """
+    Timing of one pipeline stage of one deployment revision, written by
+    tasks.run_deployment_stage; aggregated by apps.core.analytics.
+    """
+    OUTCOME_CHOICES = [
+        ('success', 'Success'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Covered by core_stageevent_stage_uniq, so no separate FK index.
+    deployment = models.ForeignKey(Deployment, on_delete=models.CASCADE, related_name='stage_events', db_index=False)
+    stage = models.CharField(max_length=20)
+    outcome = models.CharField(max_length=10, choices=OUTCOME_CHOICES)
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    duration_ms = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['started_at']
+        constraints = [
+            models.UniqueConstraint(fields=['deployment', 'stage'], name='core_stageevent_stage_uniq'),
+        ]
+        indexes = [
+            # Time-window analytics
+            models.Index(fields=['finished_at'], name='core_stageevent_finished_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.stage} of {self.deployment_id}: {self.duration_ms}ms"
+
+
 class DeploymentLog(models.Model):
+    LEVEL_CHOICES = [
+        ('info', 'Info'),
+        ('success', 'Success'),
+        ('warning', 'Warning'),
+        ('error', 'Error'),
+    ]
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    instance = models.ForeignKey(Instance, on_delete=models.CASCADE, related_name='logs')
-    log_text = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Covered by core_log_instance_ts_idx, so no separate FK index.
+    instance = models.ForeignKey(Instance, on_delete=models.CASCADE, related_name='logs', db_index=False)
+    level = models.CharField(max_length=10, choices=LEVEL_CHOICES, default='info')
+    # Pipeline stage that emitted the line (see tasks.DEPLOYMENT_STAGES)
+    stage = models.CharField(max_length=20, blank=True, default='')
+    message = models.TextField()
+    # Set when the line is emitted, not when a buffered batch is written.
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # Per-instance tail/status queries and the (timestamp, id) cursor
+            models.Index(fields=['instance', 'timestamp', 'id'], name='core_log_instance_ts_idx'),
+            # Global /logs/ cursor pagination
+            models.Index(fields=['timestamp', 'id'], name='core_log_ts_idx'),
+            # ?level= / ?stage= filters, per instance and global
+            models.Index(fields=['instance', 'level', 'timestamp', 'id'], name='core_log_inst_level_ts_idx'),
+            models.Index(fields=['instance', 'stage', 'timestamp', 'id'], name='core_log_inst_stage_ts_idx'),
+            models.Index(fields=['level', 'timestamp', 'id'], name='core_log_level_ts_idx'),
+        ]
 
     def __str__(self):
         return f"Log for {self.instance.id}"
+
+    @property
+    def log_text(self):
+        """
+        The line as it was formatted before logs were structured.
+        """
+        return f"{self.timestamp:%Y-%m-%d %H:%M:%S} - [{self.level.upper()}] {self.message}"
+
+
+class DeploymentLogArchive(models.Model):
+    """
+    The compacted log lines of a finished deployment: one compressed blob
+    per instance instead of one DeploymentLog row per line. Written by the
+    compact_deployment_logs task, read through apps.core.logarchive.
+    """
+    COMPRESSION_CHOICES = [
+        ('gzip', 'gzip'),
+        ('zstd', 'Zstandard'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    instance = models.OneToOneField(Instance, on_delete=models.CASCADE, related_name='log_archive')
+    compression = models.CharField(max_length=10, choices=COMPRESSION_CHOICES, default='gzip')
+    data = models.BinaryField()
+    line_count = models.PositiveIntegerField(default=0)
+    size_bytes = models.PositiveIntegerField(default=0)
+    first_timestamp = models.DateTimeField(null=True)
+    last_timestamp = models.DateTimeField(null=True)
+    last_message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Age-based retention sweeps
+            models.Index(fields=['last_timestamp'], name='core_logarchive_last_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"Log archive for {self.instance_id}"
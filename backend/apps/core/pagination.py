@@ -0,0 +1,338 @@
+"""
+Pagination helpers for kuberns core app
+"""
+
+import base64
+import binascii
+import json
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class DeploymentLogCursorPagination(CursorPagination):
+    """
+    Newest-first log pages that stay stable while new lines are inserted.
+    """
+    ordering = ('-timestamp', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+def encode_log_cursor(log):
+    """
+    Opaque tail cursor for a DeploymentLog, keyed on (timestamp, id).
+    """
+    raw = f"{log.timestamp.isoformat()}|{log.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_log_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, log_id = raw.split('|', 1)
+        timestamp = parse_datetime(timestamp)
+        log_id = uuid.UUID(log_id)
+    except (ValueError, binascii.Error, UnicodeError):
+        timestamp = None
+
+    if timestamp is None:
+        raise serializers.ValidationError({"after": "Invalid log cursor"})
+
+    return timestamp, log_id
+
+
+def logs_after(queryset, cursor):
+    """
+    Filter a DeploymentLog queryset down to the lines written after `cursor`,
+    oldest first.
+    """
+    queryset = queryset.order_by('timestamp', 'id')
+    if not cursor:
+        return queryset
+
+    timestamp, log_id = decode_log_cursor(cursor)
+    return queryset.filter(
+        Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=log_id)
+    )
+
+
+def logs_before(queryset, cursor):
+    """
+    Filter a DeploymentLog queryset down to the lines written before
+    `cursor`, newest first.
+    """
+    queryset = queryset.order_by('-timestamp', '-id')
+    if not cursor:
+        return queryset
+
+    timestamp, log_id = decode_log_cursor(cursor)
+    return queryset.filter(
+        Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=log_id)
+    )
+
+
+class InstanceLogPagination(DeploymentLogCursorPagination):
+    """
+    DeploymentLogCursorPagination's pages and links for the lines of one
+    instance, which merge its archive with the live rows and so are not a
+    single queryset. paginate_lines() takes `fetch(before=, after=, limit=)`
+    returning the lines before a log cursor newest first, or after one
+    oldest first (logarchive.instance_logs_before / instance_logs).
+    """
+    directions = ('older', 'newer')
+
+    def paginate_lines(self, fetch, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        direction, position = self.decode_cursor(request) if cursor else ('older', None)
+
+        if direction == 'newer':
+            lines = fetch(after=position, limit=page_size + 1)
+            self.has_previous = len(lines) > page_size
+            page = lines[:page_size][::-1]
+            self.has_next = True
+        else:
+            lines = fetch(before=position, limit=page_size + 1)
+            self.has_next = len(lines) > page_size
+            page = lines[:page_size]
+            self.has_previous = position is not None
+
+        # An empty page keeps its own position for the links.
+        self.first_position = encode_log_cursor(page[0]) if page else position
+        self.last_position = encode_log_cursor(page[-1]) if page else position
+        return page
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        direction, _, position = cursor.partition('.')
+        if direction not in self.directions:
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            decode_log_cursor(position)
+        except serializers.ValidationError:
+            raise NotFound(self.invalid_cursor_message)
+        return direction, position
+
+    def _link(self, direction, position):
+        url = self.request.build_absolute_uri()
+        if position is None:
+            return remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, f'{direction}.{position}')
+
+    def get_next_link(self):
+        if not self.has_next or self.last_position is None:
+            return None
+        return self._link('older', self.last_position)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self._link('newer', self.first_position)
+
+
+def estimated_count(queryset):
+    """
+    Postgres' estimate of the queryset's row count, None on other backends:
+    pg_class.reltuples for a whole table, the planner's row estimate when
+    filtered. Both are as fresh as the table's last ANALYZE.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+            # -1 until the table is first analyzed
+            if row and row[0] >= 0:
+                return row[0]
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_rows(queryset):
+    """
+    (count, estimated). Exact up to PAGINATION_EXACT_COUNT_LIMIT rows, which
+    is counted under a LIMIT so it never scans further; above it, the
+    Postgres estimate, or None where there is none. A limit of 0 always
+    counts exactly.
+    """
+    limit = settings.PAGINATION_EXACT_COUNT_LIMIT
+    rows = queryset.order_by().values('pk')
+    if not limit:
+        return rows.count(), False
+
+    count = rows[:limit + 1].count()
+    if count <= limit:
+        return count, False
+
+    estimate = estimated_count(rows)
+    if estimate is None:
+        return None, False
+    # Stale statistics can put the estimate under what was just counted.
+    return max(estimate, count), True
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Count-free cursor pages for KeysetPageNumberPagination's ?pagination=cursor
+    mode; `ordering` is set per request to the keyset annotations.
+    """
+
+
+class KeysetPageNumberPagination(PageNumberPagination):
+    """
+    PageNumberPagination's response, with changes for large tables:
+
+    - the `next` link carries an ?after= cursor of the page's last row, so
+      walking forward seeks on the view's `keyset_ordering` index instead of
+      OFFSET-scanning every earlier row (?page=N alone still works);
+    - `count` is from count_rows() (through view.tenant_count(), which caches
+      it per tenant), so it may be an estimate (`count_estimated`) or null;
+    - ?pagination=cursor switches to KeysetCursorPagination: next/previous
+      cursors only, no count and no page numbers.
+    """
+    after_query_param = 'after'
+    mode_query_param = 'pagination'
+    keyset_ordering = ('-created_at', '-id')
+    invalid_page_message = 'Invalid page.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        ordering = getattr(view, 'keyset_ordering', self.keyset_ordering)
+        fields = [field.lstrip('-') for field in ordering]
+        keys = [f'keyset_{index}' for index in range(len(fields))]
+        annotated = queryset.annotate(**{key: F(field) for key, field in zip(keys, fields)})
+
+        self.cursor_pagination = None
+        if request.query_params.get(self.mode_query_param) == 'cursor':
+            self.cursor_pagination = KeysetCursorPagination()
+            self.cursor_pagination.page_size = page_size
+            self.cursor_pagination.ordering = [
+                f"{'-' if field.startswith('-') else ''}{key}" for field, key in zip(ordering, keys)
+            ]
+            return self.cursor_pagination.paginate_queryset(annotated, request, view)
+
+        try:
+            page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            page_number = 0
+        if page_number < 1:
+            raise NotFound(self.invalid_page_message)
+
+        tenant_count = getattr(view, 'tenant_count', None)
+        self.count, self.count_estimated = tenant_count(queryset) if tenant_count else count_rows(queryset)
+
+        queryset = annotated.order_by(*ordering)
+
+        after = request.query_params.get(self.after_query_param)
+        if after and page_number > 1:
+            try:
+                queryset = queryset.filter(keyset_after(ordering, decode_keyset_cursor(after, len(fields))))
+            except ValidationError:
+                raise serializers.ValidationError({"after": "Invalid page cursor"})
+            rows = list(queryset[:page_size + 1])
+        else:
+            offset = (page_number - 1) * page_size
+            rows = list(queryset[offset:offset + page_size + 1])
+
+        if not rows and page_number > 1:
+            raise NotFound(self.invalid_page_message)
+
+        self.request = request
+        self.page_number = page_number
+        self.has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        self.next_cursor = encode_keyset_cursor(rows[-1], keys) if self.has_next else None
+        return rows
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        return Response({
+            'count': self.count,
+            'count_estimated': self.count_estimated,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = replace_query_param(self.request.build_absolute_uri(), self.page_query_param, self.page_number + 1)
+        return replace_query_param(url, self.after_query_param, self.next_cursor)
+
+    def get_previous_link(self):
+        if self.page_number == 1:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.after_query_param)
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+
+def _cursor_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def encode_keyset_cursor(row, keys):
+    """
+    Opaque cursor holding a row's keyset values (a .values() dict or model).
+    """
+    values = [row[key] if isinstance(row, dict) else getattr(row, key) for key in keys]
+    raw = json.dumps([_cursor_value(value) for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_keyset_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, binascii.Error, UnicodeError):
+        values = None
+
+    if not isinstance(values, list) or len(values) != length or not all(isinstance(v, str) for v in values):
+        raise serializers.ValidationError({"after": "Invalid page cursor"})
+
+    return values
+
+
+def keyset_after(ordering, values):
+    """
+    Q for the rows after `values` in `ordering`, e.g. for ('-created_at', '-id'):
+    created_at <= v0 AND (created_at < v0 OR (created_at = v0 AND id < v1)).
+    The redundant leading bound is what lets the database range-scan the index.
+    """
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    first = ordering[0]
+    bound = 'lte' if first.startswith('-') else 'gte'
+    return Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & condition
@@ -0,0 +1,51 @@
+"""
+Plan catalog: the single source of plan specs for instance creation,
+provisioning and the metadata endpoint.
+"""
+
+PLAN_CATALOG = {
+    'starter': {
+        'instance': {'cpu': '0.5', 'ram': '512', 'storage': '10GB'},
+        'ec2_instance_type': 't3.micro',
+        # Celery priority of its deployment tasks (Redis broker: 0 runs first)
+        'deploy_priority': 6,
+        # Deployment logs: deleted after `days`, archives capped at `max_lines`
+        'log_retention': {'days': 14, 'max_lines': 5000},
+        'details': {
+            'cpu': '0.5 vCPU',
+            'ram': '512MB',
+            'bandwidth': '10GB/mo',
+            'price': '$10/mo',
+        },
+    },
+    'pro': {
+        'instance': {'cpu': '2', 'ram': '4096', 'storage': '100GB'},
+        'ec2_instance_type': 't3.medium',
+        'deploy_priority': 0,
+        'log_retention': {'days': 90, 'max_lines': 50000},
+        'details': {
+            'cpu': '2 vCPU',
+            'ram': '4GB',
+            'bandwidth': 'Unlimited',
+            'price': '$50/mo',
+        },
+    },
+}
+
+
+def instance_specs(plan):
+    """
+    Instance field values (cpu, ram, storage) for a plan.
+    """
+    return PLAN_CATALOG[plan]['instance']
+
+
+def log_retention(plan):
+    """
+    Deployment log retention policy ({'days', 'max_lines'}) for a plan.
+    """
+    return PLAN_CATALOG[plan]['log_retention']
+
+
+def plan_details():
+    return {plan: spec['details'] for plan, spec in PLAN_CATALOG.items()}
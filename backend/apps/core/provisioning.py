@@ -0,0 +1,386 @@
+"""
+Instance provisioning backends for kuberns core app.
+
+settings.DEPLOYMENT_PROVISIONER selects the backend used by the deployment
+pipeline:
+- MockProvisioner: assigns a fake public IP (default, no AWS access needed)
+- AsyncEC2Provisioner: boto3 run_instances, batched per region with a cap
+  on in-flight requests and retry with exponential backoff
+
+The pipeline launches with launch() and then checks for the public IP with
+one poll() per task, re-polling from a Celery countdown (see
+tasks.wait_for_public_ip) rather than holding a worker while it boots.
+provision() does both in one blocking call.
+FakeEC2Client is an in-process stand-in for the boto3 EC2 client so the
+async backend can be exercised and measured offline.
+"""
+
+import asyncio
+import hashlib
+import itertools
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .plans import PLAN_CATALOG
+from .scheduling import acquire_ec2_slot, release_ec2_slot
+
+
+RETRYABLE_ERRORS = {
+    'RequestLimitExceeded',
+    'Throttling',
+    'InsufficientInstanceCapacity',
+    'ServiceUnavailable',
+    'InternalError',
+}
+
+
+class ProvisionRequest:
+    """
+    `launch_key` identifies this launch of the instance (its deployment
+    revision), so a retried run_instances call is idempotent but a later
+    redeploy gets a new server.
+    """
+
+    def __init__(self, instance_id, region, instance_type, launch_key=''):
+        self.instance_id = str(instance_id)
+        self.region = region
+        self.instance_type = instance_type
+        self.launch_key = f"{self.instance_id}:{launch_key}"
+
+    @classmethod
+    def for_instance(cls, instance, launch_key=''):
+        webapp = instance.environment.webapp
+        return cls(instance.id, webapp.region, PLAN_CATALOG[webapp.plan]['ec2_instance_type'], launch_key)
+
+
+def client_token(requests):
+    """
+    run_instances ClientToken for a batch (at most 64 characters): a call
+    that timed out after EC2 accepted it returns the same instances when
+    retried instead of launching them again.
+    """
+    keys = '|'.join(sorted(request.launch_key for request in requests))
+    return hashlib.sha256(keys.encode()).hexdigest()
+
+
+class ProvisioningError(Exception):
+    pass
+
+
+class BaseProvisioner:
+    def provision(self, requests):
+        """
+        Provision every request; returns {instance_id: public_ip}.
+        """
+        raise NotImplementedError
+
+    def launch(self, requests):
+        """
+        Start every request without waiting for it to boot; returns
+        {instance_id: handle}, handles being JSON-serializable.
+        """
+        raise NotImplementedError
+
+    def poll(self, region, handles):
+        """
+        Check launched instances ({instance_id: handle}) once; returns
+        {instance_id: public_ip} for those that have one.
+        """
+        raise NotImplementedError
+
+
+class MockProvisioner(BaseProvisioner):
+    def provision(self, requests):
+        return self.launch(requests)
+
+    def launch(self, requests):
+        # The fake IP is the handle, ready on the first poll.
+        return {
+            request.instance_id: f"54.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(0, 255)}"
+            for request in requests
+        }
+
+    def poll(self, region, handles):
+        return dict(handles)
+
+
+class AsyncEC2Provisioner(BaseProvisioner):
+    """
+    Groups requests by region and instance type into run_instances calls of
+    at most `max_batch` instances. boto3 is synchronous, so calls run in
+    worker threads.
+
+    Each call holds one of its region's EC2_MAX_IN_FLIGHT slots shared by
+    every worker (scheduling.acquire_ec2_slot), so the cap holds across
+    concurrent deployments; `max_in_flight` also caps one invocation's own
+    calls. shared_slots=False keeps only the latter, for runs without Redis.
+    """
+
+    def __init__(self, client_factory=None, max_in_flight=None, max_batch=None,
+                 max_retries=None, backoff=0.5, poll_interval=None, ip_timeout=None,
+                 shared_slots=True, slot_wait=0.1):
+        self.client_factory = client_factory or self._boto3_client
+        self.max_in_flight = max_in_flight or settings.EC2_MAX_IN_FLIGHT
+        self.shared_slots = shared_slots
+        self.slot_wait = slot_wait
+        self.max_batch = max_batch or settings.EC2_MAX_BATCH
+        self.max_retries = settings.EC2_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = backoff
+        self.poll_interval = poll_interval or settings.EC2_IP_POLL_INTERVAL
+        self.ip_timeout = ip_timeout or settings.EC2_IP_TIMEOUT
+        self._clients = {}
+
+    @staticmethod
+    def _boto3_client(region):
+        import boto3
+        return boto3.client('ec2', region_name=region)
+
+    def provision(self, requests):
+        return asyncio.run(self.provision_async(requests))
+
+    def launch(self, requests):
+        return asyncio.run(self.launch_async(requests))
+
+    def poll(self, region, handles):
+        return asyncio.run(self.poll_async(region, handles))
+
+    def _batches(self, requests):
+        groups = defaultdict(list)
+        for request in requests:
+            groups[(request.region, request.instance_type)].append(request)
+
+        return [
+            (region, instance_type, group[start:start + self.max_batch])
+            for (region, instance_type), group in groups.items()
+            for start in range(0, len(group), self.max_batch)
+        ]
+
+    async def provision_async(self, requests):
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        results = await asyncio.gather(*(
+            self._provision_batch(semaphore, region, instance_type, batch)
+            for region, instance_type, batch in self._batches(requests)
+        ))
+
+        public_ips = {}
+        for result in results:
+            public_ips.update(result)
+        return public_ips
+
+    async def launch_async(self, requests):
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        results = await asyncio.gather(*(
+            self._launch_batch(semaphore, region, instance_type, batch)
+            for region, instance_type, batch in self._batches(requests)
+        ))
+
+        handles = {}
+        for ec2_ids in results:
+            handles.update({instance_id: ec2_id for ec2_id, instance_id in ec2_ids.items()})
+        return handles
+
+    async def poll_async(self, region, handles):
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        ec2_ids = {ec2_id: instance_id for instance_id, ec2_id in handles.items()}
+        return await self._describe_public_ips(semaphore, region, ec2_ids)
+
+    def _client(self, region):
+        if region not in self._clients:
+            self._clients[region] = self.client_factory(region)
+        return self._clients[region]
+
+    @asynccontextmanager
+    async def _slot(self, semaphore, region):
+        async with semaphore:
+            token = uuid.uuid4().hex if self.shared_slots else None
+            while token and not await asyncio.to_thread(acquire_ec2_slot, region, token):
+                await asyncio.sleep(self.slot_wait * random.uniform(0.5, 1.5))
+            try:
+                yield
+            finally:
+                if token:
+                    await asyncio.to_thread(release_ec2_slot, region, token)
+
+    async def _call(self, semaphore, region, method, **kwargs):
+        client = self._client(region)
+        for attempt in itertools.count():
+            async with self._slot(semaphore, region):
+                try:
+                    return await asyncio.to_thread(getattr(client, method), **kwargs)
+                except ClientError as e:
+                    code = e.response.get('Error', {}).get('Code')
+                    if code not in RETRYABLE_ERRORS or attempt >= self.max_retries:
+                        raise ProvisioningError(f"{method} failed in {region}: {code}") from e
+            # Back off outside the semaphore so other batches can proceed.
+            await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    async def _provision_batch(self, semaphore, region, instance_type, batch):
+        ec2_ids = await self._launch_batch(semaphore, region, instance_type, batch)
+        return await self._wait_for_public_ips(semaphore, region, ec2_ids)
+
+    async def _launch_batch(self, semaphore, region, instance_type, batch):
+        """
+        Returns {ec2_id: instance_id}.
+        """
+        ec2_ids = {}
+        pending = list(batch)
+
+        # run_instances may launch fewer than MaxCount; relaunch the rest.
+        for attempt in itertools.count():
+            response = await self._call(
+                semaphore, region, 'run_instances',
+                ImageId=settings.EC2_AMI_IDS[region],
+                InstanceType=instance_type,
+                MinCount=1,
+                MaxCount=len(pending),
+                ClientToken=client_token(pending),
+            )
+            launched = response['Instances']
+            for request, ec2_instance in zip(pending, launched):
+                ec2_ids[ec2_instance['InstanceId']] = request.instance_id
+            pending = pending[len(launched):]
+            if not pending:
+                break
+            if attempt >= self.max_retries:
+                raise ProvisioningError(f"Could not launch {len(pending)} instances in {region}")
+
+        return ec2_ids
+
+    async def _describe_public_ips(self, semaphore, region, ec2_ids):
+        """
+        One describe_instances call; {instance_id: public_ip} of the
+        instances in `ec2_ids` ({ec2_id: instance_id}) that have one.
+        """
+        public_ips = {}
+        response = await self._call(
+            semaphore, region, 'describe_instances', InstanceIds=sorted(ec2_ids)
+        )
+        for reservation in response['Reservations']:
+            for ec2_instance in reservation['Instances']:
+                public_ip = ec2_instance.get('PublicIpAddress')
+                if public_ip and ec2_instance['InstanceId'] in ec2_ids:
+                    public_ips[ec2_ids[ec2_instance['InstanceId']]] = public_ip
+        return public_ips
+
+    async def _wait_for_public_ips(self, semaphore, region, ec2_ids):
+        public_ips = {}
+        waiting = dict(ec2_ids)
+        deadline = time.monotonic() + self.ip_timeout
+
+        while waiting:
+            ready = await self._describe_public_ips(semaphore, region, waiting)
+            public_ips.update(ready)
+            waiting = {
+                ec2_id: instance_id for ec2_id, instance_id in waiting.items()
+                if instance_id not in ready
+            }
+
+            if waiting:
+                if time.monotonic() > deadline:
+                    raise ProvisioningError(f"Timed out waiting for public IPs in {region}")
+                await asyncio.sleep(self.poll_interval)
+
+        return public_ips
+
+
+class FakeEC2Client:
+    """
+    In-process stub of the boto3 EC2 client calls used above.
+
+    `latency` is the simulated round trip per call, `throttle_rate` the
+    fraction of calls rejected with RequestLimitExceeded (and
+    `throttle_first` the number of first calls always rejected) and
+    `boot_polls` the number of describe_instances calls before an instance
+    has an IP. run_instances launches at most `max_launch` instances per
+    call, and the first `lost_responses` calls fail with InternalError
+    after launching, as a timeout would. ClientToken is honoured as EC2
+    does. Call counts and peak concurrency are recorded for measurements.
+    """
+
+    def __init__(self, region='us-east-1', latency=0.05, throttle_rate=0.0, boot_polls=1,
+                 throttle_first=0, max_launch=None, lost_responses=0):
+        self.region = region
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.throttle_first = throttle_first
+        self.boot_polls = boot_polls
+        self.max_launch = max_launch
+        self.lost_responses = lost_responses
+        self.calls = defaultdict(int)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._instances = {}
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    @property
+    def launched(self):
+        return len(self._instances)
+
+    @staticmethod
+    def _error(code, method):
+        return ClientError({'Error': {'Code': code, 'Message': code}}, method)
+
+    def _enter(self, method):
+        with self._lock:
+            self.calls[method] += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            throttled = self.throttle_first > 0
+            self.throttle_first -= throttled
+        try:
+            time.sleep(self.latency)
+            if throttled or random.random() < self.throttle_rate:
+                raise self._error('RequestLimitExceeded', method)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def run_instances(self, ImageId, InstanceType, MinCount, MaxCount, ClientToken=None, **kwargs):
+        self._enter('RunInstances')
+        with self._lock:
+            launched = self._tokens.get(ClientToken)
+            if launched is None:
+                launched = []
+                for _ in range(min(MaxCount, self.max_launch or MaxCount)):
+                    ec2_id = f"i-{random.getrandbits(68):017x}"
+                    self._instances[ec2_id] = 0
+                    launched.append({'InstanceId': ec2_id, 'InstanceType': InstanceType, 'State': {'Name': 'pending'}})
+                if ClientToken:
+                    self._tokens[ClientToken] = launched
+            lost = self.lost_responses > 0
+            self.lost_responses -= lost
+        if lost:
+            raise self._error('InternalError', 'RunInstances')
+        return {'Instances': launched}
+
+    def describe_instances(self, InstanceIds, **kwargs):
+        self._enter('DescribeInstances')
+        instances = []
+        with self._lock:
+            for ec2_id in InstanceIds:
+                self._instances[ec2_id] += 1
+                instance = {'InstanceId': ec2_id, 'State': {'Name': 'pending'}}
+                if self._instances[ec2_id] >= self.boot_polls:
+                    instance['State'] = {'Name': 'running'}
+                    instance['PublicIpAddress'] = f"54.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(0, 255)}"
+                instances.append(instance)
+        return {'Reservations': [{'Instances': instances}]}
+
+
+_provisioner = None
+
+
+def get_provisioner():
+    global _provisioner
+    if _provisioner is None:
+        _provisioner = import_string(settings.DEPLOYMENT_PROVISIONER)()
+    return _provisioner
@@ -0,0 +1,84 @@
+"""
+Read-replica routing.
+
+When a 'replica' database is configured (DATABASE_REPLICA_URL), the
+read-only actions of the API viewsets (ReplicaReadMixin.replica_actions)
+run their queries against it; all other requests, and every write, use
+'default'. The alias is chosen per request through a context variable, so
+a background task or management command is never routed.
+
+Replication lags, so a client that has just written (any successful
+unsafe request, e.g. WebAppViewSet.create) gets the REPLICA_PIN_COOKIE
+for REPLICA_PIN_SECONDS and reads from 'default' until it expires: the
+new app is in its list and its detail/status/logs do not 404.
+"""
+
+import contextvars
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+REPLICA_ALIAS = 'replica'
+REPLICA_PIN_COOKIE = 'kuberns_read_primary'
+
+_read_alias = contextvars.ContextVar('read_alias', default=None)
+
+
+def replica_enabled():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+class ReplicaRouter:
+    """
+    Reads go to the alias selected for the current request, if any; writes
+    always go to 'default', even for rows loaded from the replica. Only
+    'default' is migrated: the replica gets its schema by replication.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary.
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA_ALIAS}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadMixin:
+    """
+    Routes the viewset's `replica_actions` to the replica unless the client
+    is pinned to the primary, and pins clients after they write.
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (
+            self.action in self.replica_actions
+            and replica_enabled()
+            and REPLICA_PIN_COOKIE not in request.COOKIES
+        ):
+            self._read_alias_token = _read_alias.set(REPLICA_ALIAS)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_read_alias_token', None)
+        if token is not None:
+            _read_alias.reset(token)
+            self._read_alias_token = None
+
+        if request.method not in SAFE_METHODS and response.status_code < 400 and replica_enabled():
+            response.set_cookie(
+                REPLICA_PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,202 @@
+"""
+Deployment scheduling: queue routing, plan priorities and admission control.
+
+Every deployment stage runs on its region's Celery queue
+(deployments.<region>), so a burst in one region cannot hold up another
+and workers can be sized per region. Each plan has a broker priority
+(PLAN_CATALOG 'deploy_priority'; 0 is served first by the Redis broker).
+
+A deployment only starts once it holds a slot in its region's and its
+owner's in-flight set (DEPLOYMENT_MAX_IN_FLIGHT_PER_REGION/_PER_OWNER).
+Slots are leases in Redis sorted sets, so a crashed worker's slot expires
+after DEPLOYMENT_SLOT_LEASE seconds. Deployments that find no slot are
+re-queued after DEPLOYMENT_ADMISSION_RETRY seconds. If Redis is
+unreachable, deployments are admitted rather than blocked.
+
+The same leases cap the EC2 API calls in flight per region across all
+workers (EC2_MAX_IN_FLIGHT, see provisioning.AsyncEC2Provisioner).
+"""
+
+import logging
+import time
+
+import redis
+from django.conf import settings
+
+from .metrics import DEPLOYMENT_QUEUE_WAIT
+from .models import WebApp
+from .plans import PLAN_CATALOG
+
+logger = logging.getLogger(__name__)
+
+REGION_SLOTS_KEY = "kuberns:deployments:in-flight:region:{}"
+OWNER_SLOTS_KEY = "kuberns:deployments:in-flight:owner:{}"
+EC2_SLOTS_KEY = "kuberns:ec2:in-flight:{}"
+
+# KEYS: slot sets. ARGV: member, now, lease expiry, then one limit per key.
+# Admits only if every set has room (or already holds the member).
+ACQUIRE_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', ARGV[2])
+    if not redis.call('ZSCORE', key, ARGV[1]) and redis.call('ZCARD', key) >= tonumber(ARGV[3 + i]) then
+        return 0
+    end
+end
+for _, key in ipairs(KEYS) do
+    redis.call('ZADD', key, ARGV[3], ARGV[1])
+end
+return 1
+"""
+
+_client = None
+_acquire = None
+
+
+def get_client():
+    global _client, _acquire
+    if _client is None:
+        _client = redis.Redis.from_url(settings.DEPLOYMENT_SCHEDULER_URL)
+        _acquire = _client.register_script(ACQUIRE_SCRIPT)
+    return _client
+
+
+def deployment_queue(region):
+    return f"deployments.{region}"
+
+
+def deployment_queues():
+    return [deployment_queue(region) for region, _ in WebApp.REGION_CHOICES]
+
+
+def dispatch_options(webapp):
+    """
+    apply_async() routing options for every stage of a webapp's deployment.
+    """
+    return {
+        "queue": deployment_queue(webapp.region),
+        "priority": PLAN_CATALOG[webapp.plan]['deploy_priority'],
+    }
+
+
+def deployment_signature(instance_id, webapp, stages=None):
+    """
+    The first pipeline stage, routed and prioritised for the webapp. The
+    enqueue time travels in the stage context so the wait until admission
+    can be measured, along with the stages to run when a redeploy skips
+    some (see tasks.deployment_stages).
+    """
+    from .tasks import DEPLOYMENT_STAGES, run_deployment_stage
+
+    context = {"queued_at": time.time()}
+    if stages is not None:
+        context["stages"] = list(stages)
+    return run_deployment_stage.signature(
+        (str(instance_id), DEPLOYMENT_STAGES[0][0], context),
+        **dispatch_options(webapp),
+    )
+
+
+def _slot_limits(webapp):
+    keys, limits = [], []
+    if getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False):
+        # Eager runs are sequential, and a retry would recurse in place.
+        return keys, limits
+    if settings.DEPLOYMENT_MAX_IN_FLIGHT_PER_REGION:
+        keys.append(REGION_SLOTS_KEY.format(webapp.region))
+        limits.append(settings.DEPLOYMENT_MAX_IN_FLIGHT_PER_REGION)
+    if settings.DEPLOYMENT_MAX_IN_FLIGHT_PER_OWNER and webapp.owner_id:
+        keys.append(OWNER_SLOTS_KEY.format(webapp.owner_id))
+        limits.append(settings.DEPLOYMENT_MAX_IN_FLIGHT_PER_OWNER)
+    return keys, limits
+
+
+def acquire_slot(instance):
+    """
+    Try to admit the deployment; False means the region or owner is at its
+    in-flight limit.
+    """
+    webapp = instance.environment.webapp
+    keys, limits = _slot_limits(webapp)
+    if not keys:
+        return True
+
+    now = time.time()
+    try:
+        get_client()
+        return bool(_acquire(keys=keys, args=[str(instance.id), now, now + settings.DEPLOYMENT_SLOT_LEASE, *limits]))
+    except redis.RedisError:
+        logger.warning("Admission control unavailable; admitting instance %s", instance.id, exc_info=True)
+        return True
+
+
+def release_slot(instance):
+    keys, _ = _slot_limits(instance.environment.webapp)
+    if not keys:
+        return
+    try:
+        pipe = get_client().pipeline(transaction=False)
+        for key in keys:
+            pipe.zrem(key, str(instance.id))
+        pipe.execute()
+    except redis.RedisError:
+        logger.warning("Could not release the slot of instance %s", instance.id, exc_info=True)
+
+
+def acquire_ec2_slot(region, token):
+    """
+    Try to take one of the region's EC2_MAX_IN_FLIGHT call slots for
+    `token`; False means they are all taken.
+    """
+    now = time.time()
+    try:
+        get_client()
+        return bool(_acquire(
+            keys=[EC2_SLOTS_KEY.format(region)],
+            args=[token, now, now + settings.EC2_SLOT_LEASE, settings.EC2_MAX_IN_FLIGHT],
+        ))
+    except redis.RedisError:
+        logger.warning("EC2 call limiter unavailable; admitting call in %s", region, exc_info=True)
+        return True
+
+
+def release_ec2_slot(region, token):
+    try:
+        get_client().zrem(EC2_SLOTS_KEY.format(region), token)
+    except redis.RedisError:
+        logger.warning("Could not release EC2 call slot in %s", region, exc_info=True)
+
+
+def record_admission(instance, context):
+    queued_at = context.pop("queued_at", None)
+    if queued_at is not None and settings.METRICS_ENABLED:
+        webapp = instance.environment.webapp
+        DEPLOYMENT_QUEUE_WAIT.observe(max(time.time() - queued_at, 0), region=webapp.region, plan=webapp.plan)
+
+
+def queue_depths():
+    """
+    Messages waiting on each region queue, over all priority levels (see
+    CELERY_BROKER_TRANSPORT_OPTIONS). Countdown (ETA) messages already
+    reserved by workers are not included.
+    """
+    options = settings.CELERY_BROKER_TRANSPORT_OPTIONS
+    sep = options['sep']
+    pipe = get_client().pipeline(transaction=False)
+    queues = deployment_queues()
+    for queue in queues:
+        for step in options['priority_steps']:
+            pipe.llen(f"{queue}{sep}{step}" if step else queue)
+    lengths = iter(pipe.execute())
+    return {queue: sum(next(lengths) for _ in options['priority_steps']) for queue in queues}
+
+
+def in_flight():
+    """
+    Admitted, unfinished deployments per region.
+    """
+    now = time.time()
+    pipe = get_client().pipeline(transaction=False)
+    regions = [region for region, _ in WebApp.REGION_CHOICES]
+    for region in regions:
+        pipe.zcount(REGION_SLOTS_KEY.format(region), now, '+inf')
+    return dict(zip(regions, pipe.execute()))
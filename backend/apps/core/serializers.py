@@ -1,5 +1,7 @@
+from django.db import transaction
 from rest_framework import serializers
-from .models import WebApp, Environment, Instance, DeploymentLog, DatabaseConfig
+from .models import WebApp, Environment, Instance, Deployment, DeploymentLog, DatabaseConfig, StageEvent
+from .plans import instance_specs
 
 
 
@@ -8,7 +10,7 @@ from .models import WebApp, Environment, Instance, DeploymentLog, DatabaseConfig
 class DeploymentLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = DeploymentLog
-        fields = ['id', 'log_text', 'timestamp']
+        fields = ['id', 'level', 'stage', 'message', 'timestamp']
         read_only_fields = ['id', 'timestamp']
 
 
@@ -16,13 +18,19 @@ class DeploymentLogSerializer(serializers.ModelSerializer):
 
 
 class InstanceSerializer(serializers.ModelSerializer):
-    logs = DeploymentLogSerializer(many=True, read_only=True)
+    """
+    Logs are not embedded; log_count and latest_log come from
+    Instance.objects.with_log_summary() and the full history is served by
+    the paginated /logs/ resource.
+    """
+    log_count = serializers.IntegerField(read_only=True)
+    latest_log = serializers.CharField(read_only=True, allow_null=True)
 
     class Meta:
         model = Instance
         fields = ['id', 'cpu', 'ram', 'storage', 'status', 'public_ip',
-                  'created_at', 'updated_at', 'logs']
-        read_only_fields = ['id', 'created_at', 'updated_at', 'logs']
+                  'created_at', 'updated_at', 'log_count', 'latest_log']
+        read_only_fields = ['id', 'created_at', 'updated_at']
 
 
 
@@ -69,6 +77,74 @@ class WebAppListSerializer(serializers.ModelSerializer):
 
 
 
+def build_webapp_rows(validated_data):
+    """
+    Unsaved WebApp, Environment, Instance, (optional) DatabaseConfig and
+    the revision 1 Deployment for one validated create payload. Primary
+    keys are client-side UUIDs, so the rows can be saved one by one or with
+    bulk_create.
+    """
+    from .tasks import deployment_stages
+
+    validated_data = dict(validated_data)
+    environment_data = validated_data.pop('environment')
+    database_data = validated_data.pop('database_config', None)
+
+    webapp = WebApp(**validated_data)
+
+    env = Environment(
+        webapp=webapp,
+        port=environment_data['port'],
+        environment_variables=environment_data.get('environment_variables', {})
+    )
+
+    instance = Instance(
+        environment=env,
+        status='pending',
+        **instance_specs(validated_data['plan'])
+    )
+
+    database_config = None
+    if validated_data.get('database_enabled') and database_data is not None:
+        database_config = DatabaseConfig(
+            webapp=webapp,
+            engine=validated_data['database_type'],
+            name=database_data.get("name", f"{webapp.name}_db"),
+            username=database_data.get("username", "db_user")
+        )
+
+    deployment = Deployment(
+        webapp=webapp,
+        revision=1,
+        environment_variables=env.environment_variables,
+        stages=deployment_stages(),
+        **{field: validated_data[field] for field in ('repo', 'branch', 'plan', 'region')}
+    )
+
+    return webapp, env, instance, database_config, deployment
+
+
+
+
+
+class WebAppBulkCreateSerializer(serializers.ListSerializer):
+    """
+    Inserts each model tier with a single bulk_create inside one transaction.
+    """
+
+    def create(self, validated_data):
+        rows = [build_webapp_rows(item) for item in validated_data]
+
+        with transaction.atomic():
+            for model, tier in zip((WebApp, Environment, Instance, DatabaseConfig, Deployment), zip(*rows)):
+                model.objects.bulk_create([obj for obj in tier if obj is not None])
+
+        return [webapp for webapp, *_ in rows]
+
+
+
+
+
 class WebAppCreateSerializer(serializers.ModelSerializer):
     environment = serializers.DictField(required=True)
     database_config = serializers.DictField(required=False, allow_null=True)
@@ -80,6 +156,7 @@ class WebAppCreateSerializer(serializers.ModelSerializer):
             'repo', 'branch', 'database_enabled', 'database_type',
             'environment', 'database_config'
         ]
+        list_serializer_class = WebAppBulkCreateSerializer
 
     
     
@@ -152,40 +229,15 @@ class WebAppCreateSerializer(serializers.ModelSerializer):
     
     
     def create(self, validated_data):
-        environment_data = validated_data.pop('environment')
-        database_data = validated_data.pop('database_config', None)
-
-        
-        webapp = WebApp.objects.create(**validated_data)
-
-        
-        env = Environment.objects.create(
-            webapp=webapp,
-            port=environment_data['port'],
-            environment_variables=environment_data.get('environment_variables', {})
-        )
-
-        
-        plan = validated_data.get('plan')
-        cpu, ram, storage = ('2', '4096', '100GB') if plan == 'pro' else ('0.5', '512', '10GB')
-
-        
-        Instance.objects.create(
-            environment=env,
-            cpu=cpu,
-            ram=ram,
-            storage=storage,
-            status='pending'
-        )
+        webapp, env, instance, database_config, deployment = build_webapp_rows(validated_data)
 
-        
-        if validated_data.get('database_enabled') and database_data is not None:
-            DatabaseConfig.objects.create(
-                webapp=webapp,
-                engine=validated_data['database_type'],
-                name=database_data.get("name", f"{webapp.name}_db"),
-                username=database_data.get("username", "db_user")
-            )
+        with transaction.atomic():
+            webapp.save()
+            env.save()
+            instance.save()
+            if database_config is not None:
+                database_config.save()
+            deployment.save()
 
         return webapp
 
@@ -206,3 +258,60 @@ class WebAppDetailSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at',
             'environment', 'database_config'
         ]
+
+
+
+
+
+class StageEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StageEvent
+        fields = ['stage', 'outcome', 'started_at', 'finished_at', 'duration_ms']
+        read_only_fields = fields
+
+
+
+
+
+class DeploymentSerializer(serializers.ModelSerializer):
+    """
+    stage_events expects the queryset to prefetch them.
+    """
+    stage_events = StageEventSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Deployment
+        fields = ['id', 'revision', 'repo', 'branch', 'plan', 'region',
+                  'environment_variables', 'changed', 'stages', 'rollback_of',
+                  'created_at', 'stage_events']
+        read_only_fields = fields
+
+
+
+
+
+class RedeploySerializer(serializers.Serializer):
+    """
+    New inputs for POST /webapps/{id}/redeploy/; omitted ones keep their
+    current value. `revision` instead redeploys an older revision's inputs
+    (rollback) and cannot be combined with them.
+    """
+    repo = serializers.CharField(required=False, max_length=255)
+    branch = serializers.CharField(required=False, max_length=255)
+    plan = serializers.ChoiceField(required=False, choices=WebApp.PLAN_CHOICES)
+    region = serializers.ChoiceField(required=False, choices=WebApp.REGION_CHOICES)
+    environment_variables = serializers.DictField(required=False)
+    revision = serializers.IntegerField(required=False, min_value=1)
+
+    def validate_environment_variables(self, env_vars):
+        for key, value in env_vars.items():
+            if not key or not value:
+                raise serializers.ValidationError(f"Invalid environment variable: {key}={value}")
+        return env_vars
+
+    def validate(self, data):
+        if 'revision' in data and len(data) > 1:
+            raise serializers.ValidationError({
+                "revision": "A rollback redeploys that revision's inputs unchanged"
+            })
+        return data
@@ -0,0 +1,117 @@
+"""
+Write-through cache of the /webapps/{id}/status/ payload.
+
+Only the deployment pipeline changes an instance's status, IP and logs, so
+it writes the payload here at every stage transition and log flush; the
+status action reads it and only falls back to the database on a miss.
+Backed by the 'deployment_status' cache alias (Redis in production so web
+and Celery processes share it). Cache outages degrade to database reads.
+
+Entries carry the app's tenant (owner and organization) next to the
+payload, so a hit is only served to that tenant.
+"""
+
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from redis import RedisError
+
+from .logarchive import recent_logs
+from .fastpath import log_rows
+
+logger = logging.getLogger(__name__)
+
+STATUS_LOG_LINES = 20
+
+
+def _cache():
+    return caches['deployment_status']
+
+
+def _key(webapp_id):
+    return f"deployment-status:{uuid.UUID(str(webapp_id))}"
+
+
+def build_status(webapp, instance, logs):
+    """
+    `logs` are the newest STATUS_LOG_LINES DeploymentLog rows, newest first.
+    """
+    return {
+        "id": str(webapp.id),
+        "name": webapp.name,
+        "instance_status": instance.status,
+        "public_ip": instance.public_ip,
+        "logs": log_rows(logs),
+    }
+
+
+def _entry(webapp, payload):
+    return {"owner_id": webapp.owner_id, "organization": webapp.organization, "payload": payload}
+
+
+def _read(key):
+    entry = _cache().get(key)
+    # Entries written before they carried the tenant are misses.
+    if not isinstance(entry, dict) or "payload" not in entry:
+        return None
+    return entry
+
+
+def get_status(webapp_id, owner_id, organization=None):
+    """
+    The cached payload, or None on a miss or when the app is not the
+    tenant's (owner_id, optionally narrowed to organization).
+    """
+    try:
+        entry = _read(_key(webapp_id))
+    except ValueError:
+        return None
+    except RedisError:
+        logger.warning("Status cache read failed for webapp %s", webapp_id, exc_info=True)
+        return None
+
+    if entry is None or entry["owner_id"] != owner_id:
+        return None
+    if organization and entry["organization"] != organization:
+        return None
+    return entry["payload"]
+
+
+def add_status(webapp, payload):
+    """
+    Populate after a database read. add() never overwrites, so a stale read
+    cannot clobber a newer payload written by the pipeline meanwhile.
+    """
+    try:
+        _cache().add(_key(webapp.id), _entry(webapp, payload), settings.DEPLOYMENT_STATUS_CACHE_TIMEOUT)
+    except RedisError:
+        logger.warning("Status cache write failed for webapp %s", webapp.id, exc_info=True)
+
+
+def write_status(instance, new_logs=()):
+    """
+    Write through the instance's current status plus any newly flushed log
+    lines (oldest first). Called by the deployment pipeline.
+    """
+    webapp = instance.environment.webapp
+    key = _key(webapp.id)
+    try:
+        cached = _read(key)
+        if cached is None:
+            logs = recent_logs(instance, STATUS_LOG_LINES)
+            payload = build_status(webapp, instance, logs)
+        else:
+            payload = build_status(webapp, instance, list(reversed(new_logs)))
+            payload["logs"] = (payload["logs"] + cached["payload"]["logs"])[:STATUS_LOG_LINES]
+        _cache().set(key, _entry(webapp, payload), settings.DEPLOYMENT_STATUS_CACHE_TIMEOUT)
+    except RedisError:
+        logger.warning("Status cache write failed for webapp %s", webapp.id, exc_info=True)
+
+
+def delete_status(webapp_id):
+    try:
+        _cache().delete(_key(webapp_id))
+    except RedisError:
+        logger.warning("Status cache delete failed for webapp %s", webapp_id, exc_info=True)
@@ -3,20 +3,135 @@ Celery tasks for kuberns deployment simulation
 """
 
 import time
-import random
+from datetime import timedelta
+
 from celery import shared_task
+from django.conf import settings
 from django.utils import timezone
-from .models import Instance, DeploymentLog
+from django.utils.dateparse import parse_datetime
+from .events import publish_event
+from .logarchive import compact_logs, enforce_retention
+from .logsink import DeploymentLogSink
+from .metrics import record_stage
+from .models import Deployment, Instance, StageEvent
+from .provisioning import ProvisionRequest, ProvisioningError, get_provisioner
+from .scheduling import acquire_slot, dispatch_options, record_admission, release_slot
+from .status_cache import write_status
 
 
-def add_log(instance, text):
+def set_status(instance, log, status, **fields):
     """
-    Helper function to create timestamped logs.
+    Persist a status transition and announce it to event subscribers.
+    Buffered log lines are flushed first so they precede the transition.
     """
-    DeploymentLog.objects.create(
-        instance=instance,
-        log_text=f"{timezone.now().strftime('%Y-%m-%d %H:%M:%S')} - {text}"
-    )
+    log.flush()
+
+    instance.status = status
+    for name, value in fields.items():
+        setattr(instance, name, value)
+    instance.save(update_fields=['status', *fields, 'updated_at'])
+    write_status(instance)
+
+    publish_event(instance.environment.webapp_id, "status", {
+        "status": instance.status,
+        "public_ip": instance.public_ip,
+    })
+
+
+def _received(instance, log, context):
+    log.add("Deployment task received.")
+
+
+def _deploying(instance, log, context):
+    set_status(instance, log, "deploying")
+    log.add("Deployment started...")
+
+
+def _provisioning(instance, log, context):
+    set_status(instance, log, "provisioning")
+    log.add("Provisioning cloud resources...")
+
+
+def _ec2(instance, log, context):
+    launch_ec2_instance(instance, log, context)
+    # Usually not booted yet; wait_for_public_ip then polls on a countdown.
+    public_ip = poll_public_ip(instance, context)
+    if public_ip is not None and claim_public_ip(instance, public_ip):
+        ec2_provisioned(log, context, public_ip)
+
+
+def _active(instance, log, context):
+    log.add("Deployment completed successfully!", level="success")
+    # A redeploy that skipped provisioning keeps the instance's address.
+    set_status(instance, log, "active", public_ip=context.get("public_ip", instance.public_ip))
+
+
+# Ordered pipeline. Each stage is a short task; the wait before the next one
+# (settings.DEPLOYMENT_STAGE_DELAYS) is a Celery countdown, not a sleep, so
+# workers are never held idle between stages. The ec2 stage's wait for the
+# instance's public IP is likewise a chain of wait_for_public_ip tasks.
+DEPLOYMENT_STAGES = [
+    ('received', _received),
+    ('deploying', _deploying),
+    ('provisioning', _provisioning),
+    ('ec2', _ec2),
+    ('active', _active),
+]
+
+STAGE_HANDLERS = dict(DEPLOYMENT_STAGES)
+STAGE_ORDER = {stage: index for index, (stage, _) in enumerate(DEPLOYMENT_STAGES)}
+
+# Deployment inputs each stage depends on. A redeploy skips the stages whose
+# inputs did not change; stages not listed here always run.
+STAGE_INPUTS = {
+    'deploying': ('repo', 'branch', 'environment_variables'),
+    'provisioning': ('plan', 'region'),
+    'ec2': ('plan', 'region'),
+}
+
+
+def deployment_stages(changed=None):
+    """
+    Stages to run for a deployment whose inputs in `changed` differ from
+    the previous revision; every stage when changed is None (first deploy).
+    """
+    return [
+        stage for stage, _ in DEPLOYMENT_STAGES
+        if changed is None or stage not in STAGE_INPUTS or set(STAGE_INPUTS[stage]) & set(changed)
+    ]
+
+
+def next_stage(stage, context):
+    """
+    The stage after `stage`, limited to context["stages"] when the
+    deployment runs only some of them.
+    """
+    stages = context.get("stages")
+    for candidate, _ in DEPLOYMENT_STAGES[STAGE_ORDER[stage] + 1:]:
+        if stages is None or candidate in stages:
+            return candidate
+    return None
+
+
+def finish_stage(context, stage, outcome, started_at, seconds):
+    """
+    Record a finished stage: its duration histogram in /metrics and a
+    StageEvent on the deployment revision (context["deployment"]).
+    """
+    record_stage(stage, outcome, seconds)
+    if context.get("deployment"):
+        StageEvent.objects.create(
+            deployment_id=context["deployment"],
+            stage=stage,
+            outcome=outcome,
+            started_at=started_at,
+            finished_at=started_at + timedelta(seconds=seconds),
+            duration_ms=round(seconds * 1000),
+        )
+
+
+def stage_delay(stage):
+    return settings.DEPLOYMENT_STAGE_DELAYS.get(stage, 0) * settings.DEPLOYMENT_TIME_SCALE
 
 
 @shared_task
@@ -24,70 +139,224 @@ def deploy_instance(instance_id):
     """
     Full deployment simulation engine:
     pending → deploying → provisioning → active
+    Runs the first stage inline; the rest are scheduled by run_deployment_stage.
     """
+    return run_deployment_stage(instance_id, DEPLOYMENT_STAGES[0][0])
+
+
+@shared_task
+def run_deployment_stage(instance_id, stage, context=None):
+    """
+    Run one pipeline stage and schedule the next one.
+    Each stage is claimed on the instance row before it runs, so a
+    redelivered or duplicated message (and a stage for an instance that no
+    longer exists or already finished) is skipped.
+    """
+    context = context or {}
+    skipped = {"status": "skipped", "instance_id": str(instance_id), "stage": stage}
 
     try:
-        instance = Instance.objects.get(id=instance_id)
-
-        
-        add_log(instance, "[INFO] Deployment task received.")
-        time.sleep(1)
-
-        
-        instance.status = "deploying"
-        instance.save()
-        add_log(instance, "[INFO] Deployment started...")
-        time.sleep(3)
-
-        
-        instance.status = "provisioning"
-        instance.save()
-        add_log(instance, "[INFO] Provisioning cloud resources...")
-        time.sleep(3)
-
-        
-        public_ip = provision_ec2_instance(instance)
-        add_log(instance, f"[INFO] EC2 Instance provisioned. Assigned public IP: {public_ip}")
-        time.sleep(2)
-
-        
-        instance.status = "active"
-        instance.public_ip = public_ip
-        instance.save()
-        add_log(instance, "[SUCCESS] Deployment completed successfully!")
-        time.sleep(1)
+        instance = Instance.objects.select_related('environment__webapp').get(id=instance_id)
+    except Instance.DoesNotExist:
+        return skipped
+
+    if instance.status in ('active', 'failed') or STAGE_ORDER.get(instance.stage, -1) >= STAGE_ORDER[stage]:
+        return skipped
+
+    options = dispatch_options(instance.environment.webapp)
+    if stage == DEPLOYMENT_STAGES[0][0]:
+        # Admission control: wait for a free region/owner slot.
+        if not acquire_slot(instance):
+            run_deployment_stage.apply_async(
+                (instance_id, stage, context),
+                countdown=settings.DEPLOYMENT_ADMISSION_RETRY,
+                **options,
+            )
+            return {"status": "throttled", "instance_id": str(instance_id), "stage": stage}
+
+    # Claim the stage with one conditional UPDATE. It takes the row lock, so
+    # of two copies of a message running at once only one gets to run it.
+    earlier = ['', *(name for name, _ in DEPLOYMENT_STAGES[:STAGE_ORDER[stage]])]
+    claimed = (
+        Instance.objects.filter(id=instance.id, stage__in=earlier)
+        .exclude(status__in=('active', 'failed'))
+        .update(stage=stage)
+    )
+    if not claimed:
+        return skipped
+    instance.stage = stage
 
+    if stage == DEPLOYMENT_STAGES[0][0]:
+        record_admission(instance, context)
+        # The revision this run deploys; the newest one, since a redeploy
+        # cannot start while a deployment is in progress.
+        deployment_id = (
+            Deployment.objects.filter(webapp_id=instance.environment.webapp_id)
+            .order_by('-revision').values_list('id', flat=True).first()
+        )
+        if deployment_id is not None:
+            context["deployment"] = str(deployment_id)
+
+    log = DeploymentLogSink(instance, stage)
+    started_at = timezone.now()
+    started = time.perf_counter()
+
+    try:
+        STAGE_HANDLERS[stage](instance, log, context)
+        log.flush()
+
+    except Exception as e:
+        return fail_stage(instance, log, stage, context, e, started_at, time.perf_counter() - started)
+
+    if "ec2" in context:
+        context["ec2"]["started_at"] = started_at.isoformat()
+        wait_for_public_ip.apply_async(
+            (instance_id, context),
+            countdown=settings.EC2_IP_POLL_INTERVAL,
+            **options,
+        )
+        return {"status": "waiting", "instance_id": str(instance_id), "stage": stage}
+
+    return complete_stage(instance, stage, context, started_at, time.perf_counter() - started)
+
+
+def fail_stage(instance, log, stage, context, error, started_at, seconds):
+    log.add(f"Deployment failed: {str(error)}", level="error")
+    set_status(instance, log, "failed")
+    release_slot(instance)
+    finish_stage(context, stage, "failed", started_at, seconds)
+
+    return {"status": "failed", "error": str(error)}
+
+
+def complete_stage(instance, stage, context, started_at, seconds):
+    """
+    Record a successful stage and schedule the next one, if any.
+    """
+    finish_stage(context, stage, "success", started_at, seconds)
+
+    following = next_stage(stage, context)
+    if following is None:
+        release_slot(instance)
         return {
             "status": "success",
-            "instance_id": str(instance_id),
-            "public_ip": public_ip
+            "instance_id": str(instance.id),
+            "public_ip": instance.public_ip
         }
 
-    except Exception as e:
-        
-        instance.status = "failed"
-        instance.save()
-        add_log(instance, f"[ERROR] Deployment failed: {str(e)}")
+    run_deployment_stage.apply_async(
+        (str(instance.id), following, context),
+        countdown=stage_delay(stage),
+        **dispatch_options(instance.environment.webapp),
+    )
+    return {"status": "in_progress", "instance_id": str(instance.id), "stage": stage}
 
-        return {"status": "failed", "error": str(e)}
 
+def launch_ec2_instance(instance, log, context):
+    """
+    Launch the instance with the configured backend
+    (settings.DEPLOYMENT_PROVISIONER, see provisioning.py), without waiting
+    for it to boot; context["ec2"] tracks the launch until it has an IP.
+    """
+    log.add("Initiating EC2 provisioning request...")
+
+    request = ProvisionRequest.for_instance(instance, context.get("deployment", ''))
+    handles = get_provisioner().launch([request])
+    context["ec2"] = {
+        "region": request.region,
+        "handle": handles[request.instance_id],
+        "deadline": time.time() + settings.EC2_IP_TIMEOUT,
+    }
 
-def provision_ec2_instance(instance):
+
+def poll_public_ip(instance, context):
     """
-    Mock AWS provisioning (boto3 simulation).
-    In real project → Replace with boto3 EC2 run_instances().
+    Check the launched instance for its public IP once; None while it has
+    none, ProvisioningError past EC2_IP_TIMEOUT.
     """
+    launch = context["ec2"]
+    public_ips = get_provisioner().poll(launch["region"], {str(instance.id): launch["handle"]})
+    public_ip = public_ips.get(str(instance.id))
+    if public_ip is None and time.time() > launch["deadline"]:
+        raise ProvisioningError("Timed out waiting for the instance's public IP")
+    return public_ip
 
-    
-    add_log(instance, "[INFO] Initiating EC2 provisioning request...")
 
-    
-    time.sleep(2)
+def claim_public_ip(instance, public_ip):
+    """
+    Record the IP with one conditional UPDATE (the ec2 stage clears it), so
+    of two copies of a wait_for_public_ip message only one finishes the stage.
+    """
+    claimed = (
+        Instance.objects.filter(id=instance.id, stage='ec2', public_ip__isnull=True)
+        .exclude(status__in=('active', 'failed'))
+        .update(public_ip=public_ip)
+    )
+    if claimed:
+        instance.public_ip = public_ip
+    return bool(claimed)
 
-    
-    public_ip = f"54.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(0, 255)}"
 
-    
-    add_log(instance, f"[INFO] EC2 provision success. Instance running at {public_ip}")
+def ec2_provisioned(log, context, public_ip):
+    del context["ec2"]
+    context["public_ip"] = public_ip
+    log.add(f"EC2 provision success. Instance running at {public_ip}")
+    log.add(f"EC2 Instance provisioned. Assigned public IP: {public_ip}")
 
-    return public_ip
+
+@shared_task
+def wait_for_public_ip(instance_id, context):
+    """
+    Poll a launched ec2 stage for its public IP, then finish the stage.
+    Re-schedules itself every EC2_IP_POLL_INTERVAL seconds until then, so
+    no worker is held while the instance boots.
+    """
+    skipped = {"status": "skipped", "instance_id": str(instance_id), "stage": "ec2"}
+
+    try:
+        instance = Instance.objects.select_related('environment__webapp').get(id=instance_id)
+    except Instance.DoesNotExist:
+        return skipped
+
+    if instance.status in ('active', 'failed') or instance.stage != 'ec2' or "ec2" not in context:
+        return skipped
+
+    log = DeploymentLogSink(instance, 'ec2')
+    started_at = parse_datetime(context["ec2"]["started_at"])
+
+    try:
+        public_ip = poll_public_ip(instance, context)
+    except Exception as e:
+        return fail_stage(instance, log, 'ec2', context, e, started_at, (timezone.now() - started_at).total_seconds())
+
+    if public_ip is None:
+        wait_for_public_ip.apply_async(
+            (instance_id, context),
+            countdown=settings.EC2_IP_POLL_INTERVAL,
+            **dispatch_options(instance.environment.webapp),
+        )
+        return {"status": "waiting", "instance_id": str(instance_id), "stage": "ec2"}
+
+    if not claim_public_ip(instance, public_ip):
+        return skipped
+    ec2_provisioned(log, context, public_ip)
+    log.flush()
+
+    return complete_stage(instance, 'ec2', context, started_at, (timezone.now() - started_at).total_seconds())
+
+
+@shared_task
+def compact_deployment_logs():
+    """
+    Periodic (celery beat): fold the log rows of finished deployments into
+    one compressed archive per instance.
+    """
+    return compact_logs()
+
+
+@shared_task
+def enforce_log_retention():
+    """
+    Periodic (celery beat): delete logs older than each plan's retention.
+    """
+    return enforce_retention()
@@ -0,0 +1,126 @@
+"""
+Tenant scoping for the webapp, environment, instance and log endpoints.
+
+A tenant is the authenticated user (WebApp.owner); anonymous requests are
+the tenant of the unowned apps, which is every app created before
+authentication was configured. ?organization=<name> narrows a tenant to one
+organization's apps.
+
+The paginated list endpoints count the tenant's rows on every page, so the
+counts are cached in the 'tenant_counts' alias (Redis in production, shared
+by all web processes) and dropped whenever the tenant creates, deletes or
+re-organizes an app. Cache outages degrade to counting in the database.
+Counts read from the replica are cached apart, and only for
+REPLICA_PIN_SECONDS, since one taken during replication lag misses the
+latest writes.
+"""
+
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from redis import RedisError
+
+from .pagination import count_rows
+from .replicas import REPLICA_ALIAS
+
+logger = logging.getLogger(__name__)
+
+
+def tenant_owner(user):
+    """
+    The WebApp.owner a request's user sees, None for anonymous requests.
+    """
+    return user if user is not None and user.is_authenticated else None
+
+
+def tenant_filter(owner, organization=None, path=''):
+    """
+    Filter kwargs limiting a queryset to one tenant's rows; `path` is the
+    lookup from the queryset's model to WebApp (e.g. 'environment__webapp__').
+    """
+    if owner is None:
+        lookups = {f'{path}owner__isnull': True}
+    else:
+        lookups = {f'{path}owner': owner}
+    if organization:
+        lookups[f'{path}organization'] = organization
+    return lookups
+
+
+def _cache():
+    return caches['tenant_counts']
+
+
+def _key(model, owner_id, organization, alias=DEFAULT_DB_ALIAS):
+    return f"tenant-count:{alias}:{model._meta.label_lower}:{owner_id or 'anonymous'}:{organization or ''}"
+
+
+def tenant_count(queryset, owner, organization=None):
+    """
+    count_rows(queryset), cached per tenant. Only for querysets filtered down
+    to the tenant and nothing else, since the key does not cover other filters.
+    """
+    key = _key(queryset.model, getattr(owner, 'pk', None), organization, queryset.db)
+    try:
+        count = _cache().get(key)
+    except RedisError:
+        logger.warning("Tenant count cache read failed for %s", key, exc_info=True)
+        return count_rows(queryset)
+
+    if count is None:
+        count = count_rows(queryset)
+        timeout = settings.TENANT_COUNT_CACHE_TIMEOUT
+        if queryset.db != DEFAULT_DB_ALIAS:
+            timeout = min(timeout, settings.REPLICA_PIN_SECONDS)
+        try:
+            _cache().set(key, count, timeout)
+        except RedisError:
+            logger.warning("Tenant count cache write failed for %s", key, exc_info=True)
+    return count
+
+
+def forget_tenant_counts(owner_id, organizations=()):
+    """
+    Drop the cached counts that include apps of `owner_id` in any of
+    `organizations` (each app is counted in its owner's unfiltered count too).
+    """
+    from .models import Environment, Instance, WebApp
+
+    keys = [
+        _key(model, owner_id, organization, alias)
+        for model in (WebApp, Environment, Instance)
+        for organization in {None, *organizations}
+        for alias in (DEFAULT_DB_ALIAS, REPLICA_ALIAS)
+    ]
+    try:
+        _cache().delete_many(keys)
+    except RedisError:
+        logger.warning("Tenant count cache delete failed for owner %s", owner_id, exc_info=True)
+
+
+class TenantScopedMixin:
+    """
+    Limits a viewset's queryset to the requesting tenant. `tenant_path` is
+    the lookup from the viewset's model to WebApp.
+    """
+    tenant_path = ''
+
+    @property
+    def tenant(self):
+        return (
+            tenant_owner(self.request.user),
+            self.request.query_params.get('organization') or None,
+        )
+
+    def get_queryset(self):
+        owner, organization = self.tenant
+        return super().get_queryset().filter(**tenant_filter(owner, organization, self.tenant_path))
+
+    def tenant_count(self, queryset):
+        # Count the bare tenant rows: the list queryset's joins and
+        # annotations do not change how many there are.
+        owner, organization = self.tenant
+        rows = queryset.model._default_manager.filter(**tenant_filter(owner, organization, self.tenant_path))
+        return tenant_count(rows, owner, organization)
@@ -0,0 +1,885 @@
+"""
+Tests for kuberns core app
+
+    python manage.py test apps.core
+"""
+
+import json
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+import redis
+from celery import group
+from celery.canvas import Signature
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from . import events, replicas, scheduling, views
+from .events import InMemoryBroker, publish_event
+from .fastpath import log_rows, webapp_list_rows, webapp_list_values
+from .logarchive import archived_logs, compact_instance, compact_logs, enforce_retention
+from .models import DatabaseConfig, Deployment, DeploymentLog, DeploymentLogArchive, Environment, Instance, WebApp
+from .pagination import count_rows, encode_log_cursor
+from .provisioning import AsyncEC2Provisioner, FakeEC2Client, ProvisioningError, ProvisionRequest
+from .tasks import run_deployment_stage
+from .replicas import REPLICA_ALIAS, REPLICA_PIN_COOKIE, ReplicaRouter
+from .scheduling import acquire_slot, deployment_signature, dispatch_options, release_slot
+from .serializers import DeploymentLogSerializer, WebAppCreateSerializer, WebAppListSerializer
+
+
+LOCMEM_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': alias}
+    for alias in ('default', 'deployment_status', 'tenant_counts')
+}
+
+LOG_EPOCH = timezone.now() - timedelta(hours=1)
+
+
+def webapp_data(index, **fields):
+    return {
+        'name': f'app-{index}',
+        'region': 'us-east-1',
+        'template': 'django',
+        'plan': 'pro' if index % 2 else 'starter',
+        'repo': 'repo',
+        'branch': 'main',
+        'database_enabled': bool(index % 2),
+        'database_type': 'postgresql' if index % 2 else 'none',
+        'environment': {'port': 3000, 'environment_variables': {'DEBUG': 'false'}},
+        'database_config': {'name': f'db_{index}'},
+        **fields,
+    }
+
+
+def create_webapp(index, logs=10, **fields):
+    """
+    A webapp with its environment, instance and `logs` log lines, created
+    the way the API creates them (without starting a deployment).
+    """
+    serializer = WebAppCreateSerializer(data=webapp_data(index, **fields))
+    serializer.is_valid(raise_exception=True)
+    webapp = serializer.save()
+
+    instance = webapp.environment.instance
+    add_logs(instance, range(logs))
+    return webapp
+
+
+def add_logs(instance, lines):
+    """
+    Lines `line N`, written N seconds after LOG_EPOCH, so they sort by N.
+    """
+    DeploymentLog.objects.bulk_create([
+        DeploymentLog(
+            instance=instance,
+            level='error' if line % 5 == 0 else 'info',
+            stage='deploying',
+            message=f'line {line}',
+            timestamp=LOG_EPOCH + timedelta(seconds=line),
+        )
+        for line in lines
+    ])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, METRICS_ENABLED=False)
+class QueryCountTests(TestCase):
+    """
+    Pins the number of queries per read endpoint. Every page holds all the
+    seeded rows, so a per-row query (N+1) shows up as a count of APPS or more.
+    """
+    APPS = 6
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.webapps = [create_webapp(index) for index in range(cls.APPS)]
+        cls.webapp = cls.webapps[0]
+
+    def setUp(self):
+        for alias in LOCMEM_CACHES:
+            caches[alias].clear()
+
+    def get(self, path, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_webapp_list(self):
+        # Tenant count, then the page with environment, instance, log
+        # summary and database config joined in.
+        body = self.get('/api/webapps/', 2)
+        self.assertEqual(len(body['results']), self.APPS)
+
+    def test_webapp_list_count_is_cached(self):
+        self.get('/api/webapps/', 2)
+        self.get('/api/webapps/', 1)
+
+    def test_webapp_retrieve(self):
+        # The webapp with its environment and database config, then the
+        # instance with its log summary.
+        body = self.get(f'/api/webapps/{self.webapp.id}/', 2)
+        self.assertEqual(body['environment']['instance']['log_count'], 10)
+
+    def test_status(self):
+        # Cache miss: the webapp with its instance, then the newest lines.
+        body = self.get(f'/api/webapps/{self.webapp.id}/status/', 2)
+        self.assertEqual(len(body['logs']), 10)
+
+    def test_status_from_cache(self):
+        self.get(f'/api/webapps/{self.webapp.id}/status/', 2)
+        self.get(f'/api/webapps/{self.webapp.id}/status/', 0)
+
+    def test_logs(self):
+        body = self.get(f'/api/webapps/{self.webapp.id}/logs/', 2)
+        self.assertEqual(len(body['logs']), 10)
+
+    def test_log_list(self):
+        body = self.get('/api/logs/?page_size=100', 1)
+        self.assertEqual(len(body['results']), self.APPS * 10)
+
+    def test_log_list_for_one_webapp(self):
+        body = self.get(f'/api/logs/?webapp={self.webapp.id}', 2)
+        self.assertEqual(len(body['results']), 10)
+
+    def test_environment_list(self):
+        # Count, page, and the instances with their log summaries.
+        body = self.get('/api/environments/', 3)
+        self.assertEqual(len(body['results']), self.APPS)
+
+    def test_instance_list(self):
+        body = self.get('/api/instances/', 2)
+        self.assertEqual(len(body['results']), self.APPS)
+
+    def test_counts_do_not_grow_with_rows(self):
+        create_webapp(self.APPS, logs=30)
+        self.get('/api/webapps/', 2)
+        self.get('/api/environments/', 3)
+        self.get('/api/instances/', 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, METRICS_ENABLED=False)
+class KeysetPaginationTests(TestCase):
+    """
+    KeysetPageNumberPagination page boundaries, the count_rows() cap and
+    tenant scoping of the list endpoints.
+    """
+    APPS = 25
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.webapps = [create_webapp(index, logs=0) for index in range(cls.APPS)]
+        # Ties on created_at are broken by id.
+        WebApp.objects.filter(pk__in=[webapp.pk for webapp in cls.webapps[12:19]]).update(
+            created_at=cls.webapps[12].created_at,
+        )
+        cls.expected = [str(pk) for pk in WebApp.objects.order_by('-created_at', '-id').values_list('pk', flat=True)]
+
+    def setUp(self):
+        for alias in LOCMEM_CACHES:
+            caches[alias].clear()
+
+    def walk(self, url, client=None):
+        ids, pages = [], []
+        while url:
+            body = (client or self.client).get(url).json()
+            pages.append(body)
+            ids += [row['id'] for row in body['results']]
+            url = body['next']
+        return ids, pages
+
+    def test_next_links_visit_every_row_once_in_order(self):
+        ids, pages = self.walk('/api/webapps/')
+        self.assertEqual(ids, self.expected)
+        self.assertEqual([len(page['results']) for page in pages], [10, 10, 5])
+        self.assertIn('after=', pages[0]['next'])
+        self.assertEqual(pages[0]['count'], self.APPS)
+        self.assertIsNone(pages[0]['previous'])
+        self.assertNotIn('page=', pages[1]['previous'])
+        self.assertIn('page=2', pages[2]['previous'])
+
+    def test_keyset_page_matches_offset_page(self):
+        _, pages = self.walk('/api/webapps/')
+        offset = self.client.get('/api/webapps/', {'page': 2}).json()
+        self.assertEqual(offset['results'], pages[1]['results'])
+
+    def test_out_of_range_pages(self):
+        self.assertEqual(self.client.get('/api/webapps/', {'page': 4}).status_code, 404)
+        self.assertEqual(self.client.get('/api/webapps/', {'page': 0}).status_code, 404)
+        self.assertEqual(self.client.get('/api/webapps/', {'page': 2, 'after': 'garbage'}).status_code, 400)
+
+    def test_cursor_mode_has_no_count(self):
+        ids, pages = self.walk('/api/webapps/?pagination=cursor')
+        self.assertEqual(ids, self.expected)
+        self.assertNotIn('count', pages[0])
+
+    def test_environment_pages_seek_on_webapp_order(self):
+        _, pages = self.walk('/api/environments/')
+        environments = dict(Environment.objects.values_list('pk', 'webapp_id'))
+        ids = [str(environments[uuid.UUID(row['id'])]) for page in pages for row in page['results']]
+        self.assertEqual(ids, self.expected)
+
+    def test_count_is_exact_up_to_the_limit(self):
+        rows = WebApp.objects.all()
+        with override_settings(PAGINATION_EXACT_COUNT_LIMIT=0):
+            self.assertEqual(count_rows(rows), (self.APPS, False))
+        with override_settings(PAGINATION_EXACT_COUNT_LIMIT=self.APPS):
+            self.assertEqual(count_rows(rows), (self.APPS, False))
+        # Above the limit SQLite has no estimate, and the count stops there.
+        with override_settings(PAGINATION_EXACT_COUNT_LIMIT=5), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(count_rows(rows), (None, False))
+        self.assertIn('LIMIT 6', queries[0]['sql'])
+        # On Postgres the planner's estimate is used, never below what was counted.
+        with override_settings(PAGINATION_EXACT_COUNT_LIMIT=5):
+            with mock.patch('apps.core.pagination.estimated_count', return_value=1000):
+                self.assertEqual(count_rows(rows), (1000, True))
+            with mock.patch('apps.core.pagination.estimated_count', return_value=3):
+                self.assertEqual(count_rows(rows), (6, True))
+
+    @override_settings(PAGINATION_EXACT_COUNT_LIMIT=5)
+    def test_capped_count_still_pages(self):
+        ids, pages = self.walk('/api/webapps/')
+        self.assertEqual(ids, self.expected)
+        self.assertIsNone(pages[0]['count'])
+
+    def test_lists_are_scoped_to_the_tenant(self):
+        owner = User.objects.create_user('owner')
+        owned = str(self.webapps[0].pk)
+        WebApp.objects.filter(pk=owned).update(owner=owner, organization='acme')
+        client = self.client_class()
+        client.force_login(owner)
+
+        self.assertEqual(self.walk('/api/webapps/', client)[0], [owned])
+        self.assertEqual(self.walk('/api/webapps/?organization=other', client)[0], [])
+        self.assertEqual(client.get('/api/instances/').json()['count'], 1)
+        self.assertNotIn(owned, self.walk('/api/webapps/')[0])
+        self.assertEqual(self.client.get(f'/api/webapps/{owned}/').status_code, 404)
+
+    def test_tenant_count_is_cached_until_a_create(self):
+        self.assertEqual(self.client.get('/api/webapps/').json()['count'], self.APPS)
+        create_webapp(self.APPS, logs=0)
+        self.assertEqual(self.client.get('/api/webapps/').json()['count'], self.APPS)
+
+        with mock.patch.object(Signature, 'apply_async'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/webapps/', webapp_data(self.APPS + 1), content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.client.get('/api/webapps/').json()['count'], self.APPS + 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, METRICS_ENABLED=False)
+class ProgressPollingTests(TestCase):
+    """
+    The dashboard polls /progress/ with the cursor of the previous response
+    and its ETag; an unchanged deployment must answer 304.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.webapp = create_webapp(0)
+        cls.url = f'/api/webapps/{cls.webapp.id}/progress/'
+
+    def poll(self, after=None, etag=None):
+        return self.client.get(
+            self.url, {'after': after} if after else {},
+            **({'HTTP_IF_NONE_MATCH': etag} if etag else {}),
+        )
+
+    def test_second_poll_with_returned_cursor_is_not_modified(self):
+        first = self.poll()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(len(first.json()['logs']), 10)
+
+        with self.assertNumQueries(1):
+            second = self.poll(first.json()['cursor'], first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_new_line_after_cursor_is_returned(self):
+        first = self.poll()
+        DeploymentLog.objects.create(
+            instance=self.webapp.environment.instance, level='info', stage='deploying', message='new line',
+        )
+
+        second = self.poll(first.json()['cursor'], first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual([line['message'] for line in second.json()['logs']], ['new line'])
+        self.assertNotEqual(second['ETag'], first['ETag'])
+
+        third = self.poll(second.json()['cursor'], second['ETag'])
+        self.assertEqual(third.status_code, 304)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, METRICS_ENABLED=False)
+class IdempotentCreateTests(TestCase):
+    """
+    POST /webapps/ with an Idempotency-Key. on_commit callbacks do not run
+    in a TestCase, so no deployment is started.
+    """
+
+    def create(self, key, data=None, client=None):
+        return (client or self.client).post(
+            '/api/webapps/', data or webapp_data(0), content_type='application/json', HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retry_replays_the_first_create(self):
+        first = self.create('key-1')
+        self.assertEqual(first.status_code, 201, first.content)
+
+        # Same body, keys in another order.
+        retry = self.create('key-1', dict(reversed(list(webapp_data(0).items()))))
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json()['id'], first.json()['id'])
+        self.assertEqual(WebApp.objects.count(), 1)
+
+    def test_reused_key_with_another_body_is_refused(self):
+        self.create('key-1')
+
+        response = self.create('key-1', webapp_data(0, name='other-app'))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(WebApp.objects.count(), 1)
+
+    def test_over_length_key_is_rejected(self):
+        response = self.create('k' * 256)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Idempotency-Key', response.json())
+        self.assertFalse(WebApp.objects.exists())
+
+    def test_keys_are_scoped_per_owner(self):
+        user = User.objects.create_user('owner')
+        client = self.client_class()
+        client.force_login(user)
+
+        anonymous = self.create('key-1')
+        owned = self.create('key-1', client=client)
+        self.assertEqual(owned.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', owned)
+        self.assertNotEqual(owned.json()['id'], anonymous.json()['id'])
+        self.assertEqual(WebApp.objects.get(pk=owned.json()['id']).owner, user)
+
+    def test_anonymous_key_is_unique(self):
+        # NULL owners never collide in the per-owner constraint.
+        first, second = create_webapp(0, logs=0), create_webapp(1, logs=0)
+        WebApp.objects.filter(pk=first.pk).update(idempotency_key='key-1')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            WebApp.objects.filter(pk=second.pk).update(idempotency_key='key-1')
+
+        WebApp.objects.filter(pk=second.pk).update(idempotency_key='key-1', owner=User.objects.create_user('owner'))
+
+@override_settings(CACHES=LOCMEM_CACHES, METRICS_ENABLED=False)
+class BulkCreateTests(TestCase):
+    """
+    POST /webapps/bulk/ inserts every tier in one transaction and queues one
+    Celery group.
+    """
+
+    def bulk(self, payloads):
+        return self.client.post('/api/webapps/bulk/', payloads, content_type='application/json')
+
+    def test_creates_every_tier_and_one_group(self):
+        payloads = [webapp_data(index) for index in range(4)]
+        with mock.patch.object(group, 'apply_async') as apply_async, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.bulk(payloads)
+
+        self.assertEqual(response.status_code, 201, response.content)
+        ids = response.json()['ids']
+        self.assertEqual(sorted(WebApp.objects.values_list('name', flat=True)), [f'app-{i}' for i in range(4)])
+        self.assertEqual(set(map(str, WebApp.objects.values_list('pk', flat=True))), set(ids))
+        self.assertEqual(Environment.objects.count(), 4)
+        self.assertEqual(Instance.objects.filter(status='pending').count(), 4)
+        self.assertEqual(Deployment.objects.filter(revision=1).count(), 4)
+        # Only the odd apps enable a database.
+        self.assertEqual(DatabaseConfig.objects.count(), 2)
+        apply_async.assert_called_once()
+
+    def test_queries_do_not_grow_with_apps(self):
+        with CaptureQueriesContext(connection) as small:
+            self.bulk([webapp_data(index) for index in range(2)])
+        with CaptureQueriesContext(connection) as large:
+            self.bulk([webapp_data(index) for index in range(2, 12)])
+        self.assertEqual(len(large), len(small))
+
+    def test_one_invalid_app_creates_nothing(self):
+        response = self.bulk([webapp_data(0), webapp_data(1, region='mars-1')])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()[0], {})
+        self.assertIn('region', response.json()[1])
+        self.assertFalse(WebApp.objects.exists())
+
+    @override_settings(WEBAPP_BULK_CREATE_LIMIT=2)
+    def test_limits(self):
+        self.assertEqual(self.bulk([]).status_code, 400)
+        self.assertEqual(self.bulk([webapp_data(index) for index in range(3)]).status_code, 400)
+        self.assertFalse(WebApp.objects.exists())
+
+
+def parse_sse(frame):
+    """
+    The event name, id and decoded data of one server-sent event frame.
+    """
+    fields = dict(line.split(': ', 1) for line in frame.decode().strip().split('\n'))
+    return fields['event'], fields.get('id'), json.loads(fields['data'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, METRICS_ENABLED=False)
+class DeploymentEventStreamTests(TestCase):
+    """
+    /webapps/{id}/events/ fed through InMemoryBroker.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.webapp = create_webapp(0, logs=3)
+        cls.instance = cls.webapp.environment.instance
+        cls.url = f'/api/webapps/{cls.webapp.id}/events/'
+
+    def setUp(self):
+        self.broker = events._broker
+        events._broker = InMemoryBroker()
+
+    def tearDown(self):
+        events._broker = self.broker
+
+    async def test_streams_events_until_terminal_status(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        frames = aiter(response.streaming_content)
+        self.assertEqual(parse_sse(await anext(frames)), ('status', None, {'status': 'pending', 'public_ip': None}))
+
+        # The stream is subscribed once its first frame is out.
+        log = await DeploymentLog.objects.acreate(instance=self.instance, level='info', stage='deploying', message='up')
+        cursor = encode_log_cursor(log)
+        publish_event(self.webapp.id, 'log', {'message': 'up', 'cursor': cursor})
+        publish_event(self.webapp.id, 'status', {'status': 'active', 'public_ip': '54.1.2.3'})
+
+        self.assertEqual(parse_sse(await anext(frames)), ('log', cursor, {'message': 'up', 'cursor': cursor}))
+        self.assertEqual(parse_sse(await anext(frames)), ('status', None, {'status': 'active', 'public_ip': '54.1.2.3'}))
+        with self.assertRaises(StopAsyncIteration):
+            await anext(frames)
+
+    async def test_terminal_instance_closes_after_snapshot(self):
+        await Instance.objects.filter(pk=self.instance.pk).aupdate(status='active', public_ip='54.1.2.3')
+
+        response = await self.async_client.get(self.url)
+        frames = [parse_sse(frame) async for frame in response.streaming_content]
+        self.assertEqual(frames, [('status', None, {'status': 'active', 'public_ip': '54.1.2.3'})])
+
+    async def test_reconnect_replays_lines_after_last_event_id(self):
+        await Instance.objects.filter(pk=self.instance.pk).aupdate(status='failed')
+        first = await DeploymentLog.objects.filter(instance=self.instance).order_by('timestamp', 'id').afirst()
+
+        response = await self.async_client.get(self.url, headers={'Last-Event-ID': encode_log_cursor(first)})
+        frames = [parse_sse(frame) async for frame in response.streaming_content]
+        self.assertEqual([event for event, _, _ in frames], ['status', 'log', 'log'])
+        self.assertEqual([data['message'] for _, _, data in frames[1:]], ['line 1', 'line 2'])
+        self.assertEqual(frames[-1][1], frames[-1][2]['cursor'])
+
+    async def test_unknown_webapp_is_404(self):
+        response = await self.async_client.get('/api/webapps/00000000-0000-0000-0000-000000000000/events/')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, METRICS_ENABLED=False)
+class WebAppLogsTests(TestCase):
+    """
+    /webapps/{id}/logs/ across archived and live lines.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # Lines 0-7 compacted into the archive, 8-11 still live.
+        cls.webapp = create_webapp(0, logs=8)
+        instance = cls.webapp.environment.instance
+        Instance.objects.filter(pk=instance.pk).update(status='active')
+        compact_instance(instance.pk)
+        add_logs(instance, range(8, 12))
+        cls.url = f'/api/webapps/{cls.webapp.id}/logs/'
+
+    def messages(self, body):
+        return [line['message'] for line in body['logs']]
+
+    def test_without_cursor_returns_the_newest_lines(self):
+        with mock.patch.object(views, 'LOG_TAIL_LIMIT', 5):
+            body = self.client.get(self.url).json()
+            self.assertEqual(self.messages(body), [f'line {i}' for i in range(7, 12)])
+
+            older = self.client.get(self.url, {'before': body['before']}).json()
+            self.assertEqual(self.messages(older), [f'line {i}' for i in range(2, 7)])
+
+            oldest = self.client.get(self.url, {'before': older['before']}).json()
+            self.assertEqual(self.messages(oldest), ['line 0', 'line 1'])
+            self.assertIsNone(oldest['before'])
+
+    def test_short_history_has_no_older_page(self):
+        body = self.client.get(self.url).json()
+        self.assertEqual(self.messages(body), [f'line {i}' for i in range(12)])
+        self.assertIsNone(body['before'])
+
+    def test_after_cursor_continues_across_archive_and_live_rows(self):
+        with mock.patch.object(views, 'LOG_TAIL_LIMIT', 5):
+            first = self.client.get(self.url).json()
+            older = self.client.get(self.url, {'before': first['before']}).json()
+
+            newer = self.client.get(self.url, {'after': older['cursor']}).json()
+            self.assertEqual(self.messages(newer), [f'line {i}' for i in range(7, 12)])
+            self.assertEqual(newer['cursor'], first['cursor'])
+
+        caught_up = self.client.get(self.url, {'after': first['cursor']}).json()
+        self.assertEqual(caught_up['logs'], [])
+        self.assertEqual(caught_up['cursor'], first['cursor'])
+
+    def test_filters_apply_to_archived_lines(self):
+        body = self.client.get(self.url, {'level': 'error'}).json()
+        self.assertEqual(self.messages(body), ['line 0', 'line 5', 'line 10'])
+
+
+class LogArchiveTests(TestCase):
+    """
+    Compaction of finished deployments' log rows into DeploymentLogArchive,
+    and plan retention.
+    """
+
+    def finished_instance(self, index=0, logs=10, status='active'):
+        instance = create_webapp(index, logs=logs).environment.instance
+        Instance.objects.filter(pk=instance.pk).update(status=status)
+        return Instance.objects.get(pk=instance.pk)
+
+    def fields(self, logs):
+        return [(log.id, log.timestamp, log.level, log.stage, log.message) for log in logs]
+
+    def test_round_trip_keeps_every_line(self):
+        instance = self.finished_instance()
+        live = self.fields(instance.logs.order_by('timestamp', 'id'))
+
+        self.assertEqual(compact_instance(instance.pk), 10)
+        self.assertFalse(instance.logs.exists())
+        instance = Instance.objects.get(pk=instance.pk)
+        self.assertEqual(self.fields(archived_logs(instance)), live)
+        archive = instance.log_archive
+        self.assertEqual((archive.line_count, archive.last_message), (10, 'line 9'))
+        self.assertEqual(archive.last_timestamp, live[-1][1])
+
+    def test_later_lines_are_merged_into_the_archive(self):
+        instance = self.finished_instance()
+        compact_instance(instance.pk)
+        add_logs(instance, range(10, 15))
+
+        self.assertEqual(compact_instance(instance.pk), 5)
+        instance = Instance.objects.get(pk=instance.pk)
+        self.assertEqual([log.message for log in archived_logs(instance)], [f'line {i}' for i in range(15)])
+
+    def test_archive_is_capped_at_plan_max_lines(self):
+        instance = self.finished_instance()
+        with mock.patch('apps.core.logarchive.log_retention', return_value={'days': 14, 'max_lines': 4}):
+            compact_instance(instance.pk)
+        instance = Instance.objects.get(pk=instance.pk)
+        self.assertEqual([log.message for log in archived_logs(instance)], [f'line {i}' for i in range(6, 10)])
+
+    def test_running_deployment_is_not_compacted(self):
+        instance = self.finished_instance(status='deploying')
+        self.assertEqual(compact_instance(instance.pk), 0)
+        self.assertEqual(instance.logs.count(), 10)
+
+    def test_compact_logs_waits_for_compact_after(self):
+        self.finished_instance()
+        self.finished_instance(1, status='provisioning')
+
+        self.assertEqual(compact_logs(), {"instances": 0, "lines": 0})
+        later = timezone.now() + timedelta(hours=2)
+        self.assertEqual(compact_logs(now=later), {"instances": 1, "lines": 10})
+        self.assertEqual(DeploymentLogArchive.objects.count(), 1)
+
+    def test_retention_follows_the_plan(self):
+        # Even apps are on starter (14 days), odd ones on pro (90 days).
+        starter, pro = self.finished_instance(0), self.finished_instance(1)
+        compact_instance(starter.pk)
+        add_logs(pro, range(10, 12))
+
+        deleted = enforce_retention(now=LOG_EPOCH + timedelta(days=20))
+        self.assertEqual(deleted['starter'], {"archives": 1, "lines": 0})
+        self.assertEqual(deleted['pro'], {"archives": 0, "lines": 0})
+        self.assertFalse(DeploymentLogArchive.objects.filter(instance=starter).exists())
+        self.assertEqual(pro.logs.count(), 12)
+
+        deleted = enforce_retention(now=LOG_EPOCH + timedelta(days=91))
+        self.assertEqual(deleted['pro'], {"archives": 0, "lines": 12})
+
+
+class FastpathContractTests(TestCase):
+    """
+    The plain-function serializers must render exactly the JSON of the DRF
+    serializers they replace.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # With and without a database config, without logs, and with the
+        # logs compacted into an archive.
+        webapps = [create_webapp(index) for index in range(4)]
+        create_webapp(4, logs=0)
+        compacted = webapps[1].environment.instance
+        Instance.objects.filter(pk=compacted.pk).update(status='active', public_ip='54.1.2.3')
+        compact_instance(compacted.pk)
+        cls.compacted = Instance.objects.get(pk=compacted.pk)
+
+    def assertSameJSON(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for want, got in zip(expected, actual):
+            self.assertEqual(JSONRenderer().render(got), JSONRenderer().render(want))
+
+    def test_webapp_list_rows(self):
+        self.assertSameJSON(
+            WebAppListSerializer(WebApp.objects.with_deployment(), many=True).data,
+            webapp_list_rows(webapp_list_values(WebApp.objects.all())),
+        )
+
+    def test_latest_log_breaks_timestamp_ties_by_id(self):
+        instance = create_webapp(5, logs=0).environment.instance
+        for message in ('first', 'second'):
+            DeploymentLog.objects.create(instance=instance, message=message, timestamp=LOG_EPOCH)
+
+        self.assertEqual(Instance.objects.with_log_summary().get(pk=instance.pk).latest_log, 'second')
+        row = webapp_list_values(WebApp.objects.filter(environment__instance=instance)).get()
+        self.assertEqual(row['latest_log'], 'second')
+
+    def test_log_rows(self):
+        logs = list(DeploymentLog.objects.order_by('-timestamp', '-id'))
+        self.assertSameJSON(DeploymentLogSerializer(logs, many=True).data, log_rows(logs))
+
+    def test_archived_log_rows(self):
+        logs = archived_logs(self.compacted)
+        self.assertEqual(len(logs), 10)
+        self.assertSameJSON(DeploymentLogSerializer(logs, many=True).data, log_rows(logs))
+
+
+class DeploymentInputsTests(TestCase):
+
+    def test_current_inputs(self):
+        webapp = create_webapp(0, logs=0)
+        self.assertEqual(Deployment.current_inputs(webapp), {
+            'repo': 'repo', 'branch': 'main', 'plan': 'starter', 'region': 'us-east-1',
+            'environment_variables': {'DEBUG': 'false'},
+        })
+
+    def test_current_inputs_without_environment(self):
+        webapp = create_webapp(0, logs=0)
+        webapp.environment.delete()
+        webapp = WebApp.objects.get(pk=webapp.pk)
+        self.assertEqual(Deployment.current_inputs(webapp)['environment_variables'], {})
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES, METRICS_ENABLED=False,
+    DEPLOYMENT_MAX_IN_FLIGHT_PER_REGION=5, DEPLOYMENT_MAX_IN_FLIGHT_PER_OWNER=2,
+)
+class SchedulingTests(TestCase):
+    """
+    Queue routing, plan priorities and admission control. The slot sets
+    live in Redis, which is replaced by a stub here.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # create_webapp(1) is on pro, (0) on starter.
+        cls.pro = create_webapp(1, logs=0, region='eu-central-1')
+        cls.starter = create_webapp(0, logs=0)
+
+    def setUp(self):
+        patcher = mock.patch.multiple(scheduling, _client=mock.Mock(), _acquire=mock.Mock(return_value=1))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_routes_per_region_and_prioritises_pro(self):
+        self.assertEqual(dispatch_options(self.pro), {'queue': 'deployments.eu-central-1', 'priority': 0})
+        self.assertEqual(dispatch_options(self.starter)['queue'], 'deployments.us-east-1')
+        # The Redis broker serves lower priority numbers first.
+        self.assertGreater(dispatch_options(self.starter)['priority'], dispatch_options(self.pro)['priority'])
+
+    def test_signature_carries_routing_and_stages(self):
+        instance = self.pro.environment.instance
+        signature = deployment_signature(instance.id, self.pro, stages=['deploying'])
+
+        instance_id, stage, context = signature.args
+        self.assertEqual((instance_id, stage), (str(instance.id), 'received'))
+        self.assertEqual(context['stages'], ['deploying'])
+        self.assertIn('queued_at', context)
+        self.assertEqual(signature.options, {'queue': 'deployments.eu-central-1', 'priority': 0})
+
+    def test_admission_checks_region_and_owner_slots(self):
+        owner = User.objects.create_user('owner')
+        WebApp.objects.filter(pk=self.pro.pk).update(owner=owner)
+        instance = Instance.objects.select_related('environment__webapp').get(environment__webapp=self.pro)
+
+        self.assertTrue(acquire_slot(instance))
+        kwargs = scheduling._acquire.call_args.kwargs
+        self.assertEqual(kwargs['keys'], [
+            'kuberns:deployments:in-flight:region:eu-central-1',
+            f'kuberns:deployments:in-flight:owner:{owner.pk}',
+        ])
+        member, now, expiry, *limits = kwargs['args']
+        self.assertEqual(member, str(instance.id))
+        self.assertEqual(limits, [5, 2])
+
+        release_slot(instance)
+        pipe = scheduling._client.pipeline.return_value
+        self.assertEqual(pipe.zrem.call_count, 2)
+
+    def test_anonymous_apps_only_take_a_region_slot(self):
+        acquire_slot(self.starter.environment.instance)
+        self.assertEqual(
+            scheduling._acquire.call_args.kwargs['keys'], ['kuberns:deployments:in-flight:region:us-east-1'],
+        )
+
+    def test_full_region_requeues_the_first_stage(self):
+        scheduling._acquire.return_value = 0
+        instance = self.starter.environment.instance
+        with mock.patch.object(run_deployment_stage, 'apply_async') as apply_async:
+            result = run_deployment_stage(str(instance.id), 'received', {})
+
+        self.assertEqual(result['status'], 'throttled')
+        args, kwargs = apply_async.call_args
+        self.assertEqual(args[0][:2], (str(instance.id), 'received'))
+        self.assertEqual(kwargs['queue'], 'deployments.us-east-1')
+        self.assertEqual(kwargs['countdown'], settings.DEPLOYMENT_ADMISSION_RETRY)
+        self.assertEqual(Instance.objects.get(pk=instance.pk).stage, '')
+
+    def test_redis_outage_admits(self):
+        scheduling._acquire.side_effect = redis.ConnectionError
+        with self.assertLogs('apps.core.scheduling', 'WARNING'):
+            self.assertTrue(acquire_slot(self.starter.environment.instance))
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_eager_runs_skip_admission(self):
+        self.assertTrue(acquire_slot(self.starter.environment.instance))
+        scheduling._acquire.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHES, METRICS_ENABLED=False, REPLICA_PIN_SECONDS=10)
+class ReplicaRoutingTests(TestCase):
+    """
+    ReplicaRouter and ReplicaReadMixin. No replica is configured here, so
+    the alias a request selects is observed on a stub of the context
+    variable instead of being queried.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.webapp = create_webapp(0, logs=0)
+
+    def get_routed(self, path, pinned=False):
+        if pinned:
+            self.client.cookies[REPLICA_PIN_COOKIE] = '1'
+        with mock.patch.object(replicas, 'replica_enabled', return_value=True), \
+                mock.patch.object(replicas, '_read_alias') as read_alias:
+            read_alias.get.return_value = None
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200, response.content)
+        if read_alias.set.called:
+            read_alias.reset.assert_called_once_with(read_alias.set.return_value)
+        return [call.args[0] for call in read_alias.set.call_args_list]
+
+    def test_read_actions_go_to_the_replica(self):
+        self.assertEqual(self.get_routed('/api/webapps/'), [REPLICA_ALIAS])
+        self.assertEqual(self.get_routed(f'/api/webapps/{self.webapp.id}/status/'), [REPLICA_ALIAS])
+
+    def test_pinned_client_reads_from_the_primary(self):
+        self.assertEqual(self.get_routed('/api/webapps/', pinned=True), [])
+
+    def test_successful_write_pins_the_client(self):
+        with mock.patch.object(replicas, 'replica_enabled', return_value=True), \
+                mock.patch.object(Signature, 'apply_async'):
+            response = self.client.post('/api/webapps/', webapp_data(1), content_type='application/json')
+            failed = self.client.post('/api/webapps/', webapp_data(2, region='mars-1'), content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        cookie = response.cookies[REPLICA_PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], 10)
+        self.assertTrue(cookie['httponly'])
+        self.assertEqual(failed.status_code, 400)
+        self.assertNotIn(REPLICA_PIN_COOKIE, failed.cookies)
+
+    def test_no_pin_without_a_replica(self):
+        with mock.patch.object(Signature, 'apply_async'):
+            response = self.client.post('/api/webapps/', webapp_data(1), content_type='application/json')
+        self.assertNotIn(REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(WebApp))
+        token = replicas._read_alias.set(REPLICA_ALIAS)
+        try:
+            self.assertEqual(router.db_for_read(WebApp), REPLICA_ALIAS)
+            self.assertEqual(router.db_for_write(WebApp), 'default')
+        finally:
+            replicas._read_alias.reset(token)
+        self.assertTrue(router.allow_migrate('default', 'core'))
+        self.assertFalse(router.allow_migrate(REPLICA_ALIAS, 'core'))
+
+
+@override_settings(EC2_AMI_IDS={'us-east-1': 'ami-east', 'eu-central-1': 'ami-eu'})
+class AsyncEC2ProvisionerTests(SimpleTestCase):
+    """
+    Batching, relaunch and retry of AsyncEC2Provisioner against FakeEC2Client.
+    """
+
+    def provisioner(self, clients, max_batch=3, max_retries=3, **fake):
+        return AsyncEC2Provisioner(
+            client_factory=lambda region: clients.setdefault(region, FakeEC2Client(region, latency=0, **fake)),
+            max_batch=max_batch, max_retries=max_retries, backoff=0, poll_interval=0.01, shared_slots=False,
+        )
+
+    def requests(self, count, region='us-east-1', instance_type='t3.micro'):
+        return [ProvisionRequest(f'{region}-{instance_type}-{i}', region, instance_type) for i in range(count)]
+
+    def test_batches_per_region_and_type(self):
+        clients = {}
+        requests = self.requests(7) + self.requests(2, instance_type='t3.small') + self.requests(2, 'eu-central-1')
+        public_ips = self.provisioner(clients).provision(requests)
+
+        self.assertEqual(set(public_ips), {request.instance_id for request in requests})
+        # 7 east micros in batches of 3, one east small and one eu batch.
+        self.assertEqual(clients['us-east-1'].calls['RunInstances'], 4)
+        self.assertEqual(clients['eu-central-1'].calls['RunInstances'], 1)
+
+    def test_relaunches_what_a_partial_launch_left(self):
+        clients = {}
+        public_ips = self.provisioner(clients, max_batch=10, max_launch=2).provision(self.requests(5))
+
+        self.assertEqual(len(public_ips), 5)
+        self.assertEqual(clients['us-east-1'].calls['RunInstances'], 3)
+        self.assertEqual(clients['us-east-1'].launched, 5)
+
+    def test_retries_throttled_calls(self):
+        clients = {}
+        public_ips = self.provisioner(clients, throttle_first=2).provision(self.requests(1))
+
+        self.assertEqual(len(public_ips), 1)
+        self.assertEqual(clients['us-east-1'].calls['RunInstances'], 3)
+
+    def test_gives_up_after_max_retries(self):
+        with self.assertRaises(ProvisioningError):
+            self.provisioner({}, max_retries=1, throttle_first=5).provision(self.requests(1))
+
+    def test_retry_after_lost_response_does_not_launch_twice(self):
+        clients = {}
+        public_ips = self.provisioner(clients, lost_responses=1).provision(self.requests(3))
+
+        self.assertEqual(len(public_ips), 3)
+        self.assertEqual(clients['us-east-1'].calls['RunInstances'], 2)
+        self.assertEqual(clients['us-east-1'].launched, 3)
+
+    def test_launch_then_poll(self):
+        clients = {}
+        provisioner = self.provisioner(clients, boot_polls=2)
+        request = self.requests(1)[0]
+        handles = provisioner.launch([request])
+
+        self.assertEqual(provisioner.poll('us-east-1', handles), {})
+        self.assertEqual(list(provisioner.poll('us-east-1', handles)), [request.instance_id])
@@ -5,6 +5,9 @@ from .views import (
     EnvironmentViewSet,
     InstanceViewSet,
     DeploymentLogViewSet,
+    deployment_events,
+    deployment_queues,
+    deployment_stats,
      metadata
 )
 
@@ -16,5 +19,8 @@ router.register('logs', DeploymentLogViewSet, basename='logs')
 
 urlpatterns = [
     path('metadata/', metadata),
+    path('deployments/queues/', deployment_queues),
+    path('deployments/stats/', deployment_stats),
+    path('webapps/<uuid:pk>/events/', deployment_events),
     path('', include(router.urls)),
 ]
@@ -2,83 +2,425 @@
 Views for kuberns core app
 """
 
-from rest_framework import viewsets, status
+import hashlib
+import json
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from celery import group
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Max, OuterRef, Prefetch, Subquery
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag
+from redis import RedisError
+from rest_framework import serializers, viewsets, status
 from rest_framework.decorators import action, api_view
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 
-from .models import WebApp, Environment, Instance, DeploymentLog
+from .models import WebApp, Environment, Instance, Deployment, DeploymentLog
 from .serializers import (
     WebAppListSerializer, WebAppCreateSerializer, WebAppDetailSerializer,
-    EnvironmentSerializer, InstanceSerializer, DeploymentLogSerializer
+    EnvironmentSerializer, InstanceSerializer, DeploymentLogSerializer,
+    DeploymentSerializer, RedeploySerializer
 )
-from .tasks import deploy_instance
+from .analytics import DIMENSIONS, stage_duration_stats
+from .events import publish_event, subscribe
+from .fastpath import log_row, log_rows, webapp_list_rows, webapp_list_values
+from .logarchive import instance_logs, instance_logs_before, recent_logs
+from .plans import instance_specs, plan_details
+from .status_cache import STATUS_LOG_LINES, add_status, build_status, delete_status, get_status, write_status
+from .pagination import (
+    DeploymentLogCursorPagination, InstanceLogPagination, decode_log_cursor, encode_log_cursor
+)
+from .replicas import ReplicaReadMixin
+from .scheduling import deployment_signature, in_flight, queue_depths
+from .tasks import STAGE_HANDLERS, STAGE_ORDER, deployment_stages
+from .tenancy import TenantScopedMixin, forget_tenant_counts, tenant_filter, tenant_owner
+
+
+LOG_TAIL_LIMIT = 500
+
+IDEMPOTENCY_KEY_MAX_LENGTH = WebApp._meta.get_field('idempotency_key').max_length
+
+TERMINAL_STATUSES = ('active', 'failed')
+
+STATS_DEFAULT_HOURS = 24 * 7
+STATS_MAX_HOURS = 24 * 90
+
+LOG_FILTER_CHOICES = {
+    'level': [level for level, _ in DeploymentLog.LEVEL_CHOICES],
+    'stage': list(STAGE_HANDLERS),
+}
+
+
+def idempotency_request_hash(data):
+    """
+    sha256 of the parsed request body, independent of key order and
+    whitespace, stored with an Idempotency-Key.
+    """
+    body = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def log_filters(query_params):
+    """
+    ?level= and ?stage= (comma separated) as {field: [values]}.
+    """
+    filters = {}
+    for field, choices in LOG_FILTER_CHOICES.items():
+        value = query_params.get(field)
+        if not value:
+            continue
+        values = value.split(',')
+        invalid = [v for v in values if v not in choices]
+        if invalid:
+            raise serializers.ValidationError({field: f"Invalid {field}: {', '.join(invalid)}"})
+        filters[field] = values
+    return filters
 
 
 
 
 
+# Built once at import: the response never changes while the process runs.
+METADATA = {
+    "regions": WebApp.REGION_CHOICES,
+    "frameworks": WebApp.FRAMEWORK_CHOICES,
+    "plans": WebApp.PLAN_CHOICES,
+    "plan_details": plan_details(),
+    "database_types": WebApp.DATABASE_CHOICES,
+}
+METADATA_ETAG = '"%s"' % hashlib.sha256(
+    json.dumps(METADATA, sort_keys=True).encode()
+).hexdigest()
+
+
+@cache_control(public=True, max_age=settings.METADATA_MAX_AGE)
+@etag(lambda request: METADATA_ETAG)
 @api_view(['GET'])
 def metadata(request):
-    return Response({
-        "regions": WebApp.REGION_CHOICES,
-        "frameworks": WebApp.FRAMEWORK_CHOICES,
-        "plans": WebApp.PLAN_CHOICES,
+    return Response(METADATA)
 
-        
-        "plan_details": {
-            "starter": {
-                "cpu": "0.5 vCPU",
-                "ram": "512MB",
-                "bandwidth": "10GB/mo",
-                "price": "$10/mo"
-            },
-            "pro": {
-                "cpu": "2 vCPU",
-                "ram": "4GB",
-                "bandwidth": "Unlimited",
-                "price": "$50/mo"
-            }
-        },
 
-        "database_types": WebApp.DATABASE_CHOICES,
+@api_view(['GET'])
+def deployment_queues(request):
+    """
+    Queue depth and in-flight deployments per region, for monitoring.
+    """
+    try:
+        depths, running = queue_depths(), in_flight()
+    except RedisError:
+        return Response({"detail": "Scheduler unavailable"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    return Response({
+        "queues": depths,
+        "in_flight": running,
+        "limits": {
+            "per_region": settings.DEPLOYMENT_MAX_IN_FLIGHT_PER_REGION,
+            "per_owner": settings.DEPLOYMENT_MAX_IN_FLIGHT_PER_OWNER,
+        },
     })
 
 
 
 
+@api_view(['GET'])
+def deployment_stats(request):
+    """
+    p50/p95/max duration of each pipeline stage over the last ?hours=
+    (default one week), optionally per ?group_by=region,template,plan and
+    for one ?stage=.
+    """
+    params = request.query_params
+    group_by = [name for name in params.get('group_by', '').split(',') if name]
+    invalid = [name for name in group_by if name not in DIMENSIONS]
+    if invalid:
+        raise serializers.ValidationError({"group_by": f"Invalid group_by: {', '.join(invalid)}"})
+
+    stage = params.get('stage')
+    if stage and stage not in STAGE_HANDLERS:
+        raise serializers.ValidationError({"stage": f"Invalid stage: {stage}"})
+
+    try:
+        hours = int(params.get('hours', STATS_DEFAULT_HOURS))
+    except ValueError:
+        hours = 0
+    if not 1 <= hours <= STATS_MAX_HOURS:
+        raise serializers.ValidationError({"hours": f"Must be between 1 and {STATS_MAX_HOURS}"})
+
+    since = timezone.now() - timedelta(hours=hours)
+    rows = stage_duration_stats(since, group_by, stage)
+    rows.sort(key=lambda row: (*(row[name] for name in group_by), STAGE_ORDER[row['stage']]))
+
+    return Response({
+        "since": since,
+        "hours": hours,
+        "group_by": group_by,
+        "results": rows,
+    })
+
+
+
 
 
-class WebAppViewSet(viewsets.ModelViewSet):
+class WebAppViewSet(ReplicaReadMixin, TenantScopedMixin, viewsets.ModelViewSet):
     queryset = WebApp.objects.all()
     permission_classes = [AllowAny]
+    replica_actions = ('list', 'retrieve', 'deployments', 'status', 'logs', 'progress')
+
+    def get_queryset(self):
+        """
+        Load only what each action serializes, so query counts stay
+        constant regardless of page size.
+        """
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            return webapp_list_values(queryset)
+        if self.action == 'retrieve':
+            return queryset.with_deployment()
+        if self.action in ('status', 'logs'):
+            return queryset.select_related('environment__instance__log_archive')
+        if self.action == 'redeploy':
+            return queryset.select_related('environment__instance').select_for_update(of=('self',))
+        return queryset
 
     def get_serializer_class(self):
-        if self.action == 'create':
+        if self.action in ('create', 'bulk'):
             return WebAppCreateSerializer
         elif self.action == 'retrieve':
             return WebAppDetailSerializer
         return WebAppListSerializer
 
+    def list(self, request, *args, **kwargs):
+        """
+        Read-only, so rows come straight from .values() through
+        fastpath.webapp_list_rows instead of WebAppListSerializer (same JSON).
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        rows = webapp_list_rows(queryset if page is None else page)
+        if page is None:
+            return Response(rows)
+        return self.get_paginated_response(rows)
+
     def create(self, request, *args, **kwargs):
         """
         Create WebApp -> create Environment -> create Instance ->
         THEN start async deployment pipeline via Celery.
+        A retried request carrying the same Idempotency-Key header gets the
+        app created by the first one back, and no second deployment; the
+        same key with a different body is refused with 422.
         """
+        idempotency_key = request.headers.get('Idempotency-Key') or None
+        request_hash = ''
+        if idempotency_key is not None:
+            if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+                raise serializers.ValidationError(
+                    {"Idempotency-Key": f"Must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters"}
+                )
+            request_hash = idempotency_request_hash(request.data)
+            replay = self._replay_create(idempotency_key, request_hash)
+            if replay is not None:
+                return replay
+
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        webapp = serializer.save()
+        owner = tenant_owner(request.user)
+        try:
+            webapp = serializer.save(
+                idempotency_key=idempotency_key, idempotency_request_hash=request_hash, owner=owner,
+            )
+        except IntegrityError:
+            if idempotency_key is None:
+                raise
+            # A concurrent request with the same key won the insert.
+            replay = self._replay_create(idempotency_key, request_hash)
+            if replay is None:
+                return Response(
+                    {"detail": "A request with this Idempotency-Key is still being processed"},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            return replay
 
         
-        deploy_instance.delay(str(webapp.environment.instance.id))
+        signature = deployment_signature(webapp.environment.instance.id, webapp)
+        transaction.on_commit(lambda: signature.apply_async())
+        transaction.on_commit(lambda: forget_tenant_counts(webapp.owner_id, [webapp.organization]))
 
-        return Response({
+        webapp = self.get_queryset().with_deployment().get(pk=webapp.pk)
+
+        return self._created_response(webapp)
+
+    def _created_response(self, webapp, replayed=False):
+        response = Response({
             "message": "WebApp created successfully",
             "status": "deployment started",
             "id": str(webapp.id),
             "data": WebAppDetailSerializer(webapp).data
         }, status=status.HTTP_201_CREATED)
+        if replayed:
+            response['Idempotent-Replayed'] = 'true'
+        return response
+
+    def _replay_create(self, idempotency_key, request_hash):
+        webapp = self.get_queryset().with_deployment().filter(idempotency_key=idempotency_key).first()
+        if webapp is None:
+            return None
+        if webapp.idempotency_request_hash and webapp.idempotency_request_hash != request_hash:
+            return Response(
+                {"detail": "This Idempotency-Key was already used with a different request body"},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        return self._created_response(webapp, replayed=True)
+
+    def perform_update(self, serializer):
+        organization = serializer.instance.organization
+        webapp = serializer.save()
+        # The cached status carries the name and the app's tenant.
+        transaction.on_commit(lambda: delete_status(webapp.id))
+        if webapp.organization != organization:
+            forget_tenant_counts(webapp.owner_id, [organization, webapp.organization])
+
+    def perform_destroy(self, instance):
+        webapp_id = instance.id
+        super().perform_destroy(instance)
+        delete_status(webapp_id)
+        forget_tenant_counts(instance.owner_id, [instance.organization])
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create many WebApps in one transaction (one INSERT per model tier)
+        and queue their deployments as a single Celery group.
+        """
+        serializer = self.get_serializer(
+            data=request.data,
+            many=True,
+            allow_empty=False,
+            max_length=settings.WEBAPP_BULK_CREATE_LIMIT,
+        )
+        serializer.is_valid(raise_exception=True)
+
+        owner = tenant_owner(request.user)
+        webapps = serializer.save(owner=owner)
+
+        signatures = [deployment_signature(webapp.environment.instance.id, webapp) for webapp in webapps]
+        transaction.on_commit(lambda: group(signatures).apply_async())
+        organizations = {webapp.organization for webapp in webapps}
+        transaction.on_commit(lambda: forget_tenant_counts(getattr(owner, 'pk', None), organizations))
+
+        return Response({
+            "message": f"{len(webapps)} WebApps created successfully",
+            "status": "deployment started",
+            "ids": [str(webapp.id) for webapp in webapps],
+        }, status=status.HTTP_201_CREATED)
+
+    
+    
+    
+    @action(detail=True, methods=['post'])
+    def redeploy(self, request, pk=None):
+        """
+        Redeploy the app in place with new inputs, or roll back to an older
+        revision's inputs, recording the next revision.
+        Stages whose inputs did not change are skipped, so only a plan or
+        region change provisions a new server.
+        """
+        serializer = RedeploySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = dict(serializer.validated_data)
+
+        with transaction.atomic():
+            webapp = self.get_object()
+            environment = webapp.environment
+            instance = environment.instance
+
+            if instance.status not in TERMINAL_STATUSES:
+                return Response(
+                    {"detail": "A deployment is already in progress"},
+                    status=status.HTTP_409_CONFLICT,
+                )
+
+            rollback_of = data.pop('revision', None)
+            if rollback_of is not None:
+                target = webapp.deployments.filter(revision=rollback_of).first()
+                if target is None:
+                    raise serializers.ValidationError({"revision": f"Revision {rollback_of} does not exist"})
+                data = target.inputs()
+
+            previous = Deployment.current_inputs(webapp)
+            inputs = {**previous, **data}
+            changed = [field for field in Deployment.INPUT_FIELDS if inputs[field] != previous[field]]
+            stages = deployment_stages(changed)
+
+            latest = webapp.deployments.aggregate(revision=Max('revision'))['revision'] or 0
+            deployment = Deployment.objects.create(
+                webapp=webapp,
+                revision=latest + 1,
+                changed=changed,
+                stages=stages,
+                rollback_of=rollback_of,
+                **inputs
+            )
+
+            webapp_fields = ['repo', 'branch', 'plan', 'region']
+            for field in webapp_fields:
+                setattr(webapp, field, inputs[field])
+            webapp.save(update_fields=[*webapp_fields, 'updated_at'])
+
+            environment.environment_variables = inputs['environment_variables']
+            environment.save(update_fields=['environment_variables', 'updated_at'])
+
+            instance.status = 'pending'
+            instance.stage = ''
+            instance_fields = ['status', 'stage', 'updated_at']
+            if 'plan' in changed:
+                for field, value in instance_specs(webapp.plan).items():
+                    setattr(instance, field, value)
+                instance_fields += ['cpu', 'ram', 'storage']
+            if 'ec2' in stages:
+                instance.public_ip = None
+                instance_fields.append('public_ip')
+            instance.save(update_fields=instance_fields)
+
+            # Announce 'pending' before dispatching: the pipeline may finish
+            # (eagerly, or as a no-change redeploy) before a later hook runs.
+            transaction.on_commit(lambda: write_status(instance))
+            transaction.on_commit(lambda: publish_event(webapp.id, "status", {
+                "status": instance.status,
+                "public_ip": instance.public_ip,
+            }))
+            signature = deployment_signature(instance.id, webapp, stages)
+            transaction.on_commit(lambda: signature.apply_async())
+
+        return Response({
+            "message": f"Redeploying revision {deployment.revision}",
+            "status": "deployment started",
+            "id": str(webapp.id),
+            "deployment": DeploymentSerializer(deployment).data,
+        }, status=status.HTTP_202_ACCEPTED)
+
+    
+    
+    
+    @action(detail=True, methods=['get'])
+    def deployments(self, request, pk=None):
+        """
+        Revision history, newest first.
+        """
+        webapp = self.get_object()
+        # Per-app history: revision order and an exact count, not the
+        # tenant-wide keyset pagination of the list.
+        paginator = PageNumberPagination()
+        page = paginator.paginate_queryset(webapp.deployments.prefetch_related('stage_events'), request, view=self)
+        return paginator.get_paginated_response(DeploymentSerializer(page, many=True).data)
 
     
     
@@ -88,19 +430,26 @@ class WebAppViewSet(viewsets.ModelViewSet):
         """
         Returns live deployment status + latest logs.
         This is used by the frontend deployment dashboard.
+        Served from the write-through status cache; the database is only
+        read on a cache miss. A hit for another tenant's app is treated as a
+        miss, so get_object() 404s as for the other actions.
         """
+        owner, organization = self.tenant
+        cached = get_status(pk, getattr(owner, 'pk', None), organization)
+        if cached is not None:
+            return Response(cached)
+
         webapp = self.get_object()
         instance = webapp.environment.instance
 
-        logs = instance.logs.order_by('-timestamp')[:20]  
+        logs = recent_logs(instance, STATUS_LOG_LINES)
 
-        return Response({
-            "id": str(webapp.id),
-            "name": webapp.name,
-            "instance_status": instance.status,
-            "public_ip": instance.public_ip,
-            "logs": DeploymentLogSerializer(logs, many=True).data,
-        })
+        payload = build_status(webapp, instance, logs)
+        # A replica read can predate the pipeline's last write, and add()
+        # would keep it cached after the deployment finishes.
+        if webapp._state.db == DEFAULT_DB_ALIAS:
+            add_status(webapp, payload)
+        return Response(payload)
 
     
     
@@ -108,35 +457,226 @@ class WebAppViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def logs(self, request, pk=None):
         """
-        Returns ALL logs in chronological order.
+        Returns logs in chronological order, including lines already
+        compacted into the instance's archive, optionally narrowed with
+        ?level= and ?stage=.
+        With ?after=<cursor> only the lines written after that cursor are
+        returned (at most LOG_TAIL_LIMIT); pass the returned cursor back on
+        the next poll. Otherwise the newest LOG_TAIL_LIMIT lines (before
+        ?before=<cursor>, if given) are returned, with a `before` cursor
+        for the page of older lines while there are any.
         """
         webapp = self.get_object()
         instance = webapp.environment.instance
-
-        logs = instance.logs.order_by('timestamp')  
+        filters = log_filters(request.query_params)
+
+        after = request.query_params.get('after')
+        older = None
+        if after:
+            logs = instance_logs(instance, after, LOG_TAIL_LIMIT, filters)
+        else:
+            logs = instance_logs_before(instance, request.query_params.get('before'), LOG_TAIL_LIMIT + 1, filters)
+            logs.reverse()
+            if len(logs) > LOG_TAIL_LIMIT:
+                logs = logs[1:]
+                older = encode_log_cursor(logs[0])
 
         return Response({
             "id": str(webapp.id),
-            "logs": DeploymentLogSerializer(logs, many=True).data,
+            "logs": log_rows(logs),
+            "cursor": encode_log_cursor(logs[-1]) if logs else after,
+            "before": older,
         })
 
+    
+    
+    
+    @action(detail=True, methods=['get'])
+    def progress(self, request, pk=None):
+        """
+        Status, public IP and the log lines after ?after=<cursor> in one
+        round trip, for the deployment dashboard's polling loop.
 
-
-
-
-class EnvironmentViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Environment.objects.all()
+        The ETag covers Instance.updated_at, the newest log id and the
+        returned cursor, so polling again with that cursor while nothing has
+        changed costs one query and returns 304.
+        """
+        latest_log = DeploymentLog.objects.filter(instance=OuterRef('pk')).order_by('-timestamp', '-id')
+        try:
+            instance = (
+                Instance.objects
+                .annotate(last_log_id=Subquery(latest_log.values('id')[:1]))
+                .get(environment__webapp_id=pk, **tenant_filter(*self.tenant, path='environment__webapp__'))
+            )
+        except (Instance.DoesNotExist, ValidationError):
+            raise Http404
+
+        def make_etag(cursor):
+            return '"%s"' % hashlib.sha256(
+                f"{instance.updated_at.isoformat()}|{instance.last_log_id}|{cursor}".encode()
+            ).hexdigest()[:32]
+
+        after = request.query_params.get('after')
+        logs = []
+        caught_up = after and decode_log_cursor(after)[1] == instance.last_log_id
+        if caught_up:
+            # The response would return `after` as its cursor again.
+            etag = make_etag(after)
+            if etag in request.headers.get('If-None-Match', ''):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        else:
+            # No live rows may just mean the logs were compacted.
+            logs = instance_logs(instance, after, LOG_TAIL_LIMIT)
+
+        cursor = encode_log_cursor(logs[-1]) if logs else after
+        return Response({
+            "id": pk,
+            "instance_status": instance.status,
+            "public_ip": instance.public_ip,
+            "updated_at": instance.updated_at,
+            "logs": log_rows(logs),
+            "cursor": cursor,
+        }, headers={'ETag': make_etag(cursor)})
+
+
+
+
+
+def _sse(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def deployment_events(request, pk):
+    """
+    Server-sent event stream of status transitions and new log lines for a
+    webapp. Must be served through the ASGI application (kuberns.asgi).
+
+    Log events carry their tail cursor as the SSE id, so a reconnecting
+    EventSource resumes from Last-Event-ID without gaps.
+    """
+    owner = await sync_to_async(tenant_owner)(request.user)
+    try:
+        instance = await Instance.objects.aget(
+            environment__webapp_id=pk, **tenant_filter(owner, path='environment__webapp__')
+        )
+    except Instance.DoesNotExist:
+        raise Http404
+
+    last_event_id = request.headers.get('Last-Event-ID')
+
+    async def stream():
+        # Subscribe before taking the snapshot so no transition is missed.
+        async with subscribe(pk) as next_event:
+            current = await Instance.objects.aget(pk=instance.pk)
+            yield _sse("status", {"status": current.status, "public_ip": current.public_ip})
+
+            if last_event_id:
+                missed = await sync_to_async(instance_logs)(current, last_event_id, LOG_TAIL_LIMIT)
+                for log in missed:
+                    cursor = encode_log_cursor(log)
+                    yield _sse("log", {**log_row(log), "cursor": cursor}, cursor)
+
+            if current.status in TERMINAL_STATUSES:
+                return
+
+            while True:
+                event = await next_event()
+                if event is None:
+                    yield ": keepalive\n\n"
+                elif event["type"] == "log":
+                    yield _sse("log", event["data"], event["data"]["cursor"])
+                else:
+                    yield _sse(event["type"], event["data"])
+                    if event["data"]["status"] in TERMINAL_STATUSES:
+                        return
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class EnvironmentViewSet(ReplicaReadMixin, TenantScopedMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Pages in the order of their apps, so they seek on the tenant's WebApp index.
+    """
+    queryset = Environment.objects.prefetch_related(
+        Prefetch('instance', queryset=Instance.objects.with_log_summary())
+    )
     serializer_class = EnvironmentSerializer
     permission_classes = [AllowAny]
+    tenant_path = 'webapp__'
+    keyset_ordering = ('-webapp__created_at', '-webapp__id')
 
 
-class InstanceViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Instance.objects.all()
+class InstanceViewSet(ReplicaReadMixin, TenantScopedMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Pages in the order of their apps, so they seek on the tenant's WebApp index.
+    """
+    queryset = Instance.objects.with_log_summary()
     serializer_class = InstanceSerializer
     permission_classes = [AllowAny]
+    tenant_path = 'environment__webapp__'
+    keyset_ordering = ('-environment__webapp__created_at', '-environment__webapp__id')
+
 
+class DeploymentLogViewSet(ReplicaReadMixin, TenantScopedMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Cursor-paginated log history (newest first), filterable with
+    ?instance=<id>, ?webapp=<id>, ?level= and ?stage=.
 
-class DeploymentLogViewSet(viewsets.ReadOnlyModelViewSet):
+    Narrowed to one instance (?instance= or ?webapp=), the pages include
+    the lines compacted into its archive; the tenant-wide list only has
+    the live rows.
+    """
     queryset = DeploymentLog.objects.all()
     serializer_class = DeploymentLogSerializer
     permission_classes = [AllowAny]
+    pagination_class = DeploymentLogCursorPagination
+    tenant_path = 'instance__environment__webapp__'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        instance_id = self.request.query_params.get('instance')
+        webapp_id = self.request.query_params.get('webapp')
+        try:
+            if instance_id:
+                queryset = queryset.filter(instance_id=instance_id)
+            if webapp_id:
+                queryset = queryset.filter(instance__environment__webapp_id=webapp_id)
+        except ValidationError:
+            raise serializers.ValidationError({"detail": "Invalid instance or webapp id"})
+        for field, values in log_filters(self.request.query_params).items():
+            queryset = queryset.filter(**{f"{field}__in": values})
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        if not (params.get('instance') or params.get('webapp')):
+            return super().list(request, *args, **kwargs)
+
+        lookups = tenant_filter(*self.tenant, path='environment__webapp__')
+        if params.get('instance'):
+            lookups['pk'] = params['instance']
+        if params.get('webapp'):
+            lookups['environment__webapp_id'] = params['webapp']
+        try:
+            instance = Instance.objects.select_related('log_archive').filter(**lookups).first()
+        except ValidationError:
+            raise serializers.ValidationError({"detail": "Invalid instance or webapp id"})
+        filters = log_filters(params)
+
+        def fetch(before=None, after=None, limit=None):
+            if instance is None:
+                return []
+            if after:
+                return instance_logs(instance, after, limit, filters)
+            return instance_logs_before(instance, before, limit, filters)
+
+        paginator = InstanceLogPagination()
+        logs = paginator.paginate_lines(fetch, request)
+        return paginator.get_paginated_response(log_rows(logs))
@@ -1,5 +1,8 @@
 """
 Django ASGI config for kuberns project.
+
+Required for the streaming /api/webapps/{id}/events/ endpoint:
+    uvicorn kuberns.asgi:application
 """
 
 import os
@@ -7,5 +10,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kuberns.settings')
+# Under ASGI each request's sync ORM work runs in a fresh executor thread, so a
+# persistent connection is never reused by a later request and just stays open
+# (Django ticket #33497). Connect per request here, through PgBouncer under load.
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import worker_process_shutdown
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kuberns.settings')
 
@@ -7,6 +8,16 @@ app = Celery('kuberns')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
+# Celery's Django fixup already drops connections inherited across the fork
+# (worker_process_init) and closes obsolete or broken ones around every task
+# (task_prerun/task_postrun), which is what makes DB_CONN_MAX_AGE apply to
+# workers. What it leaves open is a child's persistent connection when the
+# child exits (e.g. --max-tasks-per-child), until Postgres notices the socket.
+@worker_process_shutdown.connect
+def close_db_connections(**kwargs):
+    from django.db import connections
+    connections.close_all()
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
@@ -6,6 +6,8 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 import dj_database_url
+from celery.schedules import crontab
+from corsheaders.defaults import default_headers
 
 load_dotenv()
 
@@ -36,6 +38,7 @@ except Exception:
     pass
 
 MIDDLEWARE = [
+    'apps.core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
 
@@ -70,27 +73,54 @@ WSGI_APPLICATION = 'kuberns.wsgi.application'
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Database connections stay open for DB_CONN_MAX_AGE seconds and are reused by later
+# requests and Celery tasks (0 reconnects every time), checked before reuse.
+# DB_POOL_MODE=pgbouncer is for a transaction-pooling PgBouncer in front of Postgres:
+# server-side cursors do not survive transaction pooling, so they are disabled.
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 600))
+DB_CONN_HEALTH_CHECKS = os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+DB_POOL_MODE = os.getenv('DB_POOL_MODE', '')
+
 if DATABASE_URL:
     DATABASES = {
         "default": dj_database_url.parse(
             DATABASE_URL,
-            conn_max_age=600,
+            conn_max_age=DB_CONN_MAX_AGE,
+            conn_health_checks=DB_CONN_HEALTH_CHECKS,
+            disable_server_side_cursors=DB_POOL_MODE == 'pgbouncer',
             ssl_require=False
         )
     }
 
 else:
-    
-   DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': os.getenv('DB_NAME'),
-        'USER': os.getenv('DB_USER'),
-        'PASSWORD': os.getenv('DB_PASSWORD'),
-        'HOST': os.getenv('DB_HOST'),
-        'PORT': os.getenv('DB_PORT'),
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME'),
+            'USER': os.getenv('DB_USER'),
+            'PASSWORD': os.getenv('DB_PASSWORD'),
+            'HOST': os.getenv('DB_HOST'),
+            'PORT': os.getenv('DB_PORT'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': DB_CONN_HEALTH_CHECKS,
+            'DISABLE_SERVER_SIDE_CURSORS': DB_POOL_MODE == 'pgbouncer',
+        }
     }
-}
+
+# Optional read replica (streaming replica of the primary, or a PgBouncer in front of
+# one). Read-only API actions query it; a client that has just written reads from the
+# primary for REPLICA_PIN_SECONDS, which should cover the replication lag.
+DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL')
+if DATABASE_REPLICA_URL:
+    DATABASES['replica'] = dj_database_url.parse(
+        DATABASE_REPLICA_URL,
+        conn_max_age=DB_CONN_MAX_AGE,
+        conn_health_checks=DB_CONN_HEALTH_CHECKS,
+        disable_server_side_cursors=DB_POOL_MODE == 'pgbouncer',
+        test_options={'MIRROR': 'default'},
+    )
+DATABASE_ROUTERS = ['apps.core.replicas.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -114,15 +144,19 @@ try:
     import drf_spectacular  
     REST_FRAMEWORK = {
         'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
-        'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+        'DEFAULT_PAGINATION_CLASS': 'apps.core.pagination.KeysetPageNumberPagination',
         'PAGE_SIZE': 10,
     }
 except Exception:
     REST_FRAMEWORK = {
-        'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+        'DEFAULT_PAGINATION_CLASS': 'apps.core.pagination.KeysetPageNumberPagination',
         'PAGE_SIZE': 10,
     }
 
+# Paginated lists count exactly up to this many rows; above it they report
+# Postgres' estimate (or no count on other databases). 0 always counts exactly.
+PAGINATION_EXACT_COUNT_LIMIT = int(os.getenv('PAGINATION_EXACT_COUNT_LIMIT', 10000))
+
 
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:5173',
@@ -133,6 +167,11 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Conditional polling (/webapps/{id}/progress/) sends If-None-Match and reads ETag;
+# retried creates send Idempotency-Key and read Idempotent-Replayed
+CORS_ALLOW_HEADERS = (*default_headers, 'if-none-match', 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['ETag', 'Idempotent-Replayed']
+
 
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
@@ -142,6 +181,115 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+# Deployment stages carry a plan priority (0 = first) and run on per-region
+# queues (deployments.<region>); prefetch one message so priorities are honoured.
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+
+# Deployment status/log events pushed to /webapps/{id}/events/ ('redis' or 'memory')
+DEPLOYMENT_EVENTS_BACKEND = os.getenv('DEPLOYMENT_EVENTS_BACKEND', 'redis')
+DEPLOYMENT_EVENTS_URL = os.getenv('DEPLOYMENT_EVENTS_URL', CELERY_BROKER_URL)
+
+# The status payload of every deployment is written through to this cache by the
+# pipeline and read by /webapps/{id}/status/; it must be shared by web and workers
+# (tenant_counts too, so a create in one web process invalidates every process's count)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'deployment_status': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('DEPLOYMENT_STATUS_CACHE_URL', 'redis://localhost:6379/1'),
+    },
+    'tenant_counts': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('TENANT_COUNT_CACHE_URL', 'redis://localhost:6379/1'),
+    },
+}
+DEPLOYMENT_STATUS_CACHE_TIMEOUT = int(os.getenv('DEPLOYMENT_STATUS_CACHE_TIMEOUT', 3600))
+
+# Per-tenant row counts of the paginated list endpoints; dropped on create/delete,
+# so the timeout only bounds drift from writes made outside the API
+TENANT_COUNT_CACHE_TIMEOUT = int(os.getenv('TENANT_COUNT_CACHE_TIMEOUT', 300))
+
+# Deployment log lines are written in batches of this size, or once the oldest
+# buffered line is this many seconds old, and always before a status change
+DEPLOYMENT_LOG_BUFFER_SIZE = int(os.getenv('DEPLOYMENT_LOG_BUFFER_SIZE', 50))
+DEPLOYMENT_LOG_FLUSH_INTERVAL = float(os.getenv('DEPLOYMENT_LOG_FLUSH_INTERVAL', 2))
+
+# Seconds to wait after each deployment stage before running the next one.
+# DEPLOYMENT_TIME_SCALE compresses the whole pipeline (0 runs it back to back).
+DEPLOYMENT_STAGE_DELAYS = {
+    'received': 1,
+    'deploying': 3,
+    'provisioning': 5,
+    'ec2': 2,
+}
+DEPLOYMENT_TIME_SCALE = float(os.getenv('DEPLOYMENT_TIME_SCALE', 1))
+
+# Provisioning backend: MockProvisioner (fake IPs) or AsyncEC2Provisioner (boto3)
+DEPLOYMENT_PROVISIONER = os.getenv('DEPLOYMENT_PROVISIONER', 'apps.core.provisioning.MockProvisioner')
+EC2_AMI_IDS = {
+    'us-east-1': os.getenv('EC2_AMI_US_EAST_1', ''),
+    'us-west-2': os.getenv('EC2_AMI_US_WEST_2', ''),
+    'eu-central-1': os.getenv('EC2_AMI_EU_CENTRAL_1', ''),
+}
+# EC2 API calls in flight per region, shared by all workers through leases in
+# the scheduler's Redis (a crashed worker's lease expires after EC2_SLOT_LEASE)
+EC2_MAX_IN_FLIGHT = int(os.getenv('EC2_MAX_IN_FLIGHT', 10))
+EC2_SLOT_LEASE = int(os.getenv('EC2_SLOT_LEASE', 60))
+EC2_MAX_BATCH = int(os.getenv('EC2_MAX_BATCH', 50))
+EC2_MAX_RETRIES = int(os.getenv('EC2_MAX_RETRIES', 5))
+# A launched instance is checked for its public IP every EC2_IP_POLL_INTERVAL
+# seconds (a Celery countdown, not a sleep) and fails after EC2_IP_TIMEOUT
+EC2_IP_POLL_INTERVAL = float(os.getenv('EC2_IP_POLL_INTERVAL', 2))
+EC2_IP_TIMEOUT = int(os.getenv('EC2_IP_TIMEOUT', 300))
+
+# Logs of finished deployments are compacted into one compressed archive per
+# instance this many seconds after the deployment ends ('gzip' or 'zstd', which
+# needs the zstandard package). Per-plan retention lives in apps.core.plans.
+DEPLOYMENT_LOG_COMPACT_AFTER = int(os.getenv('DEPLOYMENT_LOG_COMPACT_AFTER', 3600))
+DEPLOYMENT_LOG_COMPACT_BATCH = int(os.getenv('DEPLOYMENT_LOG_COMPACT_BATCH', 200))
+DEPLOYMENT_LOG_ARCHIVE_COMPRESSION = os.getenv('DEPLOYMENT_LOG_ARCHIVE_COMPRESSION', 'gzip')
+
+# Run with: celery -A kuberns beat -l info
+CELERY_BEAT_SCHEDULE = {
+    'compact-deployment-logs': {
+        'task': 'apps.core.tasks.compact_deployment_logs',
+        'schedule': crontab(minute='*/15'),
+    },
+    'enforce-deployment-log-retention': {
+        'task': 'apps.core.tasks.enforce_log_retention',
+        'schedule': crontab(hour=3, minute=30),
+    },
+}
+
+# Deployment admission control: in-flight deployments allowed per region and per
+# owner (0 disables a limit), held as Redis leases that expire after
+# DEPLOYMENT_SLOT_LEASE seconds; throttled deployments retry every
+# DEPLOYMENT_ADMISSION_RETRY seconds
+DEPLOYMENT_SCHEDULER_URL = os.getenv('DEPLOYMENT_SCHEDULER_URL', CELERY_BROKER_URL)
+DEPLOYMENT_MAX_IN_FLIGHT_PER_REGION = int(os.getenv('DEPLOYMENT_MAX_IN_FLIGHT_PER_REGION', 50))
+DEPLOYMENT_MAX_IN_FLIGHT_PER_OWNER = int(os.getenv('DEPLOYMENT_MAX_IN_FLIGHT_PER_OWNER', 10))
+DEPLOYMENT_SLOT_LEASE = int(os.getenv('DEPLOYMENT_SLOT_LEASE', 30 * 60))
+DEPLOYMENT_ADMISSION_RETRY = float(os.getenv('DEPLOYMENT_ADMISSION_RETRY', 5))
+
+# Client cache lifetime (seconds) for GET /api/metadata/, revalidated by ETag
+METADATA_MAX_AGE = int(os.getenv('METADATA_MAX_AGE', 3600))
+
+# Maximum number of apps accepted by POST /api/webapps/bulk/
+WEBAPP_BULK_CREATE_LIMIT = int(os.getenv('WEBAPP_BULK_CREATE_LIMIT', 500))
+
+# Prometheus metrics at /metrics (request latency, DB queries, response size and
+# deployment stage durations). Stage durations are recorded by Celery workers and
+# shared through this Redis URL; set it empty to keep them in process memory.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_SHARED_URL = os.getenv('METRICS_SHARED_URL', CELERY_BROKER_URL)
 
 
 LOGGING = {
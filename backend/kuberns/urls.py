@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from apps.core.metrics import metrics
+
 try:
     from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
@@ -16,3 +18,7 @@ except ImportError:
         path('admin/', admin.site.urls),
         path('api/', include('apps.core.urls')),
     ]
+
+urlpatterns += [
+    path('metrics', metrics, name='metrics'),
+]
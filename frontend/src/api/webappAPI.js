@@ -7,6 +7,9 @@ const apiClient = axios.create({
   headers: {
     'Content-Type': 'application/json',
   },
+  // Carries the backend's read-your-writes cookie, so right after creating an
+  // app this client's reads are not served from a lagging read replica
+  withCredentials: true,
 })
 
 export const webAppAPI = {
@@ -56,6 +59,30 @@ export const webAppAPI = {
       throw error.response?.data || error.message
     }
   },
+
+  // Status + new log lines since `after` in one call; resolves to null on 304
+  getWebAppProgress: async (id, after, etag) => {
+    try {
+      const response = await apiClient.get(`/webapps/${id}/progress/`, {
+        params: after ? { after } : {},
+        headers: etag ? { 'If-None-Match': etag } : {},
+        validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+      })
+      if (response.status === 304) return null
+      return { data: response.data, etag: response.headers.etag }
+    } catch (error) {
+      throw error.response?.data || error.message
+    }
+  },
+
+  // Server-sent events: pushes status transitions and new log lines
+  subscribeToDeployment: (id, { onStatus, onLog, onError }) => {
+    const source = new EventSource(`${API_BASE_URL}/webapps/${id}/events/`)
+    source.addEventListener('status', (event) => onStatus(JSON.parse(event.data)))
+    source.addEventListener('log', (event) => onLog(JSON.parse(event.data)))
+    source.onerror = onError
+    return source
+  },
 }
 
 export default apiClient
@@ -15,35 +15,61 @@ export default function Page3() {
   useEffect(() => {
     if (!id) return
 
-    const interval = setInterval(() => {
-      loadStatus()
-      loadLogs()
-    }, 2000)
-
-    loadStatus()
-    loadLogs()
-
-    return () => clearInterval(interval)
-  }, [id])
+    let interval = null
+    let finished = false
+    let cursor = null
+    let etag = null
+
+    const appendLogs = (newLogs) =>
+      setLogs((prev) => {
+        const seen = new Set(prev.map((l) => l.id))
+        return [...prev, ...newLogs.filter((l) => !seen.has(l.id))]
+      })
+
+    const finish = () => {
+      finished = true
+      source.close()
+      clearInterval(interval)
+    }
 
-  const loadStatus = async () => {
-    try {
-      const res = await webAppAPI.getWebAppStatus(id)
-      setStatus(res.instance_status)
-      setIp(res.public_ip)
-    } catch (err) {
-      console.error('STATUS ERROR:', err)
+    // One request: status, IP and only the log lines after `cursor`
+    const loadProgress = async () => {
+      try {
+        const res = await webAppAPI.getWebAppProgress(id, cursor, etag)
+        if (!res) return // 304: nothing changed since the last poll
+
+        etag = res.etag
+        cursor = res.data.cursor
+        setStatus(res.data.instance_status)
+        setIp(res.data.public_ip)
+        appendLogs(res.data.logs)
+        if (res.data.instance_status === 'active' || res.data.instance_status === 'failed') finish()
+      } catch (err) {
+        console.error('PROGRESS ERROR:', err)
+      }
     }
-  }
-
-  const loadLogs = async () => {
-    try {
-      const res = await webAppAPI.getWebAppLogs(id)
-      setLogs(res.logs)
-    } catch (err) {
-      console.error('LOGS ERROR:', err)
+
+    const source = webAppAPI.subscribeToDeployment(id, {
+      onStatus: (data) => {
+        setStatus(data.status)
+        setIp(data.public_ip)
+        if (data.status === 'active' || data.status === 'failed') finish()
+      },
+      onLog: (log) => appendLogs([log]),
+      // Fall back to polling if the event stream is unavailable
+      onError: () => {
+        source.close()
+        if (!finished && !interval) interval = setInterval(loadProgress, 2000)
+      },
+    })
+
+    loadProgress()
+
+    return () => {
+      source.close()
+      clearInterval(interval)
     }
-  }
+  }, [id])
 
   const steps = [
     { id: 'pending', label: 'Waiting', icon: Loader2 },
@@ -90,7 +116,7 @@ export default function Page3() {
 
         {logs.map((log) => (
           <pre key={log.id} className="text-sm">
-            {log.timestamp} - {log.message}
+            {log.timestamp} - [{log.level.toUpperCase()}] {log.message}
           </pre>
         ))}
       </div>